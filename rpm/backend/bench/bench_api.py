@@ -0,0 +1,541 @@
+"""End-to-end load benchmark for the Flask API with a stubbed LLM and Mongo.
+
+Starts the backend in-process on a threaded HTTP server, pointed at the
+local DeepSeek stub (bench/stub_deepseek.py) and at either a throwaway
+mongod or an in-memory stand-in (mongomock), seeds users, then replays a
+weighted traffic mix across login, user status, tutor, admin user listing
+and static assets at each concurrency level:
+
+    python bench/bench_api.py --mix default --concurrency 1 8 32 --duration 15 \
+        --output results/api-$(git rev-parse --short HEAD).json
+
+    python bench/bench_api.py --mongo-uri mongodb://127.0.0.1:27017 --reset \
+        --llm-latency 0.8 --completion-tokens 300 --mix tutor
+
+Mixes are named (see MIXES) or given as weights, e.g. --mix status=5,tutor=1.
+Each level reports throughput and p50/p95/p99 latency overall and per
+endpoint, plus Mongo round trips per request taken from /api/metrics.
+Startup is reported too: import and create_app() time, warm-up time and
+the latency of the first request to each endpoint on a fresh process
+(--no-app-warm-up shows what warm-up saves).
+--baseline prints throughput and p95 changes against an earlier result file.
+
+Load is generated by threads in the same process as the server, so
+absolute numbers are pessimistic; compare runs on the same machine.
+"""
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.stub_deepseek import start_stub_server
+
+ENDPOINTS = ('login', 'status', 'tutor', 'admin_users', 'static')
+ROUTES = {
+    'login': ['/api/auth/login'],
+    'status': ['/api/user/status'],
+    'tutor': ['/api/tutor'],
+    'admin_users': ['/api/admin/users'],
+    'static': ['/', '/<path:path>']
+}
+MIXES = {
+    # Mostly page loads and status polling, with some tutoring
+    'default': {'login': 2, 'status': 35, 'tutor': 10, 'admin_users': 3, 'static': 50},
+    'tutor': {'login': 2, 'status': 28, 'tutor': 60, 'static': 10},
+    'browse': {'login': 5, 'status': 45, 'static': 50},
+    'admin': {'status': 30, 'admin_users': 70}
+}
+PASSWORD = 'bench-password'
+TOPICS = ('Calculus', 'Linear Algebra', 'Organic Chemistry', 'World History', 'Python Programming')
+QUESTIONS = (
+    'Can you explain {} step by step?',
+    'What is the intuition behind {}?',
+    'Give me a practice problem about {} and walk through the solution.',
+    'How does {} relate to what I learned last week?',
+    'What are common mistakes students make with {}?'
+)
+SUBJECTS = ('derivatives', 'eigenvalues', 'reaction mechanisms', 'the French Revolution', 'recursion',
+            'integration by parts', 'matrix rank', 'stereochemistry', 'the industrial revolution', 'generators')
+METRIC_SAMPLE = re.compile(r'^rpm_http_request_mongo_commands_(sum|count)\{route="([^"]*)"\} (\S+)$', re.M)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {'p50_ms': None, 'p95_ms': None, 'p99_ms': None}
+    last = len(samples) - 1
+    return {
+        'p50_ms': round(samples[int(last * 0.50)] * 1000, 2),
+        'p95_ms': round(samples[int(last * 0.95)] * 1000, 2),
+        'p99_ms': round(samples[int(last * 0.99)] * 1000, 2)
+    }
+
+
+def parse_mix(text):
+    if text in MIXES:
+        return dict(MIXES[text])
+    weights = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in ENDPOINTS:
+            raise ValueError(f"unknown endpoint {name.strip()!r}; expected one of {', '.join(ENDPOINTS)}")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def configure(args, llm_url):
+    """Point the backend's config at the benchmark's Mongo and LLM stub; must run before importing src.main"""
+    if args.mongo_uri is None:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit('mongomock is not installed; pip install mongomock or pass --mongo-uri')
+        import pymongo
+        pymongo.MongoClient = mongomock.MongoClient
+
+    from src.config import get_config
+    config = get_config()
+    config.MONGODB_URI = args.mongo_uri or 'mongodb://in-memory'
+    config.DEEPSEEK_BASE_URL = llm_url
+    config.DEEPSEEK_API_KEY = 'bench'
+    config.DAILY_CREDIT_LIMIT = args.credit_limit
+    config.ENSURE_INDEXES_ON_START = False  # Population creates them before seeding
+    if args.bcrypt_rounds:
+        config.BCRYPT_ROUNDS = args.bcrypt_rounds
+    if args.mongo_uri is None:
+        count_mock_round_trips(mongomock)
+
+
+def count_mock_round_trips(mongomock):
+    """Count each mongomock collection call as one round trip in the request's metrics trace"""
+    # mongomock bypasses pymongo's command monitoring. One call is one
+    # command here, except that cursors are counted once however many
+    # batches a real server would need.
+    from src import metrics
+
+    depth = threading.local()
+
+    def counted(method):
+        def wrapper(*args, **kwargs):
+            outer = not getattr(depth, 'value', 0)
+            depth.value = getattr(depth, 'value', 0) + 1
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                depth.value -= 1
+                trace = metrics._trace.get()
+                if outer and trace is not None:
+                    trace.mongo_count += 1
+                    trace.mongo_seconds += time.perf_counter() - started
+        return wrapper
+
+    for name in ('find', 'find_one', 'insert_one', 'insert_many', 'update_one', 'update_many',
+                 'replace_one', 'delete_one', 'delete_many', 'count_documents', 'aggregate',
+                 'bulk_write', 'find_one_and_update', 'find_one_and_delete', 'distinct'):
+        setattr(mongomock.Collection, name, counted(getattr(mongomock.Collection, name)))
+
+
+def write_static_build(root, js_kb=180, css_kb=24):
+    """A small synthetic frontend build: index.html plus hashed JS/CSS bundles"""
+    from src.static_assets import build
+
+    os.makedirs(os.path.join(root, 'assets'), exist_ok=True)
+    rng = random.Random(7)
+    words = ['const', 'function', 'return', 'props', 'state', 'render', 'useEffect', 'className']
+    js = ' '.join(rng.choice(words) + str(rng.randrange(100)) for _ in range(js_kb * 100))
+    css = '\n'.join(f'.c{i} {{ margin: {i % 16}px; color: #{i % 4096:03x}; }}' for i in range(css_kb * 30))
+    with open(os.path.join(root, 'assets', 'index-B3nchJ5a.js'), 'w') as f:
+        f.write(js)
+    with open(os.path.join(root, 'assets', 'index-C7ssBnc4.css'), 'w') as f:
+        f.write(css)
+    with open(os.path.join(root, 'index.html'), 'w') as f:
+        f.write('<!doctype html><html><head><link rel="stylesheet" href="/assets/index-C7ssBnc4.css">'
+                '<script type="module" src="/assets/index-B3nchJ5a.js"></script></head>'
+                '<body><div id="root"></div></body></html>')
+    build(root)
+    return ['', 'assets/index-B3nchJ5a.js', 'assets/index-C7ssBnc4.css', 'dashboard']
+
+
+class Population:
+    """Seeded accounts and their tokens"""
+
+    def __init__(self, args, rng):
+        from src import database
+        from src.indexes import ensure_indexes
+
+        if args.reset:
+            database.mongo.client.drop_database(database.mongo.db_name)
+        elif database.users_collection.estimated_document_count():
+            sys.exit(f'{database.mongo.db_name} already has users; point --mongo-uri at a scratch mongod and pass --reset')
+        ensure_indexes()
+        if args.mongo_uri is None:
+            # mongomock ignores partialFilterExpression, so this index would
+            # reject every password account after the first as a null google_id
+            database.users_collection.drop_index('google_id_unique')
+
+        # Password accounts cost a bcrypt hash each to create, so only a few
+        # of them serve the login traffic; the rest sign up through Google
+        self.logins = []
+        for i in range(args.login_accounts):
+            email = f'bench-login-{i}@example.com'
+            user_id = database.User.create_manual_user(email, PASSWORD, f'Login {i}')
+            database.User.whitelist_user(user_id)
+            self.logins.append(email)
+
+        ids = [database.User.create_user(f'bench-google-{i}', f'bench-{i}@example.com', f'User {i}')
+               for i in range(args.users)]
+        for user_id in ids:
+            database.User.update_profile(user_id, rng.choice(['high_school', 'undergraduate', 'graduate']),
+                                         rng.choice(TOPICS), 'Improve understanding')
+        whitelisted = rng.sample(ids, max(1, int(len(ids) * args.whitelisted)))
+        database.User.bulk_whitelist(whitelisted)
+        admin_id = whitelisted[0]
+        database.User.make_admin(admin_id)
+
+        def token(user_id):
+            return database.issue_tokens(database.User.find_by_id(user_id))['token']
+        self.tokens = [token(user_id) for user_id in ids]
+        self.whitelisted_tokens = [token(user_id) for user_id in whitelisted]
+        self.admin_token = token(admin_id)
+
+
+class Client:
+    """One simulated user agent with a persistent connection"""
+
+    def __init__(self, host, port, population, static_paths, rng):
+        self.host = host
+        self.port = port
+        self.population = population
+        self.static_paths = static_paths
+        self.rng = rng
+        self.conn = None
+        self.session_id = None
+        self.token = None
+        self.etags = {}
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=120)
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                payload = response.read()
+                if response.getheader('Connection', '').lower() == 'close':
+                    self.conn.close()
+                    self.conn = None
+                return response.status, response.getheader('ETag'), payload
+            except (http.client.HTTPException, ConnectionError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+    def auth(self, token):
+        return {'Authorization': f'Bearer {token}'}
+
+    def login(self):
+        email = self.rng.choice(self.population.logins)
+        return self.request('POST', '/api/auth/login', {'email': email, 'password': PASSWORD})[0]
+
+    def status(self):
+        return self.request('GET', '/api/user/status', headers=self.auth(self.rng.choice(self.population.tokens)))[0]
+
+    def tutor(self):
+        body = {
+            'message': self.rng.choice(QUESTIONS).format(self.rng.choice(SUBJECTS)),
+            'topic': self.rng.choice(TOPICS)
+        }
+        # Half of the questions follow up in the client's previous session
+        if self.session_id and self.rng.random() < 0.5:
+            body['session_id'] = self.session_id
+        else:
+            self.token = self.rng.choice(self.population.whitelisted_tokens)
+        status, _, payload = self.request('POST', '/api/tutor', body, self.auth(self.token))
+        if status == 200:
+            self.session_id = json.loads(payload).get('session_id')
+        return status
+
+    def admin_users(self):
+        query = f"limit=50&page={self.rng.randint(1, 5)}&filter={self.rng.choice(['all', 'waitlist', 'whitelisted'])}"
+        return self.request('GET', f'/api/admin/users?{query}', headers=self.auth(self.population.admin_token))[0]
+
+    def static(self):
+        path = self.rng.choice(self.static_paths)
+        headers = {'Accept-Encoding': 'gzip, br'}
+        # Returning browsers revalidate what they already have
+        if path in self.etags and self.rng.random() < 0.5:
+            headers['If-None-Match'] = self.etags[path]
+        status, etag, _ = self.request('GET', '/' + path, headers=headers)
+        if etag:
+            self.etags[path] = etag
+        return status
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
+
+def scrape_round_trips(host, port):
+    """Per-route (sum, count) of Mongo commands per request from /api/metrics"""
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    conn.request('GET', '/api/metrics')
+    text = conn.getresponse().read().decode('utf-8')
+    conn.close()
+    totals = {}
+    for kind, route, value in METRIC_SAMPLE.findall(text):
+        totals.setdefault(route, [0.0, 0.0])[0 if kind == 'sum' else 1] = float(value)
+    return totals
+
+
+def run_level(host, port, population, static_paths, weights, concurrency, duration, warmup, seed):
+    names = [name for name in ENDPOINTS if weights.get(name)]
+    cumulative = [weights[name] for name in names]
+    samples = {name: [] for name in names}
+    statuses = {name: {} for name in names}
+    errors = []
+    lock = threading.Lock()
+    measuring = threading.Event()
+    stop = threading.Event()
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        client = Client(host, port, population, static_paths, rng)
+        try:
+            while not stop.is_set():
+                name = rng.choices(names, cumulative)[0]
+                t0 = time.perf_counter()
+                try:
+                    status = getattr(client, name)()
+                except Exception as e:
+                    status = 'error'
+                    with lock:
+                        errors.append(f'{name}: {e}')
+                elapsed = time.perf_counter() - t0
+                if measuring.is_set():
+                    with lock:
+                        samples[name].append(elapsed)
+                        statuses[name][str(status)] = statuses[name].get(str(status), 0) + 1
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    time.sleep(warmup)
+    before = scrape_round_trips(host, port)
+    measuring.set()
+    started = time.perf_counter()
+    time.sleep(duration)
+    measuring.clear()
+    elapsed = time.perf_counter() - started
+    after = scrape_round_trips(host, port)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    endpoints = {}
+    for name in names:
+        # Scrapes bracket the measured window, so in-flight requests at its
+        # edges can shift the round-trip averages slightly
+        db_sum = db_count = 0.0
+        for route in ROUTES[name]:
+            total, count = after.get(route, (0.0, 0.0))
+            base_total, base_count = before.get(route, (0.0, 0.0))
+            db_sum += total - base_total
+            db_count += count - base_count
+        endpoints[name] = dict(
+            percentiles(samples[name]),
+            requests=len(samples[name]),
+            throughput_rps=round(len(samples[name]) / elapsed, 2),
+            db_round_trips_per_request=round(db_sum / db_count, 2) if db_count else None,
+            statuses=statuses[name]
+        )
+    everything = [sample for name in names for sample in samples[name]]
+    return dict(
+        percentiles(everything),
+        concurrency=concurrency,
+        requests=len(everything),
+        throughput_rps=round(len(everything) / elapsed, 2),
+        errors=len(errors),
+        error_examples=errors[:5],
+        endpoints=endpoints
+    )
+
+
+def first_requests(host, port, population, static_paths, seed):
+    """Latency of the first request to each endpoint, in the order a new visitor sends them"""
+    client = Client(host, port, population, static_paths, random.Random(seed))
+    timings = {}
+    for name in ('static', 'login', 'status', 'tutor', 'admin_users'):
+        t0 = time.perf_counter()
+        status = getattr(client, name)()
+        timings[name] = {'ms': round((time.perf_counter() - t0) * 1000, 2), 'status': status}
+    client.close()
+    return timings
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(report, baseline):
+    """Throughput and p95 changes against a baseline result file, per level and endpoint"""
+    levels = {(r['mix'], r['concurrency']): r for r in baseline.get('results', [])}
+
+    def change(new, old):
+        return f'{(new - old) / old * 100:+.1f}%' if new is not None and old else 'n/a'
+
+    lines = [f"vs {baseline.get('commit') or 'baseline'}:"]
+    if baseline.get('startup'):
+        old, new = baseline['startup'], report['startup']
+        lines.append(f"  startup: create_app {change(new['create_app_seconds'], old['create_app_seconds'])}, "
+                     f"warm-up {change(new['warm_up_seconds'], old['warm_up_seconds'])}")
+        for name, first in new['first_requests'].items():
+            if name in old['first_requests']:
+                lines.append(f"    first {name}: {change(first['ms'], old['first_requests'][name]['ms'])}")
+    for result in report['results']:
+        old = levels.get((result['mix'], result['concurrency']))
+        if old is None:
+            continue
+        lines.append(f"  {result['mix']} c={result['concurrency']}: "
+                     f"rps {change(result['throughput_rps'], old['throughput_rps'])}, "
+                     f"p95 {change(result['p95_ms'], old['p95_ms'])}")
+        for name, endpoint in result['endpoints'].items():
+            previous = old['endpoints'].get(name)
+            if previous:
+                lines.append(f"    {name}: p95 {change(endpoint['p95_ms'], previous['p95_ms'])}, "
+                             f"db/req {previous['db_round_trips_per_request']} -> "
+                             f"{endpoint['db_round_trips_per_request']}")
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mix', nargs='+', default=['default'],
+                        help=f"named mix ({', '.join(MIXES)}) or weights like status=5,tutor=1")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--duration', type=float, default=10.0, help='measured seconds per level')
+    parser.add_argument('--warmup', type=float, default=2.0, help='unmeasured seconds before each level')
+    parser.add_argument('--mongo-uri', help='throwaway mongod to use instead of the in-memory stand-in')
+    parser.add_argument('--reset', action='store_true', help='drop the database on --mongo-uri first')
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--login-accounts', type=int, default=8)
+    parser.add_argument('--whitelisted', type=float, default=0.5, help='fraction of users off the waitlist')
+    parser.add_argument('--bcrypt-rounds', type=int, help='override BCRYPT_ROUNDS for the seeded accounts')
+    parser.add_argument('--credit-limit', type=int, default=10 ** 9,
+                        help='daily credits per user; the default keeps tutor calls from hitting 402')
+    parser.add_argument('--llm-latency', type=float, default=0.3)
+    parser.add_argument('--llm-jitter', type=float, default=0.1)
+    parser.add_argument('--llm-fail-rate', type=float, default=0.0)
+    parser.add_argument('--completion-tokens', type=int, default=150)
+    parser.add_argument('--no-app-warm-up', action='store_true', help='skip warm_up() in create_app()')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output')
+    parser.add_argument('--baseline', help='earlier --output file to compare against')
+    args = parser.parse_args()
+    try:
+        mixes = {name: parse_mix(name) for name in args.mix}
+    except ValueError as e:
+        parser.error(str(e))
+
+    _, llm_url = start_stub_server(latency=args.llm_latency, jitter=args.llm_jitter,
+                                   fail_rate=args.llm_fail_rate, completion_tokens=args.completion_tokens)
+    configure(args, llm_url)
+
+    from werkzeug.serving import make_server
+
+    import_started = time.perf_counter()
+    from src import main as backend
+    from src import database
+    import_seconds = time.perf_counter() - import_started
+
+    rng = random.Random(args.seed)
+    seed_started = time.perf_counter()
+    population = Population(args, rng)
+    seed_seconds = time.perf_counter() - seed_started
+    # Start the app as a fresh worker would: no Mongo client (the in-memory
+    # stand-in keeps its data in the client, so it stays), empty caches
+    if args.mongo_uri:
+        database.mongo.close()
+    database.user_cache.clear()
+
+    with tempfile.TemporaryDirectory(prefix='rpm-bench-static-') as static_root:
+        static_paths = write_static_build(static_root)
+        app = backend.create_app(static_folder=static_root, warm=not args.no_app_warm_up)
+        logging.getLogger('werkzeug').setLevel(logging.WARNING)  # No access log per request
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        host, port = server.server_address[:2]
+
+        startup = {
+            'import_seconds': round(import_seconds, 3),
+            'create_app_seconds': round(backend.startup_timings['create_app'], 3),
+            'warm_up_seconds': round(backend.startup_timings.get('warm_up', 0.0), 3),
+            'first_requests': first_requests(host, port, population, static_paths, args.seed)
+        }
+        print(f"startup: import {startup['import_seconds']} s, create_app {startup['create_app_seconds']} s, "
+              f"warm-up {startup['warm_up_seconds']} s", file=sys.stderr)
+
+        results = []
+        for mix_name, weights in mixes.items():
+            for level in args.concurrency:
+                result = run_level(host, port, population, static_paths, weights, level,
+                                   args.duration, args.warmup, args.seed)
+                results.append(dict(result, mix=mix_name, weights=weights))
+                print(f"{mix_name} c={level}: {result['throughput_rps']} rps, "
+                      f"p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms", file=sys.stderr)
+        server.shutdown()
+
+    report = {
+        'benchmark': 'api',
+        'commit': git_commit(),
+        'mongo': 'mongod' if args.mongo_uri else 'mongomock',
+        'settings': {
+            'users': args.users,
+            'whitelisted': args.whitelisted,
+            'login_accounts': args.login_accounts,
+            'llm_latency': args.llm_latency,
+            'llm_jitter': args.llm_jitter,
+            'llm_fail_rate': args.llm_fail_rate,
+            'completion_tokens': args.completion_tokens,
+            'duration': args.duration,
+            'seed': args.seed,
+            'app_warm_up': not args.no_app_warm_up
+        },
+        'seed_seconds': round(seed_seconds, 2),
+        'startup': startup,
+        'results': results
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            f.write(text)
+    print(text)
+    if args.baseline:
+        with open(args.baseline) as f:
+            print(compare(report, json.load(f)), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Drive the LLM gateway against the local stub upstream.
+
+Fires a burst of concurrent completions at a slow and/or failing stub and
+reports accepted, rejected (503) and failed calls plus the gateway's
+queue-depth and latency metrics:
+
+    python bench/bench_llm_gateway.py --clients 64 --latency 1.5 --fail-rate 0.05
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench.stub_deepseek import start_stub_server
+from src.llm_client import DeepSeekClient
+from src.llm_gateway import LLMGateway, GatewayOverloaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--max-in-flight', type=int, default=8)
+    parser.add_argument('--max-queue', type=int, default=16)
+    parser.add_argument('--queue-timeout', type=float, default=5.0)
+    parser.add_argument('--deadline', type=float, default=10.0)
+    parser.add_argument('--latency', type=float, default=1.0)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--stream', action='store_true')
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(latency=args.latency, fail_rate=args.fail_rate)
+    gateway = LLMGateway(
+        DeepSeekClient(api_key='stub', base_url=base_url, pool_size=args.max_in_flight),
+        max_in_flight=args.max_in_flight,
+        max_queue=args.max_queue,
+        queue_timeout=args.queue_timeout,
+        call_deadline=args.deadline
+    )
+    outcomes = {'ok': 0, 'error': 0, 'rejected': 0}
+    lock = threading.Lock()
+    messages = [{'role': 'user', 'content': 'Explain the chain rule.'}]
+
+    def call():
+        try:
+            if args.stream:
+                stream = gateway.stream_chat_completion(messages)
+                result = 'ok'
+                for event in stream:
+                    if event['type'] == 'error':
+                        result = 'error'
+            else:
+                result = 'error' if 'error' in gateway.chat_completion(messages) else 'ok'
+        except GatewayOverloaded:
+            result = 'rejected'
+        with lock:
+            outcomes[result] += 1
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=call) for _ in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(json.dumps({
+        'elapsed_seconds': round(time.monotonic() - started, 3),
+        'outcomes': outcomes,
+        'gateway': gateway.metrics()
+    }, indent=2))
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Login throughput benchmark: p50/p99 for /api/auth/login at several concurrency levels.
+
+Against a running backend (the account must already exist):
+
+    python bench/bench_login.py --url http://127.0.0.1:5000 \
+        --email bench@example.com --password 'bench-password' --concurrency 1 4 16 64
+
+Without a server, --direct measures the PasswordHasher alone, comparing
+inline bcrypt on request threads with the process pool:
+
+    python bench/bench_login.py --direct --concurrency 1 4 16 64 --rounds 12
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    if not samples:
+        return {'p50_ms': None, 'p99_ms': None}
+    last = len(samples) - 1
+    return {
+        'p50_ms': round(samples[int(last * 0.50)] * 1000, 2),
+        'p99_ms': round(samples[int(last * 0.99)] * 1000, 2)
+    }
+
+
+def run_level(concurrency, requests_per_worker, attempt):
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def worker():
+        for _ in range(requests_per_worker):
+            t0 = time.perf_counter()
+            status = attempt()
+            elapsed = time.perf_counter() - t0
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return dict(
+        percentiles(latencies),
+        concurrency=concurrency,
+        requests=len(latencies),
+        throughput_rps=round(len(latencies) / elapsed, 2),
+        statuses=statuses
+    )
+
+
+def http_attempt(url, email, password):
+    body = json.dumps({'email': email, 'password': password}).encode('utf-8')
+
+    def attempt():
+        request = urllib.request.Request(
+            url.rstrip('/') + '/api/auth/login', data=body,
+            headers={'Content-Type': 'application/json'}, method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    return attempt
+
+
+def direct_attempts(rounds, workers):
+    import bcrypt
+    from src.passwords import PasswordHasher
+
+    password = 'bench-password'
+    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds))
+    pooled = PasswordHasher(rounds=rounds, workers=workers, queue_limit=1024, timeout=120)
+
+    def inline():
+        bcrypt.checkpw(password.encode('utf-8'), hashed)
+        return 'inline'
+
+    def pool():
+        pooled.verify(password, hashed)
+        return 'pool'
+    return {'inline': inline, 'pool': pool}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--email')
+    parser.add_argument('--password')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--requests', type=int, default=8, help='requests per worker')
+    parser.add_argument('--direct', action='store_true')
+    parser.add_argument('--rounds', type=int, default=12)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    results = []
+    if args.direct:
+        for mode, attempt in direct_attempts(args.rounds, args.workers).items():
+            for level in args.concurrency:
+                results.append(dict(run_level(level, args.requests, attempt), mode=mode))
+    else:
+        if not (args.email and args.password):
+            parser.error('--email and --password are required unless --direct is given')
+        attempt = http_attempt(args.url, args.email, args.password)
+        for level in args.concurrency:
+            results.append(run_level(level, args.requests, attempt))
+
+    report = json.dumps({'benchmark': 'login', 'rounds': args.rounds, 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
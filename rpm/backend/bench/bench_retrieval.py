@@ -0,0 +1,146 @@
+"""Retrieval micro-benchmark on a synthetic corpus of upload chunks.
+
+Builds a BM25 LexicalIndex and a VectorIndex over N synthetic chunks
+(Zipf-distributed vocabulary plus rare formula/identifier tokens), then
+times BM25 with MaxScore early termination against exhaustive scoring,
+vector search and hybrid fusion for a few query mixes:
+
+    python bench/bench_retrieval.py --chunks 1000000 --queries 200
+
+Embedding is the slowest part of the build; --vector-chunks limits how
+many chunks go into the vector index (default 200000).
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from itertools import accumulate
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.lexical_index import LexicalIndex
+from src.retrieval import fuse
+from src.vector_index import HashingEmbedder, VectorIndex
+
+VOCABULARY = 50000
+IDENTIFIERS = 5000
+CHUNK_TOKENS = 60
+UPLOAD_CHUNKS = 1000
+
+
+class Corpus:
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.words = [f'w{i}' for i in range(VOCABULARY)]
+        self.cumulative = list(accumulate(1 / (i + 1) for i in range(VOCABULARY)))
+        self.identifiers = [f'fn_{i}.x^{i % 7}' for i in range(IDENTIFIERS)]
+
+    def chunk(self):
+        tokens = self.rng.choices(self.words, cum_weights=self.cumulative, k=CHUNK_TOKENS)
+        if self.rng.random() < 0.05:
+            tokens[self.rng.randrange(CHUNK_TOKENS)] = self.rng.choice(self.identifiers)
+        return ' '.join(tokens)
+
+    def query(self, mix):
+        rng = self.rng
+        if mix == 'rare':
+            return ' '.join(rng.choice(self.words[5000:]) for _ in range(2))
+        if mix == 'common':
+            return ' '.join(rng.choice(self.words[:50]) for _ in range(3))
+        if mix == 'identifier':
+            return f'what does {rng.choice(self.identifiers)} do'
+        return ' '.join([rng.choice(self.words[:50]), rng.choice(self.words[50:2000]), rng.choice(self.words[5000:])])
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    last = len(samples) - 1
+    return {
+        'p50_ms': round(samples[int(last * 0.50)] * 1000, 3),
+        'p99_ms': round(samples[int(last * 0.99)] * 1000, 3)
+    }
+
+
+def timed(fn, queries):
+    timings = []
+    for query in queries:
+        t0 = time.perf_counter()
+        fn(query)
+        timings.append(time.perf_counter() - t0)
+    return percentiles(timings)
+
+
+def build(chunks, vector_chunks, path, ivf_min_vectors):
+    corpus = Corpus()
+    embedder = HashingEmbedder()
+    lexical = LexicalIndex()
+    vectors = VectorIndex(path, embedder.dim, ivf_min_vectors=ivf_min_vectors)
+    lexical_seconds = vector_seconds = 0.0
+    for start in range(0, chunks, UPLOAD_CHUNKS):
+        upload_id = f'upload-{start // UPLOAD_CHUNKS}'
+        texts = [corpus.chunk() for _ in range(min(UPLOAD_CHUNKS, chunks - start))]
+        t0 = time.perf_counter()
+        lexical.add(upload_id, 0, texts)
+        lexical_seconds += time.perf_counter() - t0
+        if start < vector_chunks:
+            t0 = time.perf_counter()
+            vectors.add(upload_id, 0, embedder.embed(texts[:vector_chunks - start]))
+            vector_seconds += time.perf_counter() - t0
+    postings = sum(len(ids) for ids, _ in lexical._postings.values())
+    stats = {
+        'lexical_build_seconds': round(lexical_seconds, 1),
+        'vector_build_seconds': round(vector_seconds, 1),
+        'terms': len(lexical._postings),
+        'postings': postings,
+        'postings_mb': round(postings * 6 / 2 ** 20, 1),
+        'vector_rows': len(vectors),
+        'vector_ivf': vectors._state['ivf'] is not None
+    }
+    return corpus, embedder, lexical, vectors, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--chunks', type=int, default=1000000)
+    parser.add_argument('--vector-chunks', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=4)
+    parser.add_argument('--ivf-min-vectors', type=int, default=20000)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    path = tempfile.mkdtemp(prefix='bench-retrieval-')
+    try:
+        corpus, embedder, lexical, vectors, stats = build(args.chunks, args.vector_chunks, path, args.ivf_min_vectors)
+        k = args.k
+        results = []
+        for mix in ('rare', 'mixed', 'common', 'identifier'):
+            queries = [corpus.query(mix) for _ in range(args.queries)]
+
+            def hybrid(query):
+                dense = vectors.search(embedder.embed([query]), k * 4)[0]
+                return fuse(dense, lexical.search(query, k * 4), k)
+
+            results.append({
+                'mix': mix,
+                'bm25_maxscore': timed(lambda q: lexical.search(q, k), queries),
+                'bm25_exhaustive': timed(lambda q: lexical.search(q, k, exhaustive=True), queries),
+                'vector': timed(lambda q: vectors.search(embedder.embed([q]), k), queries),
+                'hybrid': timed(hybrid, queries)
+            })
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+    report = json.dumps({'benchmark': 'retrieval', 'chunks': args.chunks, 'build': stats, 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
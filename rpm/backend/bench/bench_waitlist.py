@@ -0,0 +1,110 @@
+"""Benchmark waitlist ranking at 100k and 1M waitlisted users.
+
+Compares the Fenwick-tree WaitlistRank against a linear count of earlier
+waitlisted users (what count_documents has to do without a usable index),
+and times incremental joins and leaves:
+
+    python bench/bench_waitlist.py --sizes 100000 1000000 --queries 2000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+
+from src.waitlist import WaitlistRank
+
+
+def synthetic_waitlist(n):
+    start = datetime(2025, 1, 1)
+    return [(start + timedelta(seconds=i * 3), ObjectId()) for i in range(n)]
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    last = len(samples) - 1
+    return {
+        'p50_us': round(samples[int(last * 0.50)] * 1e6, 2),
+        'p99_us': round(samples[int(last * 0.99)] * 1e6, 2)
+    }
+
+
+def bench_size(n, queries, linear_queries):
+    users = synthetic_waitlist(n)
+    rank = WaitlistRank(lambda: iter(users))
+
+    started = time.perf_counter()
+    rank.refresh()
+    build_seconds = time.perf_counter() - started
+    footprint = (
+        rank._times.itemsize * len(rank._times) + len(rank._ids)
+        + rank._tree.itemsize * len(rank._tree) + len(rank._active)
+    )
+
+    # Whitelist 10% so positions are not simply slot numbers
+    for created_at, object_id in random.sample(users, n // 10):
+        rank.leave(object_id, created_at)
+
+    sample = random.sample(users, queries)
+    timings = []
+    for created_at, object_id in sample:
+        t0 = time.perf_counter()
+        rank.position(object_id, created_at)
+        timings.append(time.perf_counter() - t0)
+
+    active = rank._active
+    linear = []
+    for created_at, object_id in sample[:linear_queries]:
+        slot = rank._slot(object_id, created_at)
+        t0 = time.perf_counter()
+        sum(active[:slot])
+        linear.append(time.perf_counter() - t0)
+
+    leave_timings = []
+    for created_at, object_id in random.sample(users, queries):
+        t0 = time.perf_counter()
+        rank.leave(object_id)
+        leave_timings.append(time.perf_counter() - t0)
+
+    join_timings = []
+    last = users[-1][0]
+    for i in range(queries):
+        t0 = time.perf_counter()
+        rank.join(ObjectId(), last + timedelta(seconds=i + 1))
+        join_timings.append(time.perf_counter() - t0)
+
+    return {
+        'waitlisted': n,
+        'build_seconds': round(build_seconds, 3),
+        'index_mb': round(footprint / 2 ** 20, 1),
+        'position_fenwick': percentiles(timings),
+        'position_linear_count': percentiles(linear),
+        'leave_by_id': percentiles(leave_timings),
+        'join': percentiles(join_timings)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--linear-queries', type=int, default=50)
+    parser.add_argument('--output')
+    args = parser.parse_args()
+
+    results = [bench_size(n, args.queries, args.linear_queries) for n in args.sizes]
+    report = json.dumps({'benchmark': 'waitlist_rank', 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
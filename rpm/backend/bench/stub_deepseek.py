@@ -0,0 +1,128 @@
+"""Local stand-in for the DeepSeek chat completions API.
+
+Simulates slow and failing upstreams so the LLM gateway, streaming endpoint
+and load benchmarks can run without network access:
+
+    python bench/stub_deepseek.py --port 8089 --latency 2.0 --fail-rate 0.1
+
+Point the backend at it with DEEPSEEK_BASE_URL=http://127.0.0.1:8089.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubSettings:
+    def __init__(self, latency=0.5, jitter=0.0, fail_rate=0.0, completion_tokens=120,
+                 chunk_delay=0.02, chunks=20):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.completion_tokens = completion_tokens
+        self.chunk_delay = chunk_delay
+        self.chunks = chunks
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    settings = StubSettings()
+    requests_served = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        settings = self.settings
+        with StubHandler.lock:
+            StubHandler.requests_served += 1
+
+        time.sleep(max(0.0, settings.latency + random.uniform(-settings.jitter, settings.jitter)))
+        if random.random() < settings.fail_rate:
+            self._send_json(500, {'error': {'message': 'stub upstream failure'}})
+            return
+
+        prompt_tokens = sum(len(m.get('content', '')) for m in request.get('messages', [])) // 4
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': settings.completion_tokens,
+            'total_tokens': prompt_tokens + settings.completion_tokens
+        }
+        words = ['token%d ' % i for i in range(settings.chunks)]
+
+        if not request.get('stream'):
+            self._send_json(200, {
+                'choices': [{'message': {'role': 'assistant', 'content': ''.join(words)}}],
+                'usage': usage
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            for word in words:
+                self._write_chunk({'choices': [{'delta': {'content': word}}]})
+                time.sleep(settings.chunk_delay)
+            self._write_chunk({'choices': [], 'usage': usage})
+            self._write_raw('data: [DONE]\n\n')
+            self.wfile.write(b'0\r\n\r\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def _write_chunk(self, data):
+        self._write_raw('data: %s\n\n' % json.dumps(data))
+
+    def _write_raw(self, text):
+        payload = text.encode('utf-8')
+        self.wfile.write(b'%x\r\n%s\r\n' % (len(payload), payload))
+        self.wfile.flush()
+
+
+def start_stub_server(port=0, **settings):
+    """Start the stub in a daemon thread and return (server, base_url)"""
+    handler = type('ConfiguredStubHandler', (StubHandler,), {'settings': StubSettings(**settings)})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:%d' % server.server_address[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.5)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--completion-tokens', type=int, default=120)
+    parser.add_argument('--chunk-delay', type=float, default=0.02)
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(
+        args.port, latency=args.latency, jitter=args.jitter, fail_rate=args.fail_rate,
+        completion_tokens=args.completion_tokens, chunk_delay=args.chunk_delay
+    )
+    print('Stub DeepSeek API listening on %s' % base_url)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,34 @@
+"""gunicorn settings for the backend, loaded automatically from rpm/backend:
+
+    gunicorn src.wsgi:app
+
+Every value can be overridden with an environment variable of the same
+name in upper case (e.g. WORKER_CLASS=gevent WORKERS=4).
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get('BIND', f"0.0.0.0:{os.environ.get('PORT', 5000)}")
+
+# sync or gthread: one request per thread; gevent: many concurrent requests
+# per worker, mostly waiting on the LLM API (needs `pip install gevent`)
+worker_class = os.environ.get('WORKER_CLASS', 'gthread')
+workers = int(os.environ.get('WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('THREADS', 8))
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 200))
+
+# Streamed tutor replies can take as long as LLM_CALL_DEADLINE
+timeout = int(os.environ.get('TIMEOUT', 90))
+graceful_timeout = int(os.environ.get('GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.environ.get('KEEPALIVE', 5))
+
+# Recycle workers now and then to bound memory growth of the in-process caches
+max_requests = int(os.environ.get('MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.environ.get('MAX_REQUESTS_JITTER', 1000))
+
+# The app must be built after the fork: gevent has to patch the standard
+# library before src is imported, and clients opened in the master would be
+# dropped by every worker anyway
+preload_app = False
+
+accesslog = os.environ.get('ACCESS_LOG', '-')
@@ -0,0 +1,177 @@
+import csv
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+
+from src.config import get_config
+from src.database import AdminJob, User
+from src.retrieval import drop_user
+
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+ADMIN_JOB_CHUNK_SIZE = getattr(config, 'ADMIN_JOB_CHUNK_SIZE', 1000)
+ADMIN_JOB_QUEUE_LIMIT = getattr(config, 'ADMIN_JOB_QUEUE_LIMIT', 4)
+ADMIN_JOB_MAX_TARGETS = getattr(config, 'ADMIN_JOB_MAX_TARGETS', 200000)
+ADMIN_JOB_CHUNK_PAUSE = getattr(config, 'ADMIN_JOB_CHUNK_PAUSE', 0.0)  # Seconds between chunks
+
+ACTIONS = ('whitelist', 'delete')
+CSV_HEADERS = ('id', '_id', 'user_id', 'email')
+
+
+class AdminJobsBusy(Exception):
+    """Raised when too many admin jobs are already queued"""
+
+    def __init__(self, retry_after=30):
+        super().__init__('Admin job queue is full')
+        self.retry_after = retry_after
+
+
+def parse_targets(text):
+    """Split CSV text into user ids and emails; returns (ids, emails, invalid_count)
+
+    Every cell is considered, so a single column, an id,email export or a
+    file with a header row all work. Duplicates are dropped, order is kept.
+    """
+    ids, emails, invalid = {}, {}, 0
+    for row in csv.reader(io.StringIO(text)):
+        for cell in row:
+            cell = cell.strip()
+            if not cell or cell.lower() in CSV_HEADERS:
+                continue
+            if ObjectId.is_valid(cell):
+                ids[cell] = True
+            elif '@' in cell:
+                emails[cell] = True
+            else:
+                invalid += 1
+    return list(ids), list(emails), invalid
+
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class AdminJobRunner:
+    """Background runner for admin operations over many users"""
+
+    # The request only validates and records a job; a single worker per
+    # process then applies it in chunks of chunk_size users, each chunk one
+    # unordered bulk_write, and adds the chunk's outcome to the job document
+    # so admins can poll progress. Jobs run one at a time to keep the write
+    # load on the users collection predictable.
+
+    def __init__(self, queue_limit=ADMIN_JOB_QUEUE_LIMIT, chunk_size=ADMIN_JOB_CHUNK_SIZE,
+                 pause=ADMIN_JOB_CHUNK_PAUSE):
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self._slots = threading.BoundedSemaphore(queue_limit)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created lazily and per process, so pre-forking servers get their own worker
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='admin-job')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def submit(self, action, created_by, next_n=None, user_ids=(), emails=()):
+        """Validate and queue a job; returns its id"""
+        if action not in ACTIONS:
+            raise ValueError(f"action must be one of {', '.join(ACTIONS)}")
+        if action == 'delete':
+            # Never let a bulk delete take out the admin running it
+            user_ids = [user_id for user_id in user_ids if user_id != created_by]
+        if next_n is not None:
+            if action != 'whitelist':
+                raise ValueError('next is only supported for whitelist jobs')
+            if not isinstance(next_n, int) or next_n < 1:
+                raise ValueError('next must be a positive integer')
+            total, source = min(next_n, ADMIN_JOB_MAX_TARGETS), 'waitlist'
+        else:
+            total, source = len(user_ids) + len(emails), 'list'
+            if not total:
+                raise ValueError('No user IDs or emails provided')
+        if total > ADMIN_JOB_MAX_TARGETS:
+            raise ValueError(f'At most {ADMIN_JOB_MAX_TARGETS} users per job')
+
+        if not self._slots.acquire(blocking=False):
+            raise AdminJobsBusy()
+        try:
+            job_id = AdminJob.create(action, source, created_by, total)
+            future = self._get_executor().submit(self.run, job_id, action, total, list(user_ids), list(emails))
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return job_id
+
+    def _chunks(self, total, user_ids, emails):
+        """Yield (user ids, count of targets not found) per chunk"""
+        if not user_ids and not emails:
+            # Each chunk takes the current head of the queue, since the
+            # previous chunk's users have already left it
+            remaining = total
+            while remaining > 0:
+                chunk = User.waitlist_head(min(self.chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk, 0
+            return
+        for chunk in _batches(user_ids, self.chunk_size):
+            yield chunk, 0
+        for chunk in _batches(emails, self.chunk_size):
+            found = User.ids_for_emails(chunk)
+            yield list(found.values()), len(chunk) - len(found)
+
+    def _apply(self, action, user_ids):
+        """Apply an action to one chunk; returns how many users it changed"""
+        if action == 'whitelist':
+            result = User.bulk_whitelist(user_ids)
+            return result.modified_count if result else 0
+        deleted = User.delete_users(user_ids, keep_admins=True)
+        for user in deleted:
+            try:
+                drop_user(str(user['_id']))
+            except OSError:
+                logger.exception('Error dropping indexes of user %s', user['_id'])
+        return len(deleted)
+
+    def run(self, job_id, action, total, user_ids, emails):
+        """Run one job (on the worker thread)"""
+        AdminJob.update(job_id, status='running', started_at=datetime.utcnow())
+        try:
+            for chunk, missing in self._chunks(total, user_ids, emails):
+                errors = [f'{missing} emails not found'] if missing else []
+                try:
+                    changed = self._apply(action, chunk) if chunk else 0
+                except PyMongoError as e:
+                    # Keep going; a rerun with the same targets retries this chunk
+                    AdminJob.record_chunk(job_id, len(chunk) + missing, skipped=missing,
+                                          failed=len(chunk), errors=errors + [str(e)[:500]])
+                else:
+                    AdminJob.record_chunk(job_id, len(chunk) + missing, succeeded=changed,
+                                          skipped=len(chunk) - changed + missing, errors=errors)
+                if self.pause:
+                    time.sleep(self.pause)
+            AdminJob.update(job_id, status='completed', finished_at=datetime.utcnow())
+        except Exception as e:
+            logger.exception('Error running admin job %s', job_id)
+            AdminJob.update(job_id, status='failed', error=str(e), finished_at=datetime.utcnow())
+
+
+admin_jobs = AdminJobRunner()
@@ -0,0 +1,291 @@
+import asyncio
+import inspect
+import math
+import os
+
+from src.cache import TTLCache
+from src.config import get_config
+from src.metrics import mongo_listener
+from src.mongo import MongoConnection
+from src import queries
+
+# asyncio flavour of the request-path models in src/database.py, for an
+# ASGI deployment of the API. Every filter, update and pipeline comes from
+# src/queries.py, so both layers issue the same queries against the same
+# indexes; only the I/O differs. It does not import the sync models, so
+# an ASGI process opens no sync collections. Motor is preferred; PyMongo
+# 4.9+ ships its own asyncio client, which is used when Motor is not
+# installed.
+try:
+    from motor.motor_asyncio import AsyncIOMotorClient as AsyncMongoClient
+except ImportError:
+    try:
+        from pymongo import AsyncMongoClient
+    except ImportError:
+        AsyncMongoClient = None
+
+config = get_config()
+
+# Same settings as the sync layer reads
+MESSAGE_BUCKET_SIZE = getattr(config, 'MESSAGE_BUCKET_SIZE', 50)
+CONTEXT_HISTORY_MESSAGES = getattr(config, 'CONTEXT_HISTORY_MESSAGES', 20)
+CACHE_HIT_CREDIT_RATIO = getattr(config, 'LLM_CACHE_HIT_CREDIT_RATIO', 0.2)
+
+
+class AsyncMongoConnection(MongoConnection):
+    """Async client created on first use in each process and event loop"""
+
+    # An asyncio client is bound to the loop it first ran on, so besides
+    # the fork rule of MongoConnection, a new loop (a test, a worker
+    # restarting its loop) gets a new client. The pool options are shared
+    # with the sync connection.
+
+    _loop = None
+
+    def _current(self, loop):
+        return self._client is not None and self._pid == os.getpid() and self._loop is loop
+
+    @property
+    def client(self):
+        loop = asyncio.get_running_loop()
+        if not self._current(loop):
+            with self._lock:
+                if not self._current(loop):
+                    if AsyncMongoClient is None:
+                        raise RuntimeError('The async data-access layer needs motor (pip install motor)')
+                    self._client = AsyncMongoClient(self.uri, **self.options)
+                    self._pid = os.getpid()
+                    self._loop = loop
+        return self._client
+
+    async def ping(self):
+        return await self.db.command('ping')
+
+    async def close(self):
+        with self._lock:
+            client, pid = self._client, self._pid
+            self._client = None
+        if client is not None and pid == os.getpid():
+            # Motor closes synchronously, PyMongo's async client returns a coroutine
+            result = client.close()
+            if inspect.isawaitable(result):
+                await result
+
+
+mongo = AsyncMongoConnection(config.MONGODB_URI, event_listeners=[mongo_listener])
+
+users_collection = mongo.collection('users')
+sessions_collection = mongo.collection('sessions')
+uploads_collection = mongo.collection('uploads')
+credits_collection = mongo.collection('credits')
+messages_collection = mongo.collection('session_messages')
+usage_collection = mongo.collection('usage_ledger')
+
+# Collections the step generators of src/queries.py address by name
+_step_collections = {c.name: c for c in (usage_collection, sessions_collection, messages_collection)}
+
+# This process's user documents; like the cache in each sync worker, it
+# sees writes made elsewhere once an entry's TTL runs out
+user_cache = TTLCache(
+    maxsize=getattr(config, 'USER_CACHE_SIZE', 10000),
+    ttl=getattr(config, 'USER_CACHE_TTL', 30)
+)
+
+
+async def _execute(operation):
+    """Make one queries.operation call against its collection"""
+    name, method, args, kwargs = operation
+    return await getattr(_step_collections[name], method)(*args, **kwargs)
+
+
+async def run_steps(steps):
+    """Drive a queries step generator with awaited calls and return its result"""
+    result = error = None
+    while True:
+        try:
+            operation = steps.throw(error) if error is not None else steps.send(result)
+        except StopIteration as done:
+            return done.value
+        try:
+            result, error = await _execute(operation), None
+        except Exception as e:
+            result, error = None, e
+
+
+async def _to_list(cursor, length=None):
+    """Drain a cursor from either driver (PyMongo's async aggregate must be awaited first)"""
+    if inspect.isawaitable(cursor):
+        cursor = await cursor
+    return await cursor.to_list(length)
+
+
+class User:
+    @staticmethod
+    async def find_by_id(user_id):
+        """Find user by MongoDB ObjectId, served from the user cache when fresh"""
+        key = str(user_id)
+        user = user_cache.get(key)
+        if user is None:
+            user = await users_collection.find_one(queries.user_by_id(user_id))
+            if user is None:
+                return None
+            user_cache.set(key, user)
+        return dict(user)
+
+    @staticmethod
+    async def find_by_email(email):
+        """Find user by email"""
+        return await users_collection.find_one(queries.user_by_email(email))
+
+
+class Credits:
+    @staticmethod
+    def credits_for_tokens(tokens):
+        """Convert a token count into billable credits"""
+        return queries.credits_for_tokens(tokens, config.TOKENS_PER_CREDIT)
+
+    @staticmethod
+    def credits_for_cache_hit(tokens):
+        """Discounted charge for a reply served from the response cache"""
+        return int(math.ceil(Credits.credits_for_tokens(tokens) * CACHE_HIT_CREDIT_RATIO))
+
+    @staticmethod
+    async def get_credit_status(user_id):
+        """Get current credit status for user"""
+        today = Usage.today()
+        account = await credits_collection.find_one(queries.credit_account(user_id), queries.CREDIT_ACCOUNT_FIELDS) or {}
+        totals = await Usage.user_totals(user_id, today, account.get('archived_through'))
+        return queries.credit_status(account, totals, today, config.DAILY_CREDIT_LIMIT)
+
+    @staticmethod
+    async def reserve_credits(user_id, credits, topic=None):
+        """Atomically check today's balance and hold credits in today's ledger bucket"""
+        return await run_steps(queries.reserve_steps(user_id, credits, Usage.today(), topic, config.DAILY_CREDIT_LIMIT))
+
+    @staticmethod
+    async def commit_credits(reservation, tokens_used, charged=None, cached=False):
+        """Settle a reservation against the real token usage and return the new balance"""
+        if charged is None:
+            charged = Credits.credits_for_tokens(tokens_used)
+        return await run_steps(queries.commit_steps(reservation, tokens_used, charged, cached, config.DAILY_CREDIT_LIMIT))
+
+    @staticmethod
+    async def refund_credits(reservation):
+        """Release a reservation that was never used"""
+        return await usage_collection.update_one(*queries.refund(reservation))
+
+
+class Usage:
+    today = staticmethod(queries.utc_today)
+
+    @staticmethod
+    async def record(user_id, day, credits=0, tokens=0, topic=None, charged=None, cached=False):
+        """Add one settled request to a day bucket; returns the bucket's credits"""
+        return await _execute(queries.record_usage_step(user_id, day, credits, tokens, topic, charged, cached))
+
+    @staticmethod
+    async def user_totals(user_id, today, archived_through=None):
+        """Credits used today and since the last archival, from one indexed aggregation"""
+        pipeline = queries.usage_totals_pipeline(user_id, today, archived_through)
+        return queries.usage_totals(await _to_list(usage_collection.aggregate(pipeline)))
+
+
+class TutoringSession:
+    @staticmethod
+    async def create_session(user_id, topic, content_chunks=None):
+        """Create a new tutoring session"""
+        result = await sessions_collection.insert_one(queries.new_session(user_id, topic, content_chunks))
+        return str(result.inserted_id)
+
+    @staticmethod
+    async def _append_messages(session_id, messages, tokens_used):
+        """Allocate sequence numbers on the session, then write all messages in one bulk_write"""
+        return await run_steps(queries.append_messages_steps(
+            session_id, messages, tokens_used, Credits.credits_for_tokens(tokens_used), MESSAGE_BUCKET_SIZE
+        ))
+
+    @staticmethod
+    async def add_message(session_id, role, content, tokens_used=0):
+        """Add a message to the session"""
+        return await TutoringSession._append_messages(
+            session_id,
+            [{'role': role, 'content': content, 'tokens_used': tokens_used}],
+            tokens_used
+        )
+
+    @staticmethod
+    async def add_turn(session_id, user_content, assistant_content, tokens_used=0):
+        """Add a user message and the assistant reply in one write to the message store"""
+        return await TutoringSession._append_messages(
+            session_id,
+            [
+                {'role': 'user', 'content': user_content, 'tokens_used': 0},
+                {'role': 'assistant', 'content': assistant_content, 'tokens_used': tokens_used}
+            ],
+            tokens_used
+        )
+
+    @staticmethod
+    async def get_messages(session_id, limit=20, before=None):
+        """Get the latest messages of a session, paging backwards with a sequence cursor"""
+        page = queries.MessagePage(limit, before)
+        query = queries.message_page(session_id, before, MESSAGE_BUCKET_SIZE)
+        if query is None:
+            return page.result()
+
+        async for bucket in messages_collection.find(query).sort('bucket', -1).batch_size(2):
+            page.add(bucket)
+            if page.full:
+                break
+        return page.result()
+
+    @staticmethod
+    async def update_summary(session_id, summary, summary_through, expected_through):
+        """Store a rolling summary, unless another request already advanced it"""
+        result = await sessions_collection.update_one(
+            *queries.summary_update(session_id, summary, summary_through, expected_through)
+        )
+        return result.modified_count > 0
+
+    @staticmethod
+    async def get_session(session_id):
+        """Get session by ID (counters only, without message history)"""
+        return await sessions_collection.find_one(queries.session_by_id(session_id), queries.SESSION_FIELDS)
+
+    @staticmethod
+    async def get_user_sessions(user_id, limit=10):
+        """Get user's recent session summaries"""
+        query, projection, sort = queries.user_sessions(user_id)
+        return await _to_list(sessions_collection.find(query, projection).sort(sort).limit(limit))
+
+
+class Upload:
+    @staticmethod
+    async def get_upload(upload_id, user_id=None):
+        """Get an upload's metadata and progress"""
+        return await uploads_collection.find_one(queries.upload_by_id(upload_id, user_id), queries.UPLOAD_FIELDS)
+
+    @staticmethod
+    async def get_user_uploads(user_id):
+        """Get user's uploads"""
+        query, projection, sort = queries.user_uploads(user_id)
+        return await _to_list(uploads_collection.find(query, projection).sort(sort))
+
+
+async def load_tutor_state(user_id, session_id=None, history=CONTEXT_HISTORY_MESSAGES):
+    """Everything a tutoring turn reads before pricing, fetched concurrently
+
+    The user, the credit balance, the session and its recent messages do
+    not depend on each other, so the turn waits for the slowest read
+    instead of their sum. A session owned by someone else comes back as
+    None, like a missing one, and its messages are dropped.
+    """
+    reads = [User.find_by_id(user_id), Credits.get_credit_status(user_id)]
+    if session_id:
+        reads += [TutoringSession.get_session(session_id), TutoringSession.get_messages(session_id, history)]
+    results = await asyncio.gather(*reads)
+
+    session, messages = (results[2], results[3]['messages']) if session_id else (None, [])
+    if session is None or session.get('user_id') != user_id:
+        session, messages = None, []
+    return {'user': results[0], 'credits': results[1], 'session': session, 'messages': messages}
@@ -0,0 +1,73 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+class AuthzVersions:
+    """Tiny in-memory map of recent authorization changes, keyed by user id"""
+
+    # Access tokens carry is_whitelisted/is_admin claims plus the user's
+    # authz_version at issue time. Any change to those flags bumps the version
+    # and logs an event; this map holds the events from the last `window`
+    # seconds (at least the access-token lifetime), polled from Mongo every
+    # refresh_interval. A token whose version is older than the map's entry
+    # has stale claims. Users absent from the map have not changed recently,
+    # so any unexpired token for them is current.
+
+    def __init__(self, loader, window, refresh_interval=5, overlap=2):
+        self.loader = loader
+        self.overlap = overlap
+        self.window = window
+        self.refresh_interval = refresh_interval
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._since = None
+        self._refreshed_at = 0
+
+    def record(self, user_id, version, deleted=False):
+        """Apply a change made by this process (or loaded from the event log)"""
+        with self._lock:
+            current = self._versions.get(user_id)
+            if current is None or version >= current[0]:
+                self._versions[user_id] = (version, deleted, time.monotonic())
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._refreshed_at < self.refresh_interval:
+            return
+        self._refreshed_at = now
+        since = self._since or datetime.utcnow() - timedelta(seconds=self.window)
+        try:
+            # Re-read a short overlap so events stamped by skewed clocks are not missed
+            for event in self.loader(since - timedelta(seconds=self.overlap)):
+                self.record(event['user_id'], event['version'], event.get('deleted', False))
+                self._since = max(self._since or event['at'], event['at'])
+        except Exception:
+            # Without fresh events claims cannot be trusted; force DB checks
+            logger.exception('Error refreshing authorization versions')
+            self._refreshed_at = 0
+            raise
+        if self._since is None:
+            self._since = since
+        cutoff = now - self.window
+        with self._lock:
+            for user_id in [u for u, entry in self._versions.items() if entry[2] < cutoff]:
+                del self._versions[user_id]
+
+    def is_current(self, user_id, version):
+        """Whether claims issued at `version` still reflect the user's authorization"""
+        try:
+            self._refresh()
+        except Exception:
+            return False
+        entry = self._versions.get(user_id)
+        if entry is None:
+            return True
+        return not entry[1] and version >= entry[0]
+
+    def is_deleted(self, user_id):
+        entry = self._versions.get(user_id)
+        return bool(entry and entry[1])
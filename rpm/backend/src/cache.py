@@ -0,0 +1,114 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Bounded, thread-safe LRU cache whose entries expire after a fixed TTL"""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Return a live entry, counting the lookup as a hit or a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        """Store a value, evicting the least recently used entry when full"""
+        ttl = self.ttl if ttl is None else ttl
+        # A ttl of None makes this a plain bounded LRU
+        expires_at = time.monotonic() + ttl if ttl is not None else float('inf')
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        """Drop a single entry if present"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self):
+        """Drop every entry"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Return hit/miss counters for monitoring"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl
+        }
+
+
+class RefreshingCache:
+    """Caches expensive values and refreshes stale ones in the background"""
+
+    # Missing values are computed inline; stale ones are served as-is while a
+    # daemon thread recomputes them, so readers never wait on a refresh.
+
+    def __init__(self, refresh_after=60):
+        self.refresh_after = refresh_after
+        self._values = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key, loader):
+        """Return the cached value for key, loading or scheduling a refresh as needed"""
+        entry = self._values.get(key)
+        if entry is None:
+            value = loader()
+            self._values[key] = (value, time.monotonic())
+            return value
+
+        value, loaded_at = entry
+        if time.monotonic() - loaded_at > self.refresh_after:
+            with self._lock:
+                if key in self._refreshing:
+                    return value
+                self._refreshing.add(key)
+            threading.Thread(target=self._refresh, args=(key, loader), daemon=True).start()
+        return value
+
+    def _refresh(self, key, loader):
+        try:
+            self._values[key] = (loader(), time.monotonic())
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def invalidate(self, key=None):
+        """Force the next read of key (or of everything) to reload"""
+        if key is None:
+            self._values.clear()
+        else:
+            self._values.pop(key, None)
@@ -0,0 +1,86 @@
+import re
+
+from src.config import get_config
+from src.database import TutoringSession
+from src.tokens import token_estimator, MESSAGE_OVERHEAD
+
+config = get_config()
+
+CONTEXT_TOKEN_BUDGET = getattr(config, 'CONTEXT_TOKEN_BUDGET', 3000)
+CONTEXT_HISTORY_MESSAGES = getattr(config, 'CONTEXT_HISTORY_MESSAGES', 20)
+SUMMARY_TOKEN_BUDGET = getattr(config, 'SUMMARY_TOKEN_BUDGET', 400)
+SUMMARY_LINE_CHARS = getattr(config, 'SUMMARY_LINE_CHARS', 160)
+
+
+def _summary_line(message):
+    """Compress a message to its first sentence, attributed to the speaker"""
+    text = ' '.join(message['content'].split())
+    first = re.split(r'(?<=[.!?])\s', text, 1)[0]
+    if len(first) > SUMMARY_LINE_CHARS:
+        first = first[:SUMMARY_LINE_CHARS - 3].rstrip() + '...'
+    speaker = 'Student' if message['role'] == 'user' else 'Tutor'
+    return f'{speaker}: {first}'
+
+
+def _fold_into_summary(summary, messages):
+    """Append folded messages to the summary, dropping its oldest lines past the budget"""
+    lines = summary.split('\n') if summary else []
+    lines.extend(_summary_line(message) for message in messages)
+    while len(lines) > 1 and token_estimator.count('\n'.join(lines)) > SUMMARY_TOKEN_BUDGET:
+        lines.pop(0)
+    return '\n'.join(lines)
+
+
+def build_context(session, system_prompt, message, token_budget=None):
+    """Assemble prompt messages from the rolling summary and recent turns within a token budget"""
+    if not session:
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": message}
+        ]
+
+    session_id = str(session['_id'])
+    summary = session.get('summary', '')
+    summary_through = session.get('summary_through', 0)
+    budget = token_budget or CONTEXT_TOKEN_BUDGET
+
+    # Only the newest window is candidate context, so the cost does not grow with the session
+    window = TutoringSession.get_messages(session_id, CONTEXT_HISTORY_MESSAGES)['messages']
+    recent = [m for m in window if m['seq'] >= summary_through]
+
+    # Messages that slid out of the window since the last fold still have to
+    # reach the summary. Folding keeps up every turn, so this gap is usually
+    # the previous turn's couple of messages.
+    gap = []
+    if window and window[0]['seq'] > summary_through:
+        window_start = window[0]['seq']
+        gap = TutoringSession.get_messages(session_id, window_start - summary_through, window_start)['messages']
+
+    available = budget - token_estimator.count(system_prompt) - token_estimator.count(message)
+    available -= SUMMARY_TOKEN_BUDGET if summary or recent or gap else 0
+
+    selected = []
+    for past in reversed(recent):
+        cost = token_estimator.count(past['content']) + MESSAGE_OVERHEAD
+        if cost > available:
+            break
+        available -= cost
+        selected.append(past)
+    selected.reverse()
+
+    # Everything from summary_through up to the selected messages is folded into the summary once
+    first_selected = selected[0]['seq'] if selected else None
+    folded = gap + [m for m in recent if first_selected is None or m['seq'] < first_selected]
+    if folded:
+        new_summary = _fold_into_summary(summary, folded)
+        new_through = folded[-1]['seq'] + 1
+        if TutoringSession.update_summary(session_id, new_summary, new_through, summary_through):
+            summary, summary_through = new_summary, new_through
+
+    if summary:
+        system_prompt = f"{system_prompt}\n\nSummary of the earlier conversation:\n{summary}"
+
+    messages = [{"role": "system", "content": system_prompt}]
+    messages.extend({"role": m['role'], "content": m['content']} for m in selected)
+    messages.append({"role": "user", "content": message})
+    return messages
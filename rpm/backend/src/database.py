@@ -1,21 +1,170 @@
-from pymongo import MongoClient
+from pymongo import UpdateOne, DeleteOne, DeleteMany, IndexModel, ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
 from datetime import datetime, timedelta
-import bcrypt
+import base64
+import math
+import json
+import logging
+import threading
+import time
 import jwt
 from bson import ObjectId
 from src.config import get_config
+from src.cache import TTLCache, RefreshingCache
+from src.waitlist import WaitlistRank
+from src.indexes import declare_indexes, declare_query
+from src.passwords import password_hasher, PasswordHasherBusy
+from src.authz import AuthzVersions
+from src.metrics import mongo_listener
+from src.mongo import MongoConnection
+from src import queries
 
 config = get_config()
 
-# MongoDB Connection
-client = MongoClient(config.MONGODB_URI)
-db = client['ai_tutoring_platform']  # Specify database name
+logger = logging.getLogger(__name__)
+
+# MongoDB connection, opened lazily in each process (see src/mongo.py)
+mongo = MongoConnection(config.MONGODB_URI, event_listeners=[mongo_listener])  # Command timings for /api/metrics
 
 # Collections
-users_collection = db.users
-sessions_collection = db.sessions
-uploads_collection = db.uploads
-credits_collection = db.credits
+users_collection = mongo.collection('users')
+sessions_collection = mongo.collection('sessions')
+uploads_collection = mongo.collection('uploads')
+credits_collection = mongo.collection('credits')
+messages_collection = mongo.collection('session_messages')  # Session messages, bucketed by sequence range
+stats_collection = mongo.collection('stats')  # Incrementally maintained dashboard counters
+authz_events_collection = mongo.collection('authz_events')  # Recent authorization changes, TTL-expired
+chunks_collection = mongo.collection('upload_chunks')  # Text chunks of uploads, one document per chunk
+llm_cache_collection = mongo.collection('llm_cache')  # Shared tier of the LLM response cache, TTL-expired
+admin_jobs_collection = mongo.collection('admin_jobs')  # Progress of background admin jobs
+usage_collection = mongo.collection('usage_ledger')  # Credit and token usage per (user, UTC day)
+
+# Collections the step generators of src/queries.py address by name
+_step_collections = {c.name: c for c in (usage_collection, sessions_collection, messages_collection)}
+
+
+def _execute(operation):
+    """Make one queries.operation call against its collection"""
+    name, method, args, kwargs = operation
+    return getattr(_step_collections[name], method)(*args, **kwargs)
+
+
+def run_steps(steps):
+    """Drive a queries step generator with blocking calls and return its result"""
+    result = error = None
+    while True:
+        try:
+            operation = steps.throw(error) if error is not None else steps.send(result)
+        except StopIteration as done:
+            return done.value
+        try:
+            result, error = _execute(operation), None
+        except Exception as e:
+            result, error = None, e
+
+MESSAGE_BUCKET_SIZE = getattr(config, 'MESSAGE_BUCKET_SIZE', 50)
+
+# Admin list totals are served from here and recounted in the background
+user_count_cache = RefreshingCache(refresh_after=getattr(config, 'USER_COUNT_REFRESH', 60))
+
+USER_LIST_FILTERS = {
+    'all': {},
+    'waitlist': {'is_whitelisted': False},
+    'whitelisted': {'is_whitelisted': True}
+}
+USER_LIST_ORDER = [('created_at', -1), ('_id', -1)]
+
+def encode_cursor(user, direction):
+    """Opaque keyset token for a (created_at, _id) position"""
+    payload = {'c': user['created_at'].isoformat(), 'i': str(user['_id']), 'd': direction}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+
+def user_list_query(filter_type, position=None):
+    """(filter, sort) of an admin user list page, keyset from a decoded cursor position when given"""
+    query = dict(USER_LIST_FILTERS.get(filter_type, {}))
+    if position is None:
+        return query, USER_LIST_ORDER
+    created_at, object_id, direction = position
+    # Range on created_at keeps the index scan tight; $or breaks ties on _id
+    if direction == 'prev':
+        query['created_at'] = {'$gte': created_at}
+        query['$or'] = [{'created_at': {'$gt': created_at}}, {'_id': {'$gt': object_id}}]
+        return query, [('created_at', 1), ('_id', 1)]
+    query['created_at'] = {'$lte': created_at}
+    query['$or'] = [{'created_at': {'$lt': created_at}}, {'_id': {'$lt': object_id}}]
+    return query, USER_LIST_ORDER
+
+def decode_cursor(token):
+    """Decode a keyset token; returns (created_at, ObjectId, direction) or None"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        return datetime.fromisoformat(payload['c']), ObjectId(payload['i']), payload['d']
+    except Exception:
+        return None
+
+ACCESS_TOKEN_TTL = getattr(config, 'ACCESS_TOKEN_TTL', 900)
+REFRESH_TOKEN_TTL = getattr(config, 'REFRESH_TOKEN_TTL', 7 * 24 * 3600)
+AUTHZ_EVENT_WINDOW = ACCESS_TOKEN_TTL + 300
+
+def _load_authz_events(since):
+    """Authorization changes recorded after `since`, oldest first"""
+    return authz_events_collection.find({'at': {'$gte': since}}).sort('at', 1)
+
+# Lets gated routes trust token claims without reading the user; see src/authz.py
+authz_versions = AuthzVersions(
+    _load_authz_events,
+    window=AUTHZ_EVENT_WINDOW,
+    refresh_interval=getattr(config, 'AUTHZ_REFRESH_INTERVAL', 5)
+)
+
+def new_authz_version():
+    """Monotonic authorization version (epoch milliseconds)"""
+    return int(time.time() * 1000)
+
+def record_authz_change(user_ids, version, deleted=False):
+    """Log an authorization change so every worker stops trusting older claims"""
+    now = datetime.utcnow()
+    user_ids = [str(user_id) for user_id in user_ids]
+    if not user_ids:
+        return
+    authz_events_collection.insert_many([
+        {'user_id': user_id, 'version': version, 'deleted': deleted, 'at': now}
+        for user_id in user_ids
+    ], ordered=False)
+    for user_id in user_ids:
+        authz_versions.record(user_id, version, deleted)
+
+STATS_RECONCILE_INTERVAL = getattr(config, 'STATS_RECONCILE_INTERVAL', 3600)
+
+# Share of the normal credit cost charged when a reply comes from the response cache
+CACHE_HIT_CREDIT_RATIO = getattr(config, 'LLM_CACHE_HIT_CREDIT_RATIO', 0.2)
+_reconcile_lock = threading.Lock()
+
+# Days of per-day usage kept in the ledger before archive() folds them into lifetime totals
+USAGE_RETENTION_DAYS = getattr(config, 'USAGE_RETENTION_DAYS', 400)
+USAGE_ARCHIVE_INTERVAL = getattr(config, 'USAGE_ARCHIVE_INTERVAL', 24 * 3600)
+_archive_lock = threading.Lock()
+
+WAITLIST_FILTER = {'is_whitelisted': False, 'is_admin': False}
+WAITLIST_ORDER = [('created_at', 1), ('_id', 1)]
+
+def _load_waitlist():
+    """Stream (created_at, _id) of waitlisted users in queue order"""
+    cursor = users_collection.find(WAITLIST_FILTER, {'created_at': 1}).sort(WAITLIST_ORDER).batch_size(10000)
+    for user in cursor:
+        yield user['created_at'], user['_id']
+
+# In-process queue ranking; see src/waitlist.py
+waitlist_rank = WaitlistRank(
+    _load_waitlist,
+    refresh_interval=getattr(config, 'WAITLIST_REFRESH_INTERVAL', 60)
+)
+
+# In-process cache of user documents keyed by id; write paths invalidate it
+user_cache = TTLCache(
+    maxsize=getattr(config, 'USER_CACHE_SIZE', 10000),
+    ttl=getattr(config, 'USER_CACHE_TTL', 30)
+)
 
 class User:
     @staticmethod
@@ -35,7 +184,14 @@ class User:
             'last_login': datetime.utcnow()
         }
         
-        result = users_collection.insert_one(user_data)
+        try:
+            result = users_collection.insert_one(user_data)
+        except DuplicateKeyError:
+            # Email already registered (e.g. via email/password), or this
+            # Google id was just created by a concurrent sign-in
+            return None
+        waitlist_rank.join(result.inserted_id, user_data['created_at'])
+        UserStats.record(total_users=1, waitlisted_users=1, registered_at=user_data['created_at'])
         
         # Create initial credit account
         Credits.create_credit_account(str(result.inserted_id))
@@ -49,13 +205,26 @@ class User:
     
     @staticmethod
     def find_by_id(user_id):
-        """Find user by MongoDB ObjectId"""
-        return users_collection.find_one({'_id': ObjectId(user_id)})
+        """Find user by MongoDB ObjectId, served from the user cache when fresh"""
+        key = str(user_id)
+        user = user_cache.get(key)
+        if user is None:
+            user = users_collection.find_one(queries.user_by_id(user_id))
+            if user is None:
+                return None
+            user_cache.set(key, user)
+        return dict(user)
+    
+    @staticmethod
+    def invalidate_cache(*user_ids):
+        """Drop cached user documents after a write"""
+        for user_id in user_ids:
+            user_cache.pop(str(user_id))
     
     @staticmethod
     def update_profile(user_id, academic_level, subject_interest, learning_goals):
         """Update user profile after registration"""
-        return users_collection.update_one(
+        result = users_collection.update_one(
             {'_id': ObjectId(user_id)},
             {
                 '$set': {
@@ -67,19 +236,30 @@ class User:
                 }
             }
         )
+        User.invalidate_cache(user_id)
+        return result
     
     @staticmethod
     def whitelist_user(user_id):
-        """Admin function to whitelist a user"""
-        return users_collection.update_one(
-            {'_id': ObjectId(user_id)},
+        """Admin function to whitelist a user; returns its _id and created_at, or None if nothing changed"""
+        version = new_authz_version()
+        user = users_collection.find_one_and_update(
+            {'_id': ObjectId(user_id), 'is_whitelisted': {'$ne': True}},
             {
                 '$set': {
                     'is_whitelisted': True,
                     'whitelisted_at': datetime.utcnow()
-                }
-            }
+                },
+                '$max': {'authz_version': version}
+            },
+            projection={'created_at': 1}
         )
+        User.invalidate_cache(user_id)
+        if user is not None:
+            waitlist_rank.leave(user['_id'], user.get('created_at'))
+            UserStats.record(waitlisted_users=-1, whitelisted_users=1)
+            record_authz_change([user_id], version)
+        return user
     
     @staticmethod
     def update_last_login(user_id):
@@ -97,7 +277,7 @@ class User:
             return None
         
         # Hash password
-        hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+        hashed_password = password_hasher.hash(password)
         
         user_data = {
             'email': email,
@@ -114,7 +294,13 @@ class User:
             'profile_completed': False
         }
         
-        result = users_collection.insert_one(user_data)
+        try:
+            result = users_collection.insert_one(user_data)
+        except DuplicateKeyError:
+            # Lost a race with a concurrent registration for the same email
+            return None
+        waitlist_rank.join(result.inserted_id, user_data['created_at'])
+        UserStats.record(total_users=1, waitlisted_users=1, registered_at=user_data['created_at'])
         
         # Create initial credit account
         Credits.create_credit_account(str(result.inserted_id))
@@ -124,7 +310,7 @@ class User:
     @staticmethod
     def find_by_email(email):
         """Find user by email"""
-        return users_collection.find_one({'email': email})
+        return users_collection.find_one(queries.user_by_email(email))
     
     @staticmethod
     def verify_password(email, password):
@@ -133,33 +319,65 @@ class User:
         if not user or 'password' not in user:
             return None
         
-        if bcrypt.checkpw(password.encode('utf-8'), user['password']):
-            return user
-        return None
+        if not password_hasher.verify(password, user['password']):
+            return None
+        
+        if password_hasher.needs_rehash(user['password']):
+            # Cost factor changed: upgrade the stored hash off the request path
+            old_hash = user['password']
+            
+            def store_upgraded_hash(future):
+                if not future.exception():
+                    User.update_password_hash(user['_id'], old_hash, future.result())
+            
+            try:
+                password_hasher.hash_async(password).add_done_callback(store_upgraded_hash)
+            except PasswordHasherBusy:
+                pass  # Upgrade on a later login
+        return user
     
     @staticmethod
-    def list_users(page=1, limit=50, filter_type='all'):
-        """List users with pagination and filtering"""
-        skip = (page - 1) * limit
+    def update_password_hash(user_id, old_hash, new_hash):
+        """Swap in an upgraded hash unless the password changed meanwhile"""
+        result = users_collection.update_one(
+            {'_id': ObjectId(user_id), 'password': old_hash},
+            {'$set': {'password': new_hash}}
+        )
+        User.invalidate_cache(user_id)
+        return result
+    
+    @staticmethod
+    def list_users(page=1, limit=50, filter_type='all', cursor=None):
+        """List users with keyset (cursor) or page-number pagination and filtering"""
+        projection = {
+            'password': 0,  # Exclude password from results
+            'google_id': 0  # Exclude sensitive data
+        }
         
-        # Build filter query
-        query = {}
-        if filter_type == 'waitlist':
-            query['is_whitelisted'] = False
-        elif filter_type == 'whitelisted':
-            query['is_whitelisted'] = True
+        position = decode_cursor(cursor) if cursor else None
+        query, order = user_list_query(filter_type, position)
+        if position:
+            direction = position[2]
+            users = list(users_collection.find(query, projection).sort(order).limit(limit + 1))
+            has_more = len(users) > limit
+            users = users[:limit]
+            if direction == 'prev':
+                users.reverse()
+                has_next, has_prev = True, has_more
+            else:
+                has_next, has_prev = has_more, True
+        else:
+            # Page-number compatibility: skip is fine for the shallow pages it is used for
+            skip = (page - 1) * limit
+            users = list(users_collection.find(query, projection).sort(order).skip(skip).limit(limit + 1))
+            has_next = len(users) > limit
+            users = users[:limit]
+            has_prev = page > 1
         
-        # Get total count
-        total = users_collection.count_documents(query)
+        next_cursor = encode_cursor(users[-1], 'next') if users and has_next else None
+        prev_cursor = encode_cursor(users[0], 'prev') if users and has_prev else None
         
-        # Get users
-        users = list(users_collection.find(
-            query,
-            {
-                'password': 0,  # Exclude password from results
-                'google_id': 0  # Exclude sensitive data
-            }
-        ).sort('created_at', -1).skip(skip).limit(limit))
+        total = User.count_users(filter_type)
         
         # Convert ObjectId to string
         for user in users:
@@ -177,59 +395,145 @@ class User:
                 'page': page,
                 'limit': limit,
                 'total': total,
-                'pages': (total + limit - 1) // limit
+                'pages': (total + limit - 1) // limit,
+                'next_cursor': next_cursor,
+                'prev_cursor': prev_cursor
             }
         }
     
+    @staticmethod
+    def count_users(filter_type='all'):
+        """Cached user total for a list filter, recounted in the background when stale"""
+        query = USER_LIST_FILTERS.get(filter_type, {})
+        if not query:
+            # Collection metadata count; no scan
+            return user_count_cache.get('all', users_collection.estimated_document_count)
+        return user_count_cache.get(filter_type, lambda: users_collection.count_documents(query))
+    
     @staticmethod
     def make_admin(user_id):
-        """Make a user an admin"""
-        return users_collection.update_one(
-            {'_id': ObjectId(user_id)},
+        """Make a user an admin; returns its _id and created_at, or None if nothing changed"""
+        version = new_authz_version()
+        user = users_collection.find_one_and_update(
+            {'_id': ObjectId(user_id), 'is_admin': {'$ne': True}},
             {
                 '$set': {
                     'is_admin': True,
                     'admin_granted_at': datetime.utcnow()
-                }
-            }
+                },
+                '$max': {'authz_version': version}
+            },
+            projection={'created_at': 1}
         )
+        User.invalidate_cache(user_id)
+        if user is not None:
+            waitlist_rank.leave(user['_id'], user.get('created_at'))
+            UserStats.record(admin_users=1)
+            record_authz_change([user_id], version)
+        return user
     
     @staticmethod
     def get_user_stats():
         """Get user statistics for admin dashboard"""
-        total_users = users_collection.count_documents({})
-        waitlisted_users = users_collection.count_documents({'is_whitelisted': False})
-        whitelisted_users = users_collection.count_documents({'is_whitelisted': True})
-        admin_users = users_collection.count_documents({'is_admin': True})
-        
-        # Get recent registrations (last 7 days)
-        week_ago = datetime.utcnow() - timedelta(days=7)
-        recent_registrations = users_collection.count_documents({
-            'created_at': {'$gte': week_ago}
-        })
-        
-        return {
-            'total_users': total_users,
-            'waitlisted_users': waitlisted_users,
-            'whitelisted_users': whitelisted_users,
-            'admin_users': admin_users,
-            'recent_registrations': recent_registrations
-        }
+        return UserStats.get()
     
     @staticmethod
     def bulk_whitelist(user_ids):
-        """Bulk whitelist multiple users"""
+        """Whitelist a batch of users in one unordered bulk_write"""
         object_ids = [ObjectId(user_id) for user_id in user_ids]
-        return users_collection.update_many(
-            {'_id': {'$in': object_ids}},
-            {
-                '$set': {
-                    'is_whitelisted': True,
-                    'whitelisted_at': datetime.utcnow()
+        if not object_ids:
+            return None
+        version = new_authz_version()
+        now = datetime.utcnow()
+        result = users_collection.bulk_write([
+            UpdateOne(
+                {'_id': object_id, 'is_whitelisted': {'$ne': True}},
+                {
+                    '$set': {'is_whitelisted': True, 'whitelisted_at': now},
+                    '$max': {'authz_version': version}
                 }
-            }
-        )
+            )
+            for object_id in object_ids
+        ], ordered=False)
+        User.invalidate_cache(*user_ids)
+        # Signup times locate each user's waitlist slot without scanning the index
+        for user in users_collection.find({'_id': {'$in': object_ids}}, {'created_at': 1}):
+            waitlist_rank.leave(user['_id'], user.get('created_at'))
+        if result.modified_count:
+            UserStats.record(waitlisted_users=-result.modified_count, whitelisted_users=result.modified_count)
+            # Ids that were already whitelisted just re-check against the DB until their next refresh
+            record_authz_change(user_ids, version)
+        return result
 
+    @staticmethod
+    def waitlist_head(limit):
+        """Ids of the first `limit` waitlisted users in queue order"""
+        cursor = users_collection.find(WAITLIST_FILTER, {'_id': 1}).sort(WAITLIST_ORDER).limit(limit)
+        return [str(user['_id']) for user in cursor]
+
+    @staticmethod
+    def ids_for_emails(emails):
+        """Map a batch of emails to user ids; unknown emails are left out"""
+        return {
+            user['email']: str(user['_id'])
+            for user in users_collection.find({'email': {'$in': list(emails)}}, {'email': 1})
+        }
+
+    @staticmethod
+    def delete_user(user_id):
+        """Delete a user and everything they own; returns the user document or None"""
+        deleted = User.delete_users([user_id])
+        return deleted[0] if deleted else None
+
+    @staticmethod
+    def delete_users(user_ids, keep_admins=False):
+        """Delete a batch of users with their credits, usage, sessions, messages, uploads and chunks
+
+        The user documents go first, so the accounts stop authenticating
+        before their data is removed. Dependent deletes are keyed on every
+        requested id rather than only the users found, which lets a rerun
+        clean up after a batch that failed halfway. Returns the deleted user
+        documents.
+        """
+        object_ids = [ObjectId(user_id) for user_id in user_ids]
+        users = list(users_collection.find(
+            {'_id': {'$in': object_ids}},
+            {'is_whitelisted': 1, 'is_admin': 1, 'created_at': 1}
+        ))
+        if keep_admins:
+            admins = {str(user['_id']) for user in users if user.get('is_admin', False)}
+            users = [user for user in users if str(user['_id']) not in admins]
+            user_ids = [str(user_id) for user_id in user_ids if str(user_id) not in admins]
+        else:
+            user_ids = [str(user_id) for user_id in user_ids]
+        if not user_ids:
+            return []
+
+        if users:
+            users_collection.bulk_write([DeleteOne({'_id': user['_id']}) for user in users], ordered=False)
+            User.invalidate_cache(*user_ids)
+            for user in users:
+                waitlist_rank.leave(user['_id'], user.get('created_at'))
+            record_authz_change([user['_id'] for user in users], new_authz_version(), deleted=True)
+            # Counts come from the documents read above; a concurrent delete of
+            # the same user can skew them until the next reconcile()
+            whitelisted = sum(1 for user in users if user.get('is_whitelisted', False))
+            UserStats.record(
+                total_users=-len(users),
+                whitelisted_users=-whitelisted,
+                waitlisted_users=-(len(users) - whitelisted),
+                admin_users=-sum(1 for user in users if user.get('is_admin', False))
+            )
+
+        credits_collection.delete_many({'user_id': {'$in': user_ids}})
+        usage_collection.delete_many({'user_id': {'$in': user_ids}})
+        session_ids = [str(s['_id']) for s in sessions_collection.find({'user_id': {'$in': user_ids}}, {'_id': 1})]
+        if session_ids:
+            messages_collection.delete_many({'session_id': {'$in': session_ids}})
+            sessions_collection.delete_many({'_id': {'$in': [ObjectId(s) for s in session_ids]}})
+        chunks_collection.delete_many({'user_id': {'$in': user_ids}})
+        uploads_collection.delete_many({'user_id': {'$in': user_ids}})
+        return users
 
     @staticmethod
     def get_queue_position(user_id):
@@ -238,7 +542,12 @@ class User:
         if not user or user.get('is_whitelisted', False) or user.get('is_admin', False):
             return None
         
-        # Count users who registered before this user and are still on waitlist
+        if waitlist_rank.ready():
+            position = waitlist_rank.position(user['_id'], user['created_at'])
+            if position is not None:
+                return position
+        
+        # Snapshot still loading or user joined on another worker: count directly
         position = users_collection.count_documents({
             'created_at': {'$lt': user['created_at']},
             'is_whitelisted': False,
@@ -248,91 +557,166 @@ class User:
         return position
     
     @staticmethod
-    def update_all_queue_positions():
-        """Update queue positions for all waitlisted users"""
-        waitlist_users = list(users_collection.find(
-            {"is_whitelisted": False, "is_admin": False}
-        ).sort("created_at", 1))
+    def update_all_queue_positions(chunk_size=1000):
+        """Persist queue positions for all waitlisted users in chunked bulk writes"""
+        now = datetime.utcnow()
+        cursor = users_collection.find(WAITLIST_FILTER, {'_id': 1}).sort(WAITLIST_ORDER).batch_size(chunk_size)
         
-        for index, user in enumerate(waitlist_users):
-            position = index + 1
-            users_collection.update_one(
-                {"_id": user["_id"]},
-                {
-                    "$set": {
-                        "queue_position": position,
-                        "position_updated_at": datetime.utcnow()
-                    }
-                }
-            )
+        operations = []
+        position = 0
+        for user in cursor:
+            position += 1
+            operations.append(UpdateOne(
+                {'_id': user['_id']},
+                {'$set': {'queue_position': position, 'position_updated_at': now}}
+            ))
+            if len(operations) >= chunk_size:
+                users_collection.bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            users_collection.bulk_write(operations, ordered=False)
+        
+        return position
+
+declare_indexes(
+    users_collection,
+    IndexModel([('email', ASCENDING)], unique=True, name='email_unique'),
+    IndexModel(
+        [('google_id', ASCENDING)], unique=True, name='google_id_unique',
+        partialFilterExpression={'google_id': {'$type': 'string'}}
+    ),
+    IndexModel(
+        [('is_whitelisted', ASCENDING), ('is_admin', ASCENDING), ('created_at', ASCENDING), ('_id', ASCENDING)],
+        name='waitlist_order'
+    ),
+    IndexModel([('is_whitelisted', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)], name='list_by_status'),
+    IndexModel([('created_at', DESCENDING), ('_id', DESCENDING)], name='list_all'),
+    IndexModel([('is_admin', ASCENDING)], name='is_admin')
+)
+declare_query('find_by_email', users_collection, {'email': 'audit@example.com'})
+declare_query('find_by_google_id', users_collection, {'google_id': 'audit'})
+declare_query('find_by_id', users_collection, {'_id': ObjectId()})
+for _filter_type in USER_LIST_FILTERS:
+    # Every shape list_users sends: a numbered page, and a keyset page in each direction
+    for _direction in (None, 'next', 'prev'):
+        _position = (datetime(2100, 1, 1), ObjectId(), _direction) if _direction else None
+        declare_query(f"list_users_{_filter_type}{'_' + _direction if _direction else ''}", users_collection,
+                      *user_list_query(_filter_type, _position))
+declare_query('queue_position_count', users_collection, {
+    'created_at': {'$lt': datetime(2100, 1, 1)}, 'is_whitelisted': False, 'is_admin': False
+})
+declare_query('waitlist_order', users_collection, WAITLIST_FILTER, WAITLIST_ORDER)
+declare_query('stats_admins', users_collection, {'is_admin': True})
+declare_query('stats_recent', users_collection, {'created_at': {'$gte': datetime(2000, 1, 1)}})
+declare_query('ids_for_emails', users_collection, {'email': {'$in': ['audit@example.com']}})
+
+class UserStats:
+    STATS_ID = 'users'
+    COUNTERS = ('total_users', 'waitlisted_users', 'whitelisted_users', 'admin_users')
+    REGISTRATION_DAYS = 30  # Daily buckets kept for rolling windows
+    
+    @staticmethod
+    def _day(moment):
+        return moment.strftime('%Y-%m-%d')
+    
+    @staticmethod
+    def record(registered_at=None, **deltas):
+        """Atomically apply counter deltas (and a registration to its day bucket)"""
+        increments = {name: delta for name, delta in deltas.items() if delta}
+        if registered_at is not None:
+            increments[f'registrations.{UserStats._day(registered_at)}'] = 1
+        if not increments:
+            return None
+        return stats_collection.update_one(
+            {'_id': UserStats.STATS_ID},
+            {'$inc': increments, '$set': {'updated_at': datetime.utcnow()}},
+            upsert=True
+        )
+    
+    @staticmethod
+    def get(window_days=7):
+        """Dashboard stats from a single point lookup"""
+        stats = stats_collection.find_one({'_id': UserStats.STATS_ID})
+        if not stats or 'reconciled_at' not in stats:
+            stats = UserStats.reconcile()
+        elif datetime.utcnow() - stats['reconciled_at'] > timedelta(seconds=STATS_RECONCILE_INTERVAL):
+            # Repair drift off the request path, one reconciliation at a time
+            if _reconcile_lock.acquire(blocking=False):
+                threading.Thread(target=UserStats._background_reconcile, daemon=True).start()
+        
+        today = datetime.utcnow()
+        registrations = stats.get('registrations', {})
+        recent = sum(
+            registrations.get(UserStats._day(today - timedelta(days=offset)), 0)
+            for offset in range(window_days)
+        )
         
-        return len(waitlist_users)
+        result = {name: max(0, stats.get(name, 0)) for name in UserStats.COUNTERS}
+        result['recent_registrations'] = recent
+        return result
+    
+    @staticmethod
+    def _background_reconcile():
+        try:
+            UserStats.reconcile()
+        finally:
+            _reconcile_lock.release()
+    
+    @staticmethod
+    def reconcile():
+        """Recompute every counter in one $facet aggregation and overwrite any drift"""
+        since = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        since -= timedelta(days=UserStats.REGISTRATION_DAYS - 1)
+        facets = list(users_collection.aggregate([
+            {'$facet': {
+                'total_users': [{'$count': 'n'}],
+                'waitlisted_users': [{'$match': {'is_whitelisted': False}}, {'$count': 'n'}],
+                'whitelisted_users': [{'$match': {'is_whitelisted': True}}, {'$count': 'n'}],
+                'admin_users': [{'$match': {'is_admin': True}}, {'$count': 'n'}],
+                'registrations': [
+                    {'$match': {'created_at': {'$gte': since}}},
+                    {'$group': {
+                        '_id': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$created_at'}},
+                        'n': {'$sum': 1}
+                    }}
+                ]
+            }}
+        ]))[0]
+        
+        now = datetime.utcnow()
+        stats = {name: facets[name][0]['n'] if facets[name] else 0 for name in UserStats.COUNTERS}
+        stats['registrations'] = {bucket['_id']: bucket['n'] for bucket in facets['registrations']}
+        stats['reconciled_at'] = now
+        stats['updated_at'] = now
+        stats_collection.replace_one({'_id': UserStats.STATS_ID}, stats, upsert=True)
+        return stats
 
 class Credits:
     @staticmethod
     def create_credit_account(user_id):
         """Create initial credit account for new user"""
-        credit_data = {
-            'user_id': user_id,
-            'daily_credits': config.DAILY_CREDIT_LIMIT,
-            'credits_used_today': 0,
-            'last_reset': datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0),
-            'total_credits_used': 0,
-            'created_at': datetime.utcnow()
-        }
-        return credits_collection.insert_one(credit_data)
+        try:
+            return credits_collection.insert_one(queries.new_credit_account(user_id))
+        except DuplicateKeyError:
+            # Account was created concurrently
+            return None
     
     @staticmethod
     def get_credit_status(user_id):
         """Get current credit status for user"""
-        credit_account = credits_collection.find_one({'user_id': user_id})
-        
-        if not credit_account:
-            # Create account if it doesn't exist
-            Credits.create_credit_account(user_id)
-            credit_account = credits_collection.find_one({'user_id': user_id})
-        
-        # Check if we need to reset daily credits
-        today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-        if credit_account['last_reset'] < today:
-            credits_collection.update_one(
-                {'user_id': user_id},
-                {
-                    '$set': {
-                        'credits_used_today': 0,
-                        'last_reset': today
-                    }
-                }
-            )
-            credit_account['credits_used_today'] = 0
-        
-        remaining_credits = config.DAILY_CREDIT_LIMIT - credit_account['credits_used_today']
-        next_reset = today + timedelta(days=1)
-        
-        return {
-            'remaining_credits': max(0, remaining_credits),
-            'daily_limit': config.DAILY_CREDIT_LIMIT,
-            'used_today': credit_account['credits_used_today'],
-            'next_reset': next_reset,
-            'total_used': credit_account['total_credits_used']
-        }
+        # Read-only: today's usage is today's ledger bucket, so a new day
+        # needs no reset write
+        today = Usage.today()
+        account = credits_collection.find_one(queries.credit_account(user_id), queries.CREDIT_ACCOUNT_FIELDS) or {}
+        totals = Usage.user_totals(user_id, today, account.get('archived_through'))
+        return queries.credit_status(account, totals, today, config.DAILY_CREDIT_LIMIT)
     
     @staticmethod
     def deduct_credits(user_id, tokens_used):
         """Deduct credits based on tokens used"""
-        credits_to_deduct = max(1, tokens_used // config.TOKENS_PER_CREDIT)
-        
-        result = credits_collection.update_one(
-            {'user_id': user_id},
-            {
-                '$inc': {
-                    'credits_used_today': credits_to_deduct,
-                    'total_credits_used': credits_to_deduct
-                }
-            }
-        )
-        
-        return credits_to_deduct if result.modified_count > 0 else 0
+        credits_to_deduct = Credits.credits_for_tokens(tokens_used)
+        Usage.record(user_id, Usage.today(), credits=credits_to_deduct, tokens=tokens_used)
+        return credits_to_deduct
     
     @staticmethod
     def can_use_credits(user_id, estimated_tokens):
@@ -342,107 +726,642 @@ class Credits:
         
         return credit_status['remaining_credits'] >= estimated_credits
 
+    @staticmethod
+    def credits_for_tokens(tokens):
+        """Convert a token count into billable credits"""
+        return queries.credits_for_tokens(tokens, config.TOKENS_PER_CREDIT)
+    
+    @staticmethod
+    def credits_for_cache_hit(tokens):
+        """Discounted charge for a reply served from the response cache"""
+        return int(math.ceil(Credits.credits_for_tokens(tokens) * CACHE_HIT_CREDIT_RATIO))
+    
+    @staticmethod
+    def reserve_credits(user_id, credits, topic=None):
+        """Atomically check today's balance and hold credits in today's ledger bucket"""
+        # One round trip: returns None when the balance is too low, otherwise a
+        # reservation to hand to commit_credits or refund_credits
+        return run_steps(queries.reserve_steps(user_id, credits, Usage.today(), topic, config.DAILY_CREDIT_LIMIT))
+    
+    @staticmethod
+    def commit_credits(reservation, tokens_used, charged=None, cached=False):
+        """Settle a reservation against the real token usage and return the new balance"""
+        if charged is None:
+            charged = Credits.credits_for_tokens(tokens_used)
+        return run_steps(queries.commit_steps(reservation, tokens_used, charged, cached, config.DAILY_CREDIT_LIMIT))
+    
+    @staticmethod
+    def refund_credits(reservation):
+        """Release a reservation that was never used"""
+        return usage_collection.update_one(*queries.refund(reservation))
+
+class Usage:
+    STATS_ID = 'usage_ledger'
+    EPOCH = queries.EPOCH
+    GROUPS = ('day', 'user', 'topic')
+    
+    # One bucket per (user_id, UTC day) with credits (including in-flight
+    # holds), tokens, request and cache-hit counts, and the same totals per
+    # session topic. Topic keys are bounded by the daily credit limit, since
+    # every request costs at least one credit. Buckets older than
+    # USAGE_RETENTION_DAYS are folded into the user's credit account
+    # (total_credits_used, archived_through) and deleted; see archive().
+    
+    @staticmethod
+    def today():
+        return queries.utc_today()
+    
+    @staticmethod
+    def new_bucket_fields():
+        return queries.new_bucket_fields()
+    
+    @staticmethod
+    def topic_key(topic):
+        """Field-safe topic name (no dots, no leading $)"""
+        return queries.topic_key(topic)
+    
+    @staticmethod
+    def record(user_id, day, credits=0, tokens=0, topic=None, charged=None, cached=False):
+        """Add one settled request to a day bucket; returns the bucket's credits"""
+        return _execute(queries.record_usage_step(user_id, day, credits, tokens, topic, charged, cached))
+    
+    @staticmethod
+    def user_totals(user_id, today, archived_through=None):
+        """Credits used today and since the last archival, from one indexed aggregation"""
+        rows = list(usage_collection.aggregate(queries.usage_totals_pipeline(user_id, today, archived_through)))
+        return queries.usage_totals(rows)
+    
+    @staticmethod
+    def summary(group_by='day', days=30, user_id=None, limit=100):
+        """Credit and token totals over the ledger, grouped by day, user or topic"""
+        since = Usage.today() - timedelta(days=days - 1)
+        match = {'day': {'$gte': since}}
+        if user_id is not None:
+            match['user_id'] = user_id
+        
+        totals = {
+            'credits': {'$sum': '$credits'},
+            'tokens': {'$sum': '$tokens'},
+            'requests': {'$sum': '$requests'},
+            'cache_hits': {'$sum': '$cache_hits'}
+        }
+        if group_by == 'day':
+            pipeline = [
+                {'$group': dict(totals, _id='$day', users={'$sum': 1})},
+                {'$sort': {'_id': 1}}
+            ]
+        elif group_by == 'user':
+            pipeline = [
+                {'$group': dict(totals, _id='$user_id', days={'$sum': 1})},
+                {'$sort': {'credits': -1}},
+                {'$limit': limit}
+            ]
+        else:
+            pipeline = [
+                {'$project': {'topics': {'$objectToArray': {'$ifNull': ['$topics', {}]}}}},
+                {'$unwind': '$topics'},
+                {'$group': {
+                    '_id': '$topics.k',
+                    'credits': {'$sum': '$topics.v.credits'},
+                    'tokens': {'$sum': '$topics.v.tokens'},
+                    'requests': {'$sum': '$topics.v.requests'}
+                }},
+                {'$sort': {'tokens': -1}},
+                {'$limit': limit}
+            ]
+        
+        Usage._maybe_archive()
+        rows = list(usage_collection.aggregate([{'$match': match}] + pipeline))
+        key = {'day': 'day', 'user': 'user_id', 'topic': 'topic'}[group_by]
+        for row in rows:
+            row[key] = row.pop('_id')
+        return rows
+    
+    @staticmethod
+    def _maybe_archive():
+        stats = stats_collection.find_one({'_id': Usage.STATS_ID}, {'archived_at': 1}) or {}
+        archived_at = stats.get('archived_at')
+        if archived_at and datetime.utcnow() - archived_at < timedelta(seconds=USAGE_ARCHIVE_INTERVAL):
+            return
+        if _archive_lock.acquire(blocking=False):
+            threading.Thread(target=Usage._background_archive, daemon=True).start()
+    
+    @staticmethod
+    def _background_archive():
+        try:
+            Usage.archive()
+        except Exception:
+            logger.exception('Error archiving usage ledger')
+        finally:
+            _archive_lock.release()
+    
+    @staticmethod
+    def archive(retention_days=None, chunk_size=1000):
+        """Fold buckets past retention into credit accounts, then delete them"""
+        # Each account records the last day folded into it. Only buckets
+        # after that day are added, so a run that died between folding and
+        # deleting is finished by the next one without double counting.
+        retention_days = retention_days or USAGE_RETENTION_DAYS
+        cutoff = Usage.today() - timedelta(days=retention_days)
+        cursor = usage_collection.aggregate([
+            {'$match': {'day': {'$lt': cutoff}}},
+            {'$lookup': {
+                'from': credits_collection.name, 'localField': 'user_id', 'foreignField': 'user_id', 'as': 'account'
+            }},
+            # Without an account there is nowhere to fold into; keep those buckets
+            {'$match': {'account': {'$ne': []}}},
+            {'$set': {'folded_through': {
+                '$ifNull': [{'$arrayElemAt': ['$account.archived_through', 0]}, Usage.EPOCH]
+            }}},
+            {'$group': {
+                '_id': '$user_id',
+                'folded_through': {'$first': '$folded_through'},
+                'through': {'$max': '$day'},
+                'credits': {'$sum': {'$cond': [{'$gt': ['$day', '$folded_through']}, '$credits', 0]}}
+            }}
+        ], allowDiskUse=True)
+        
+        folded = 0
+        batch = []
+        for row in cursor:
+            batch.append(row)
+            if len(batch) >= chunk_size:
+                folded += Usage._fold(batch)
+                batch = []
+        if batch:
+            folded += Usage._fold(batch)
+        stats_collection.update_one(
+            {'_id': Usage.STATS_ID},
+            {'$set': {'archived_at': datetime.utcnow(), 'archived_before': cutoff}, '$inc': {'archived_users': folded}},
+            upsert=True
+        )
+        return folded
+    
+    @staticmethod
+    def _fold(rows):
+        folded_at = datetime.utcnow()
+        accounts = [
+            UpdateOne(
+                # Matches only if no other run has folded this user meanwhile
+                {
+                    'user_id': row['_id'],
+                    'archived_through': None if row['folded_through'] == Usage.EPOCH else row['folded_through']
+                },
+                {
+                    '$inc': {'total_credits_used': row['credits']},
+                    '$set': {'archived_through': row['through'], 'archived_at': folded_at}
+                }
+            )
+            for row in rows if row['through'] > row['folded_through']
+        ]
+        if accounts:
+            credits_collection.bulk_write(accounts, ordered=False)
+        usage_collection.bulk_write([
+            DeleteMany({'user_id': row['_id'], 'day': {'$lte': row['through']}})
+            for row in rows
+        ], ordered=False)
+        return len(accounts)
+
+declare_indexes(
+    usage_collection,
+    IndexModel([('user_id', ASCENDING), ('day', ASCENDING)], unique=True, name='user_day_unique'),
+    IndexModel([('day', ASCENDING)], name='day')
+)
+declare_query('usage_bucket', usage_collection, {'user_id': 'audit', 'day': datetime(2000, 1, 1)})
+declare_query('usage_user_totals', usage_collection, {'user_id': 'audit', 'day': {'$gt': datetime(2000, 1, 1)}})
+declare_query('usage_summary', usage_collection, {'day': {'$gte': datetime(2000, 1, 1)}})
+
+declare_indexes(
+    authz_events_collection,
+    IndexModel([('at', ASCENDING)], expireAfterSeconds=AUTHZ_EVENT_WINDOW, name='at_ttl')
+)
+declare_query('authz_events_since', authz_events_collection, {'at': {'$gte': datetime(2000, 1, 1)}}, [('at', 1)])
+
+declare_indexes(
+    credits_collection,
+    IndexModel([('user_id', ASCENDING)], unique=True, name='user_id_unique')
+)
+declare_query('credit_account', credits_collection, {'user_id': 'audit'})
+
 class TutoringSession:
     @staticmethod
     def create_session(user_id, topic, content_chunks=None):
         """Create a new tutoring session"""
-        session_data = {
-            'user_id': user_id,
-            'topic': topic,
-            'content_chunks': content_chunks or [],
-            'messages': [],
-            'credits_used': 0,
-            'status': 'active',
-            'created_at': datetime.utcnow(),
-            'updated_at': datetime.utcnow()
-        }
-        
-        result = sessions_collection.insert_one(session_data)
+        result = sessions_collection.insert_one(queries.new_session(user_id, topic, content_chunks))
         return str(result.inserted_id)
     
+    @staticmethod
+    def _append_messages(session_id, messages, tokens_used):
+        """Allocate sequence numbers on the session, then write all messages in one bulk_write"""
+        return run_steps(queries.append_messages_steps(
+            session_id, messages, tokens_used, Credits.credits_for_tokens(tokens_used), MESSAGE_BUCKET_SIZE
+        ))
+    
     @staticmethod
     def add_message(session_id, role, content, tokens_used=0):
         """Add a message to the session"""
-        message = {
-            'role': role,
-            'content': content,
-            'tokens_used': tokens_used,
-            'timestamp': datetime.utcnow()
-        }
+        return TutoringSession._append_messages(
+            session_id,
+            [{'role': role, 'content': content, 'tokens_used': tokens_used}],
+            tokens_used
+        )
+    
+    @staticmethod
+    def add_turn(session_id, user_content, assistant_content, tokens_used=0):
+        """Add a user message and the assistant reply in one write to the message store"""
+        return TutoringSession._append_messages(
+            session_id,
+            [
+                {'role': 'user', 'content': user_content, 'tokens_used': 0},
+                {'role': 'assistant', 'content': assistant_content, 'tokens_used': tokens_used}
+            ],
+            tokens_used
+        )
+    
+    @staticmethod
+    def get_messages(session_id, limit=20, before=None):
+        """Get the latest messages of a session, paging backwards with a sequence cursor"""
+        page = queries.MessagePage(limit, before)
+        query = queries.message_page(session_id, before, MESSAGE_BUCKET_SIZE)
+        if query is None:
+            return page.result()
         
-        return sessions_collection.update_one(
-            {'_id': ObjectId(session_id)},
-            {
-                '$push': {'messages': message},
-                '$inc': {'credits_used': max(1, tokens_used // config.TOKENS_PER_CREDIT)},
-                '$set': {'updated_at': datetime.utcnow()}
-            }
+        for bucket in messages_collection.find(query).sort('bucket', -1).batch_size(2):
+            page.add(bucket)
+            if page.full:
+                break
+        return page.result()
+    
+    @staticmethod
+    def update_summary(session_id, summary, summary_through, expected_through):
+        """Store a rolling summary, unless another request already advanced it"""
+        result = sessions_collection.update_one(
+            *queries.summary_update(session_id, summary, summary_through, expected_through)
         )
+        return result.modified_count > 0
     
     @staticmethod
     def get_session(session_id):
-        """Get session by ID"""
-        return sessions_collection.find_one({'_id': ObjectId(session_id)})
+        """Get session by ID (counters only, without message history)"""
+        return sessions_collection.find_one(queries.session_by_id(session_id), queries.SESSION_FIELDS)
     
     @staticmethod
     def get_user_sessions(user_id, limit=10):
-        """Get user's recent sessions"""
-        return list(sessions_collection.find(
-            {'user_id': user_id}
-        ).sort('updated_at', -1).limit(limit))
+        """Get user's recent session summaries"""
+        query, projection, sort = queries.user_sessions(user_id)
+        return list(sessions_collection.find(query, projection).sort(sort).limit(limit))
+    
+    @staticmethod
+    def migrate_embedded_messages(batch_size=100):
+        """Move messages still embedded in legacy session documents into the message store"""
+        migrated = 0
+        for session in sessions_collection.find({'messages': {'$exists': True}}).batch_size(batch_size):
+            session_id = str(session['_id'])
+            legacy = session.get('messages') or []
+            operations = []
+            for start in range(0, len(legacy), MESSAGE_BUCKET_SIZE):
+                bucket_messages = [
+                    dict(message, seq=start + offset)
+                    for offset, message in enumerate(legacy[start:start + MESSAGE_BUCKET_SIZE])
+                ]
+                operations.append(UpdateOne(
+                    {'session_id': session_id, 'bucket': start // MESSAGE_BUCKET_SIZE},
+                    {'$set': {
+                        'messages': bucket_messages,
+                        'count': len(bucket_messages),
+                        'seq_start': start,
+                        'seq_end': start + len(bucket_messages) - 1,
+                        'created_at': session.get('created_at')
+                    }},
+                    upsert=True
+                ))
+            if operations:
+                messages_collection.bulk_write(operations, ordered=False)
+            sessions_collection.update_one(
+                {'_id': session['_id']},
+                {
+                    '$set': {
+                        'message_count': len(legacy),
+                        'tokens_used': sum(m.get('tokens_used', 0) for m in legacy)
+                    },
+                    '$unset': {'messages': ''}
+                }
+            )
+            migrated += 1
+        return migrated
+
+declare_indexes(
+    sessions_collection,
+    IndexModel([('user_id', ASCENDING), ('updated_at', DESCENDING)], name='user_recent')
+)
+declare_indexes(
+    messages_collection,
+    IndexModel([('session_id', ASCENDING), ('bucket', DESCENDING)], unique=True, name='session_bucket')
+)
+declare_query('user_sessions', sessions_collection, {'user_id': 'audit'}, [('updated_at', -1)])
+declare_query('session_history', messages_collection, {'session_id': 'audit', 'bucket': {'$lte': 3}}, [('bucket', -1)])
 
 class Upload:
     @staticmethod
     def create_upload(user_id, filename, file_type, extracted_text, chunks):
-        """Create upload record"""
+        """Create upload record from already extracted text"""
+        upload_id = Upload.create_pending_upload(user_id, filename, file_type, len(extracted_text.encode('utf-8')))
+        UploadChunks.insert_batch(upload_id, user_id, 0, chunks)
+        Upload.update_progress(upload_id, status='processing', chunk_count=len(chunks))
+        Upload.mark_indexed(upload_id)
+        return upload_id
+    
+    @staticmethod
+    def create_pending_upload(user_id, filename, file_type, size_bytes):
+        """Create upload record for a file waiting for background ingestion"""
         upload_data = {
             'user_id': user_id,
             'filename': filename,
             'file_type': file_type,
-            'extracted_text': extracted_text,
-            'chunks': chunks,
+            'size_bytes': size_bytes,
+            'status': 'queued',
+            'pages_total': None,
+            'pages_done': 0,
+            'chunk_count': 0,
+            'error': None,
             'vector_indexed': False,
-            'created_at': datetime.utcnow()
+            'created_at': datetime.utcnow(),
+            'updated_at': datetime.utcnow()
         }
         
         result = uploads_collection.insert_one(upload_data)
         return str(result.inserted_id)
     
+    @staticmethod
+    def update_progress(upload_id, **fields):
+        """Record ingestion progress (status, pages_total, pages_done, chunk_count)"""
+        fields['updated_at'] = datetime.utcnow()
+        return uploads_collection.update_one({'_id': ObjectId(upload_id)}, {'$set': fields})
+    
+    @staticmethod
+    def mark_failed(upload_id, error):
+        """Mark ingestion as failed"""
+        return Upload.update_progress(upload_id, status='failed', error=str(error))
+    
+    @staticmethod
+    def get_upload(upload_id, user_id=None):
+        """Get an upload's metadata and progress"""
+        return uploads_collection.find_one(queries.upload_by_id(upload_id, user_id), queries.UPLOAD_FIELDS)
+    
     @staticmethod
     def get_user_uploads(user_id):
         """Get user's uploads"""
-        return list(uploads_collection.find({'user_id': user_id}).sort('created_at', -1))
+        query, projection, sort = queries.user_uploads(user_id)
+        return list(uploads_collection.find(query, projection).sort(sort))
+    
+    @staticmethod
+    def delete_upload(upload_id, user_id):
+        """Delete a user's upload and its stored chunks; returns the deleted document or None"""
+        upload = uploads_collection.find_one_and_delete(queries.upload_by_id(upload_id, user_id), projection={'status': 1})
+        if upload is not None:
+            UploadChunks.delete_for_upload(str(upload['_id']))
+        return upload
+    
+    @staticmethod
+    def get_indexed_upload_ids(user_id):
+        """Ids of the user's uploads whose ingestion has finished"""
+        return [str(u['_id']) for u in uploads_collection.find({'user_id': user_id, 'vector_indexed': True}, {'_id': 1})]
+
+    @staticmethod
+    def has_indexed_uploads(user_id):
+        """Whether any of the user's uploads finished ingestion"""
+        return uploads_collection.find_one({'user_id': user_id, 'vector_indexed': True}, {'_id': 1}) is not None
     
     @staticmethod
     def mark_indexed(upload_id):
         """Mark upload as vector indexed"""
         return uploads_collection.update_one(
             {'_id': ObjectId(upload_id)},
-            {'$set': {'vector_indexed': True}}
+            {'$set': {'vector_indexed': True, 'status': 'indexed', 'updated_at': datetime.utcnow()}}
+        )
+
+declare_indexes(
+    uploads_collection,
+    IndexModel([('user_id', ASCENDING), ('created_at', DESCENDING)], name='user_recent')
+)
+declare_query('user_uploads', uploads_collection, {'user_id': 'audit'}, [('created_at', -1)])
+declare_query('indexed_uploads', uploads_collection, {'user_id': 'audit', 'vector_indexed': True})
+
+class UploadChunks:
+    @staticmethod
+    def insert_batch(upload_id, user_id, first_seq, texts):
+        """Insert a batch of consecutive chunks for an upload"""
+        if not texts:
+            return None
+        now = datetime.utcnow()
+        return chunks_collection.insert_many([
+            {
+                'upload_id': upload_id,
+                'user_id': user_id,
+                'seq': first_seq + offset,
+                'text': text,
+                'created_at': now
+            }
+            for offset, text in enumerate(texts)
+        ], ordered=False)
+    
+    @staticmethod
+    def get_chunks(upload_id, start=0, limit=100):
+        """Get a page of an upload's chunks in order"""
+        return list(chunks_collection.find(
+            {'upload_id': upload_id, 'seq': {'$gte': start}}
+        ).sort('seq', 1).limit(limit))
+    
+    @staticmethod
+    def get_by_refs(refs):
+        """Fetch chunks by (upload_id, seq) pairs, returned in the order given"""
+        if not refs:
+            return []
+        found = {
+            (c['upload_id'], c['seq']): c
+            for c in chunks_collection.find({'$or': [{'upload_id': u, 'seq': s} for u, s in refs]})
+        }
+        return [found[ref] for ref in refs if ref in found]
+    
+    @staticmethod
+    def iter_user_chunks(user_id, batch_size=1000):
+        """Stream every chunk a user has uploaded"""
+        return chunks_collection.find({'user_id': user_id}).sort([('upload_id', 1), ('seq', 1)]).batch_size(batch_size)
+    
+    @staticmethod
+    def delete_for_upload(upload_id):
+        """Remove all chunks of an upload"""
+        return chunks_collection.delete_many({'upload_id': upload_id})
+
+declare_indexes(
+    chunks_collection,
+    IndexModel([('upload_id', ASCENDING), ('seq', ASCENDING)], unique=True, name='upload_seq'),
+    IndexModel([('user_id', ASCENDING), ('upload_id', ASCENDING), ('seq', ASCENDING)], name='user_chunks')
+)
+declare_query('upload_chunks', chunks_collection, {'upload_id': 'audit', 'seq': {'$gte': 0}}, [('seq', 1)])
+declare_query('user_chunks', chunks_collection, {'user_id': 'audit'}, [('upload_id', 1), ('seq', 1)])
+
+class CachedResponse:
+    STATS_ID = 'llm_cache'
+    
+    @staticmethod
+    def get(key):
+        """A live shared cache entry, or None"""
+        return llm_cache_collection.find_one({'_id': key, 'expires_at': {'$gt': datetime.utcnow()}})
+    
+    @staticmethod
+    def put(key, content, tokens_used, model, ttl):
+        """Store a reply in the shared tier (last writer wins)"""
+        now = datetime.utcnow()
+        return llm_cache_collection.update_one(
+            {'_id': key},
+            {
+                '$set': {
+                    'content': content,
+                    'tokens_used': tokens_used,
+                    'model': model,
+                    'created_at': now,
+                    'expires_at': now + timedelta(seconds=ttl)
+                },
+                '$setOnInsert': {'hits': 0}
+            },
+            upsert=True
         )
+    
+    @staticmethod
+    def record(deltas, entry_hits=None):
+        """Add a worker's batched lookup counters to the shared totals, and hit counts to their entries"""
+        if entry_hits:
+            llm_cache_collection.bulk_write(
+                [UpdateOne({'_id': key}, {'$inc': {'hits': hits}}) for key, hits in entry_hits.items()],
+                ordered=False
+            )
+        increments = {name: delta for name, delta in deltas.items() if delta}
+        if not increments:
+            return None
+        return stats_collection.update_one(
+            {'_id': CachedResponse.STATS_ID},
+            {'$inc': increments, '$set': {'updated_at': datetime.utcnow()}},
+            upsert=True
+        )
+    
+    @staticmethod
+    def get_stats():
+        """Counters recorded by every worker"""
+        stats = stats_collection.find_one({'_id': CachedResponse.STATS_ID}) or {}
+        stats.pop('_id', None)
+        return stats
 
-def generate_jwt_token(user_id):
-    """Generate JWT token for user"""
+declare_indexes(
+    llm_cache_collection,
+    IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=0, name='expires_at_ttl')
+)
+declare_query('llm_cache_lookup', llm_cache_collection, {'_id': 'audit', 'expires_at': {'$gt': datetime(2000, 1, 1)}})
+
+class AdminJob:
+    MAX_ERRORS = 20  # Sample of failures kept on the job document
+    
+    @staticmethod
+    def create(action, source, created_by, total=None):
+        """Record a queued admin job; returns its id"""
+        now = datetime.utcnow()
+        job = {
+            'action': action,
+            'source': source,
+            'created_by': created_by,
+            'status': 'queued',
+            'total': total,
+            'processed': 0,
+            'succeeded': 0,
+            'skipped': 0,
+            'failed': 0,
+            'errors': [],
+            'error': None,
+            'created_at': now,
+            'started_at': None,
+            'finished_at': None,
+            'updated_at': now
+        }
+        return str(admin_jobs_collection.insert_one(job).inserted_id)
+    
+    @staticmethod
+    def update(job_id, **fields):
+        """Set job fields (status, total, timestamps)"""
+        fields['updated_at'] = datetime.utcnow()
+        return admin_jobs_collection.update_one({'_id': ObjectId(job_id)}, {'$set': fields})
+    
+    @staticmethod
+    def record_chunk(job_id, processed, succeeded=0, skipped=0, failed=0, errors=()):
+        """Add one chunk's outcome to the job's counters"""
+        update = {
+            '$inc': {'processed': processed, 'succeeded': succeeded, 'skipped': skipped, 'failed': failed},
+            '$set': {'updated_at': datetime.utcnow()}
+        }
+        if errors:
+            update['$push'] = {'errors': {'$each': list(errors), '$slice': AdminJob.MAX_ERRORS}}
+        return admin_jobs_collection.update_one({'_id': ObjectId(job_id)}, update)
+    
+    @staticmethod
+    def get(job_id):
+        return admin_jobs_collection.find_one({'_id': ObjectId(job_id)})
+    
+    @staticmethod
+    def list_recent(limit=20):
+        return list(admin_jobs_collection.find().sort('created_at', -1).limit(limit))
+
+declare_indexes(
+    admin_jobs_collection,
+    IndexModel([('created_at', DESCENDING)], name='created_at')
+)
+declare_query('admin_jobs_recent', admin_jobs_collection, {}, [('created_at', -1)])
+
+def generate_jwt_token(user, token_type='access'):
+    """Generate a JWT for a user document; access tokens embed authorization claims"""
+    now = datetime.utcnow()
+    ttl = ACCESS_TOKEN_TTL if token_type == 'access' else REFRESH_TOKEN_TTL
     payload = {
-        'user_id': user_id,
-        'exp': datetime.utcnow() + timedelta(days=7),
-        'iat': datetime.utcnow()
+        'user_id': str(user['_id']),
+        'type': token_type,
+        'av': user.get('authz_version', 0),
+        'exp': now + timedelta(seconds=ttl),
+        'iat': now
     }
+    if token_type == 'access':
+        payload['wl'] = user.get('is_whitelisted', False)
+        payload['adm'] = user.get('is_admin', False)
     return jwt.encode(payload, config.JWT_SECRET, algorithm='HS256')
 
-def verify_jwt_token(token):
-    """Verify JWT token and return user_id"""
+def issue_tokens(user):
+    """Short-lived access token plus the refresh token used to renew it"""
+    return {
+        'token': generate_jwt_token(user, 'access'),
+        'refresh_token': generate_jwt_token(user, 'refresh'),
+        'expires_in': ACCESS_TOKEN_TTL
+    }
+
+def decode_jwt_token(token, token_type='access'):
+    """Verify a JWT and return its payload, or None"""
     try:
         payload = jwt.decode(token, config.JWT_SECRET, algorithms=['HS256'])
-        return payload['user_id']
     except jwt.ExpiredSignatureError:
         return None
     except jwt.InvalidTokenError:
         return None
+    # Tokens issued before claims existed have no type and count as access tokens
+    if payload.get('type', 'access') != token_type:
+        return None
+    return payload
 
+def verify_jwt_token(token):
+    """Verify JWT token and return user_id"""
+    payload = decode_jwt_token(token)
+    return payload['user_id'] if payload else None
 
+def current_claims(payload):
+    """Authorization claims from an access token, or None when they may be stale"""
+    if 'av' not in payload or 'wl' not in payload:
+        return None
+    if not authz_versions.is_current(payload['user_id'], payload['av']):
+        return None
+    return payload
 
-    @staticmethod
-    def delete_user(user_id):
-        """Delete a user by ID"""
-        return users_collection.delete_one({"_id": ObjectId(user_id)})
\ No newline at end of file
@@ -0,0 +1,94 @@
+import argparse
+import logging
+import sys
+
+from pymongo.errors import PyMongoError
+
+# Registry of the indexes each model needs and the query shapes it issues.
+# Models declare against it at import time (see database.py); ensure_indexes()
+# creates everything idempotently at startup and audit() explains every shape.
+INDEXES = {}
+QUERY_SHAPES = []
+
+logger = logging.getLogger(__name__)
+
+
+def declare_indexes(collection, *indexes):
+    """Register IndexModels that a collection's queries rely on"""
+    INDEXES.setdefault(collection.name, (collection, []))[1].extend(indexes)
+
+
+def declare_query(name, collection, query, sort=None):
+    """Register a representative query shape for the plan audit"""
+    QUERY_SHAPES.append({'name': name, 'collection': collection, 'query': query, 'sort': sort})
+
+
+def ensure_indexes():
+    """Create all declared indexes (no-op for ones that already exist)"""
+    created = {}
+    for name, (collection, indexes) in INDEXES.items():
+        try:
+            created[name] = collection.create_indexes(indexes)
+        except PyMongoError:
+            logger.exception('Error creating indexes on %s', name)
+    return created
+
+
+def _plan_stages(plan):
+    """Yield every stage name in an explain() plan tree"""
+    yield plan.get('stage')
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            yield from _plan_stages(plan[key])
+    for child in plan.get('inputStages', []):
+        yield from _plan_stages(child)
+
+
+def audit():
+    """Explain each declared query shape and report collection scans and in-memory sorts"""
+    findings = []
+    for shape in QUERY_SHAPES:
+        cursor = shape['collection'].find(shape['query'])
+        if shape['sort']:
+            cursor = cursor.sort(shape['sort'])
+        planner = cursor.explain().get('queryPlanner', {})
+        stages = set(_plan_stages(planner.get('winningPlan', {})))
+        findings.append({
+            'name': shape['name'],
+            'collection': shape['collection'].name,
+            'stages': sorted(s for s in stages if s),
+            'collscan': 'COLLSCAN' in stages,
+            'blocking_sort': 'SORT' in stages
+        })
+    return findings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage and audit MongoDB indexes')
+    parser.add_argument('command', choices=['ensure', 'audit'])
+    parser.add_argument('--no-ensure', action='store_true', help='audit without creating indexes first')
+    args = parser.parse_args()
+
+    import src.database  # noqa: F401  (registers the model declarations)
+
+    if args.command == 'ensure' or not args.no_ensure:
+        for name, indexes in ensure_indexes().items():
+            print(f"{name}: {', '.join(indexes)}")
+    if args.command == 'ensure':
+        return 0
+
+    failures = 0
+    for finding in audit():
+        if finding['collscan']:
+            status = 'COLLSCAN'
+            failures += 1
+        elif finding['blocking_sort']:
+            status = 'SORT'
+        else:
+            status = 'ok'
+        print(f"{status:8} {finding['collection']}.{finding['name']}: {', '.join(finding['stages'])}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
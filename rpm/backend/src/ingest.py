@@ -0,0 +1,229 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from src.config import get_config
+from src.database import Upload, UploadChunks
+from src.retrieval import index_chunks, remove_upload
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # PDF ingestion is optional
+    PdfReader = None
+
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_SPOOL_DIR = getattr(config, 'UPLOAD_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'rpm-uploads'))
+UPLOAD_MAX_BYTES = getattr(config, 'UPLOAD_MAX_BYTES', 50 * 1024 * 1024)
+INGEST_WORKERS = getattr(config, 'INGEST_WORKERS', 2)
+INGEST_QUEUE_LIMIT = getattr(config, 'INGEST_QUEUE_LIMIT', 32)
+CHUNK_SIZE = getattr(config, 'CHUNK_SIZE', 1000)
+CHUNK_OVERLAP = getattr(config, 'CHUNK_OVERLAP', 200)
+CHUNK_INSERT_BATCH = getattr(config, 'CHUNK_INSERT_BATCH', 200)
+PROGRESS_INTERVAL = 1.0
+
+SPOOL_BLOCK = 64 * 1024
+TEXT_TYPES = ('txt', 'md')
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds UPLOAD_MAX_BYTES"""
+
+
+class IngestBusy(Exception):
+    """Raised when too many ingestion jobs are already queued"""
+
+    def __init__(self, retry_after=5):
+        super().__init__('Ingestion queue is full')
+        self.retry_after = retry_after
+
+
+def supported_types():
+    """File extensions the ingester can extract text from"""
+    return TEXT_TYPES + (('pdf',) if PdfReader is not None else ())
+
+
+def file_type_of(filename):
+    return os.path.splitext(filename or '')[1].lstrip('.').lower()
+
+
+def spool_upload(stream, max_bytes=UPLOAD_MAX_BYTES):
+    """Copy an upload stream to a spool file block by block; returns (path, size)"""
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_SPOOL_DIR, uuid.uuid4().hex)
+    size = 0
+    try:
+        with open(path, 'wb') as f:
+            while True:
+                block = stream.read(SPOOL_BLOCK)
+                if not block:
+                    break
+                size += len(block)
+                if size > max_bytes:
+                    raise UploadTooLarge()
+                f.write(block)
+    except BaseException:
+        _remove(path)
+        raise
+    return path, size
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def iter_pages(path, file_type):
+    """Yield (text, pages_done, pages_total), one page (or text block) at a time"""
+    if file_type == 'pdf':
+        if PdfReader is None:
+            raise RuntimeError('PDF support requires the pypdf package')
+        reader = PdfReader(path)
+        total = len(reader.pages)
+        for number in range(total):
+            # Pages are parsed on demand, so only one is held in memory at a time
+            yield (reader.pages[number].extract_text() or '') + '\n', number + 1, total
+    else:
+        total = max(1, -(-os.path.getsize(path) // SPOOL_BLOCK))
+        with open(path, 'r', encoding='utf-8', errors='replace') as f:
+            done = 0
+            while True:
+                block = f.read(SPOOL_BLOCK)
+                if not block:
+                    break
+                done += 1
+                yield block, min(done, total), total
+
+
+class Chunker:
+    """Incremental fixed-size chunker with overlap, fed text as it is extracted"""
+
+    def __init__(self, size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+        self.size = size
+        self.overlap = min(overlap, size // 2)
+        self._buffer = ''
+        self._fresh = False
+
+    def _cut(self):
+        # Prefer to break on whitespace in the back half of the window
+        window = self._buffer[:self.size]
+        cut = max(window.rfind(' '), window.rfind('\n'))
+        return cut if cut > self.size // 2 else self.size
+
+    def feed(self, text):
+        """Add text; returns the chunks that are now complete"""
+        chunks = []
+        if text:
+            self._buffer += text
+            self._fresh = True
+        while len(self._buffer) >= self.size:
+            cut = self._cut()
+            chunk = self._buffer[:cut].strip()
+            if chunk:
+                chunks.append(chunk)
+            self._buffer = self._buffer[max(cut - self.overlap, 1):]
+            self._fresh = len(self._buffer) > self.overlap
+        return chunks
+
+    def flush(self):
+        """Return the final partial chunk, if it holds any text not yet emitted"""
+        chunk = self._buffer.strip() if self._fresh else ''
+        self._buffer = ''
+        self._fresh = False
+        return [chunk] if chunk else []
+
+
+class Ingester:
+    """Background pool that extracts, chunks and stores spooled uploads"""
+
+    # Request threads only spool the body to disk and enqueue a job. Workers
+    # read the spool file a page at a time, feed the chunker and insert chunks
+    # in batches of CHUNK_INSERT_BATCH, so memory stays bounded by one page plus
+    # one batch regardless of file size. Each batch is also embedded into the
+    # user's vector index. Progress is written to the upload document
+    # (throttled) and mark_indexed flips once every chunk is stored.
+
+    def __init__(self, workers=INGEST_WORKERS, queue_limit=INGEST_QUEUE_LIMIT,
+                 batch_size=CHUNK_INSERT_BATCH):
+        self.workers = workers
+        self.batch_size = batch_size
+        self._slots = threading.BoundedSemaphore(queue_limit)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created lazily and per process, so pre-forking servers get their own pool
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='ingest')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def submit(self, upload_id, user_id, path, file_type):
+        """Queue ingestion of a spooled file, failing fast when the queue is full"""
+        if not self._slots.acquire(blocking=False):
+            raise IngestBusy()
+        try:
+            future = self._get_executor().submit(self.run, upload_id, user_id, path, file_type)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _store(self, upload_id, user_id, first_seq, texts):
+        """Insert a batch of chunks and add their embeddings to the user's vector index"""
+        if texts:
+            UploadChunks.insert_batch(upload_id, user_id, first_seq, texts)
+            index_chunks(user_id, upload_id, first_seq, texts)
+
+    def run(self, upload_id, user_id, path, file_type):
+        """Ingest one spooled file (runs on a pool thread)"""
+        try:
+            Upload.update_progress(upload_id, status='processing')
+            chunker = Chunker()
+            batch = []
+            stored = 0
+            reported_at = 0
+            for text, done, total in iter_pages(path, file_type):
+                batch.extend(chunker.feed(text))
+                if len(batch) >= self.batch_size:
+                    self._store(upload_id, user_id, stored, batch)
+                    stored += len(batch)
+                    batch = []
+                now = time.monotonic()
+                if now - reported_at >= PROGRESS_INTERVAL or done == total:
+                    Upload.update_progress(upload_id, pages_done=done, pages_total=total, chunk_count=stored)
+                    reported_at = now
+            batch.extend(chunker.flush())
+            self._store(upload_id, user_id, stored, batch)
+            stored += len(batch)
+            Upload.update_progress(upload_id, chunk_count=stored)
+            Upload.mark_indexed(upload_id)
+        except Exception as e:
+            logger.exception('Error ingesting upload %s', upload_id)
+            Upload.mark_failed(upload_id, e)
+            # Drop what was stored before the failure: index entries and chunk rows
+            try:
+                remove_upload(user_id, upload_id)
+            except Exception:
+                logger.exception('Error removing upload %s from the indexes', upload_id)
+            try:
+                UploadChunks.delete_for_upload(upload_id)
+            except Exception:
+                logger.exception('Error deleting chunks of failed upload %s', upload_id)
+        finally:
+            _remove(path)
+
+
+ingester = Ingester()
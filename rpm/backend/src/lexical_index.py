@@ -0,0 +1,231 @@
+import math
+import re
+import threading
+from array import array
+from collections import Counter
+
+import numpy as np
+
+# Words, numbers and identifiers, keeping joined forms like np.dot, x^2,
+# snake_case or 3.14 whole so exact formulas and code names match
+_TOKEN = re.compile(r"\w+(?:[.^'-]\w+)*")
+_PARTS = re.compile(r"[.^'_-]")
+
+COMPACT_RATIO = 0.25  # Rebuild postings once deleted docs reach this share
+MAX_TF = 65535
+
+
+def tokenize(text):
+    """Lowercased terms of a text; compound tokens also yield their parts"""
+    tokens = []
+    for token in _TOKEN.findall(text.lower()):
+        tokens.append(token)
+        parts = _PARTS.split(token)
+        if len(parts) > 1:
+            tokens.extend(part for part in parts if part)
+    return tokens
+
+
+class LexicalIndex:
+    """In-memory BM25 inverted index over one user's upload chunks"""
+
+    # Docs get sequential ids as they are added, so each term's postings are
+    # two parallel arrays (doc ids ascending, term frequencies) that only
+    # ever grow at the end. Removing an upload tombstones its docs; postings
+    # are rebuilt without them once COMPACT_RATIO of the docs are dead.
+    #
+    # Search uses MaxScore: terms are scored in decreasing order of their
+    # BM25 upper bound into a dense accumulator. Once the bounds of the terms
+    # left cannot lift an unseen doc past the current k-th score, the rest
+    # only score the surviving candidates (by binary search in their
+    # postings) instead of walking their full posting lists.
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._postings = {}
+        self._max_tf = {}
+        self._lengths = array('I')
+        self._slots = array('i')
+        self._seqs = array('i')
+        self._alive = bytearray()
+        self._uploads = []
+        self._slot_of = {}
+        self._next_seq = {}
+        self._total_length = 0
+        self._live = 0
+        self._dead = 0
+        # Bookkeeping for whoever syncs this index against the chunk store
+        self.synced_version = None
+        self.syncing = False
+
+    def __len__(self):
+        return self._live
+
+    def uploads(self):
+        """Upload id -> number of its chunks indexed so far"""
+        with self._lock:
+            return dict(self._next_seq)
+
+    def add(self, upload_id, first_seq, texts):
+        """Index consecutive chunks of an upload; chunks already indexed are skipped"""
+        with self._lock:
+            next_seq = self._next_seq.get(upload_id, 0)
+            if first_seq > next_seq:
+                # A gap means earlier chunks are missing; a later sync fills it
+                return 0
+            texts = texts[next_seq - first_seq:]
+            if not texts:
+                return 0
+            slot = self._slot_of.get(upload_id)
+            if slot is None:
+                slot = self._slot_of[upload_id] = len(self._uploads)
+                self._uploads.append(upload_id)
+            for offset, text in enumerate(texts):
+                doc = len(self._lengths)
+                counts = Counter(tokenize(text))
+                for term, tf in counts.items():
+                    postings = self._postings.get(term)
+                    if postings is None:
+                        postings = self._postings[term] = (array('i'), array('H'))
+                    postings[0].append(doc)
+                    postings[1].append(min(tf, MAX_TF))
+                    if tf > self._max_tf.get(term, 0):
+                        self._max_tf[term] = min(tf, MAX_TF)
+                length = sum(counts.values())
+                self._lengths.append(length)
+                self._slots.append(slot)
+                self._seqs.append(next_seq + offset)
+                self._alive.append(1)
+                self._total_length += length
+            self._live += len(texts)
+            self._next_seq[upload_id] = next_seq + len(texts)
+            return len(texts)
+
+    def remove_upload(self, upload_id):
+        """Tombstone an upload's docs"""
+        with self._lock:
+            slot = self._slot_of.pop(upload_id, None)
+            if slot is None:
+                return 0
+            self._next_seq.pop(upload_id, None)
+            self._uploads[slot] = None
+            docs = np.flatnonzero(np.frombuffer(self._slots, dtype=np.int32) == slot)
+            alive = np.frombuffer(self._alive, dtype=np.uint8)
+            docs = docs[alive[docs] == 1]
+            alive[docs] = 0
+            del alive
+            self._total_length -= int(np.frombuffer(self._lengths, dtype=np.uint32)[docs].sum())
+            self._live -= len(docs)
+            self._dead += len(docs)
+            if self._dead >= COMPACT_RATIO * len(self._lengths):
+                self._compact()
+            return len(docs)
+
+    def _compact(self):
+        alive = np.frombuffer(self._alive, dtype=np.uint8).astype(bool)
+        remap = np.cumsum(alive, dtype=np.int64) - 1
+        postings, max_tf = {}, {}
+        for term, (ids, tfs) in self._postings.items():
+            ids = np.frombuffer(ids, dtype=np.int32)
+            keep = alive[ids]
+            if not keep.any():
+                continue
+            kept_tfs = np.frombuffer(tfs, dtype=np.uint16)[keep]
+            postings[term] = (array('i', remap[ids[keep]].astype(np.int32).tobytes()),
+                              array('H', kept_tfs.tobytes()))
+            max_tf[term] = int(kept_tfs.max())
+        self._postings, self._max_tf = postings, max_tf
+        for name, typecode, dtype in (('_lengths', 'I', np.uint32), ('_slots', 'i', np.int32), ('_seqs', 'i', np.int32)):
+            kept = np.frombuffer(getattr(self, name), dtype=dtype)[alive]
+            setattr(self, name, array(typecode, kept.tobytes()))
+        self._alive = bytearray(b'\x01' * self._live)
+        self._dead = 0
+
+    def _idf(self, df):
+        return math.log(1 + (self._live - df + 0.5) / (df + 0.5))
+
+    @staticmethod
+    def _touched(accumulator, touched, count):
+        """Doc ids with a score so far, by merging postings or scanning, whichever is cheaper"""
+        if count * 8 < len(accumulator):
+            return np.unique(np.concatenate(touched))
+        return np.flatnonzero(accumulator)
+
+    def search(self, query, k=4, exhaustive=False):
+        """Top-k (upload_id, seq, score) by BM25, best first"""
+        terms = set(tokenize(query))
+        with self._lock:
+            if not self._live or not terms:
+                return []
+            k1, b = self.k1, self.b
+            avgdl = self._total_length / self._live
+            lengths = np.frombuffer(self._lengths, dtype=np.uint32)
+            alive = np.frombuffer(self._alive, dtype=np.uint8) if self._dead else None
+
+            plan = []
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = self._idf(len(postings[0]))
+                max_tf = self._max_tf[term]
+                # Score of the highest tf in the shortest possible doc
+                bound = idf * max_tf * (k1 + 1) / (max_tf + k1 * (1 - b))
+                plan.append((bound, idf, postings))
+            if not plan:
+                return []
+            plan.sort(key=lambda entry: entry[0], reverse=True)
+
+            def term_scores(idf, ids, tfs):
+                norm = k1 * (1 - b + b * lengths[ids] / avgdl)
+                return idf * tfs * (k1 + 1) / (tfs + norm)
+
+            accumulator = np.zeros(len(lengths), dtype=np.float32)
+            total = remaining = sum(entry[0] for entry in plan)
+            touched, touched_count = [], 0
+            candidates = None
+            threshold = 0.0
+            for bound, idf, (ids, tfs) in plan:
+                remaining -= bound
+                ids = np.frombuffer(ids, dtype=np.int32)
+                tfs = np.frombuffer(tfs, dtype=np.uint16)
+                if candidates is None:
+                    if alive is not None:
+                        live = alive[ids] == 1
+                        ids, tfs = ids[live], tfs[live]
+                    accumulator[ids] += term_scores(idf, ids, tfs.astype(np.float32))
+                    touched.append(ids)
+                    touched_count += len(ids)
+                    # Scores so far are at most the bounds spent, so until those
+                    # exceed what is left the threshold cannot prune anything
+                    if exhaustive or touched_count < k or remaining >= total - remaining:
+                        continue
+                    pool = ids if len(ids) >= k else np.unique(np.concatenate(touched))
+                    if len(pool) < k:
+                        continue
+                    threshold = max(threshold, float(np.partition(accumulator[pool], -k)[-k]))
+                    if remaining < threshold:
+                        # No unseen doc can reach the top k any more
+                        candidates = self._touched(accumulator, touched, touched_count)
+                        candidates = candidates[accumulator[candidates] + remaining >= threshold]
+                else:
+                    positions = np.searchsorted(ids, candidates)
+                    positions[positions == len(ids)] = 0
+                    hit = ids[positions] == candidates
+                    matched = candidates[hit]
+                    accumulator[matched] += term_scores(idf, matched, tfs[positions[hit]].astype(np.float32))
+            if candidates is None:
+                candidates = self._touched(accumulator, touched, touched_count)
+
+            scores = accumulator[candidates]
+            if len(scores) > k:
+                best = np.argpartition(-scores, k)[:k]
+            else:
+                best = np.arange(len(scores))
+            best = best[np.argsort(-scores[best], kind='stable')]
+            return [
+                (self._uploads[self._slots[doc]], self._seqs[doc], float(score))
+                for doc, score in zip(candidates[best].tolist(), scores[best].tolist())
+            ]
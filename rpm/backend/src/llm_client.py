@@ -0,0 +1,182 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.config import get_config
+
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+
+def _abort(response):
+    """Shut the response's socket down, waking a read blocked on a stalled or trickling upstream"""
+    sock = getattr(getattr(response.raw, 'connection', None), 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+def _check_deadline(deadline):
+    if deadline is not None and time.monotonic() >= deadline:
+        raise TimeoutError('LLM call deadline exceeded')
+
+
+class DeepSeekClient:
+    """Minimal DeepSeek (OpenAI-compatible) chat client with streaming support"""
+
+    def __init__(self, api_key=None, base_url=None, model=None, timeout=None, pool_size=None):
+        self.api_key = api_key or getattr(config, 'DEEPSEEK_API_KEY', None)
+        self.base_url = (base_url or getattr(config, 'DEEPSEEK_BASE_URL', 'https://api.deepseek.com')).rstrip('/')
+        self.model = model or getattr(config, 'DEEPSEEK_MODEL', 'deepseek-chat')
+        self.timeout = timeout or getattr(config, 'DEEPSEEK_TIMEOUT', 60)
+        self.connect_timeout = getattr(config, 'DEEPSEEK_CONNECT_TIMEOUT', 5)
+
+        self.pool_size = pool_size or getattr(config, 'LLM_MAX_IN_FLIGHT', 8)
+        self._session = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self):
+        # Keep-alive connections to the upstream, sized to the in-flight limit.
+        # Opened on first use and per process, so forked workers never share sockets
+        if self._session is None or self._pid != os.getpid():
+            with self._lock:
+                if self._session is None or self._pid != os.getpid():
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                    session = requests.Session()
+                    session.mount('https://', adapter)
+                    session.mount('http://', adapter)
+                    self._session = session
+                    self._pid = os.getpid()
+        return self._session
+
+    def warm_up(self):
+        """Open a pooled connection (DNS, TCP and TLS) to the upstream ahead of the first call"""
+        try:
+            # Any HTTP status will do; the body is read, so the connection stays pooled
+            self.session.get(f'{self.base_url}/models', headers=self._headers(),
+                             timeout=(self.connect_timeout, self.connect_timeout))
+            return True
+        except requests.RequestException as e:
+            logger.warning('LLM warm-up failed: %s', e)
+            return False
+
+    def _payload(self, messages, stream, **params):
+        payload = {
+            'model': self.model,
+            'messages': messages,
+            'temperature': params.get('temperature', 0.7),
+            'max_tokens': params.get('max_tokens', 1000),
+            'stream': stream
+        }
+        if stream:
+            # Ask for a final usage frame so credits can be settled exactly
+            payload['stream_options'] = {'include_usage': True}
+        return payload
+
+    def _headers(self):
+        return {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
+
+    def _timeout(self, timeout, deadline=None):
+        read_timeout = self.timeout if timeout is None else max(0.1, timeout)
+        if deadline is not None:
+            read_timeout = max(0.1, min(read_timeout, deadline - time.monotonic()))
+        return (min(self.connect_timeout, read_timeout), read_timeout)
+
+    @contextmanager
+    def _completion(self, messages, stream, timeout, deadline, **params):
+        """POST a completion and hold its response open until the deadline at most
+
+        The read timeout only bounds each socket read, so an upstream sending
+        a few bytes at a time, or stalling mid-stream, could outlive it many
+        times over. Bodies are read in chunks checked against the deadline,
+        and a timer shuts the socket down when it passes, which also ends a
+        read that is still blocked.
+        """
+        with self.session.post(
+            f'{self.base_url}/chat/completions',
+            headers=self._headers(),
+            json=self._payload(messages, stream, **params),
+            timeout=self._timeout(timeout, deadline),
+            stream=True
+        ) as response:
+            watchdog = None
+            if deadline is not None:
+                watchdog = threading.Timer(max(0.0, deadline - time.monotonic()), _abort, (response,))
+                watchdog.daemon = True
+                watchdog.start()
+            try:
+                response.raise_for_status()
+                yield response
+            finally:
+                if watchdog is not None:
+                    watchdog.cancel()
+
+    def chat_completion(self, messages, timeout=None, deadline=None, **params):
+        """Blocking completion returning {'content', 'tokens_used', 'prompt_tokens'} or {'error'}"""
+        try:
+            body = bytearray()
+            with self._completion(messages, False, timeout, deadline, **params) as response:
+                for chunk in response.iter_content(chunk_size=8192):
+                    _check_deadline(deadline)
+                    body.extend(chunk)
+            data = json.loads(body)
+            usage = data.get('usage', {})
+            return {
+                'content': data['choices'][0]['message']['content'],
+                'tokens_used': usage.get('total_tokens', 0),
+                'prompt_tokens': usage.get('prompt_tokens')
+            }
+        except Exception as e:
+            if deadline is not None and time.monotonic() >= deadline:
+                e = TimeoutError('LLM call deadline exceeded')
+            return {'error': str(e)}
+
+    def stream_chat_completion(self, messages, timeout=None, deadline=None, **params):
+        """Yield delta events as they arrive, then a final done event with usage"""
+        parts = []
+        tokens_used = prompt_tokens = None
+        finished = False
+        try:
+            with self._completion(messages, True, timeout, deadline, **params) as response:
+                for line in response.iter_lines(decode_unicode=True):
+                    _check_deadline(deadline)
+                    if not line or not line.startswith('data:'):
+                        continue
+                    data = line[5:].strip()
+                    if data == '[DONE]':
+                        finished = True
+                        break
+                    chunk = json.loads(data)
+                    if chunk.get('usage'):
+                        tokens_used = chunk['usage'].get('total_tokens', 0)
+                        prompt_tokens = chunk['usage'].get('prompt_tokens')
+                    for choice in chunk.get('choices') or []:
+                        delta = (choice.get('delta') or {}).get('content')
+                        if delta:
+                            parts.append(delta)
+                            yield {'type': 'delta', 'content': delta}
+            if not finished:
+                # The watchdog ends a read with EOF rather than an error
+                _check_deadline(deadline)
+        except Exception as e:
+            if deadline is not None and time.monotonic() >= deadline:
+                e = TimeoutError('LLM call deadline exceeded')
+            yield {'type': 'error', 'error': str(e), 'content': ''.join(parts)}
+            return
+
+        yield {'type': 'done', 'content': ''.join(parts), 'tokens_used': tokens_used, 'prompt_tokens': prompt_tokens}
@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import deque
+
+from src.config import get_config
+from src.metrics import observe_llm_call
+
+config = get_config()
+
+
+class GatewayOverloaded(Exception):
+    """Raised when the wait queue is full or a queued call waited too long"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMGateway:
+    """Concurrency-bounded front door for upstream LLM calls"""
+
+    # At most max_in_flight calls run at once and up to max_queue more wait
+    # queue_timeout seconds for a slot; anything beyond that fails fast with
+    # GatewayOverloaded so a slow upstream cannot pin every worker.
+
+    def __init__(self, client, max_in_flight=None, max_queue=None, queue_timeout=None,
+                 call_deadline=None, retry_after=None, latency_window=1024):
+        self.client = client
+        self.max_in_flight = max_in_flight or getattr(config, 'LLM_MAX_IN_FLIGHT', 8)
+        self.max_queue = max_queue if max_queue is not None else getattr(config, 'LLM_MAX_QUEUE', 32)
+        self.queue_timeout = queue_timeout or getattr(config, 'LLM_QUEUE_TIMEOUT', 10)
+        self.call_deadline = call_deadline or getattr(config, 'LLM_CALL_DEADLINE', 60)
+        self.retry_after = retry_after or getattr(config, 'LLM_RETRY_AFTER', 5)
+
+        self._cond = threading.Condition()
+        self._in_flight = 0
+        self._waiting = 0
+        self._latencies = deque(maxlen=latency_window)
+        self._queue_waits = deque(maxlen=latency_window)
+        self.calls = 0
+        self.errors = 0
+        self.rejected = 0
+        self.queue_timeouts = 0
+
+    def _acquire(self):
+        """Take a slot, waiting in the queue if needed; returns the seconds waited"""
+        started = time.monotonic()
+        with self._cond:
+            if self._in_flight >= self.max_in_flight:
+                if self._waiting >= self.max_queue:
+                    self.rejected += 1
+                    raise GatewayOverloaded('LLM queue is full', self.retry_after)
+                self._waiting += 1
+                try:
+                    acquired = self._cond.wait_for(
+                        lambda: self._in_flight < self.max_in_flight,
+                        timeout=self.queue_timeout
+                    )
+                finally:
+                    self._waiting -= 1
+                if not acquired:
+                    self.queue_timeouts += 1
+                    raise GatewayOverloaded('Timed out waiting for an LLM slot', self.retry_after)
+            self._in_flight += 1
+        waited = time.monotonic() - started
+        self._queue_waits.append(waited)
+        return waited
+
+    def _release(self, started, failed):
+        with self._cond:
+            self._in_flight -= 1
+            self.calls += 1
+            if failed:
+                self.errors += 1
+            self._latencies.append(time.monotonic() - started)
+            self._cond.notify()
+
+    def chat_completion(self, messages, deadline=None, **params):
+        """Run a blocking completion within the in-flight limit and call deadline"""
+        waited = self._acquire()
+        started = time.monotonic()
+        response = {'error': 'LLM call did not complete'}
+        try:
+            response = self.client.chat_completion(
+                messages, deadline=started + (deadline or self.call_deadline), **params
+            )
+            return response
+        finally:
+            self._release(started, 'error' in response)
+            observe_llm_call('blocking', time.monotonic() - started, 'error' in response, waited,
+                             response.get('prompt_tokens'), response.get('tokens_used'))
+
+    def stream_chat_completion(self, messages, deadline=None, **params):
+        """Reserve a slot now and return an event stream that frees it when closed"""
+        waited = self._acquire()
+        started = time.monotonic()
+        events = self.client.stream_chat_completion(
+            messages, deadline=started + (deadline or self.call_deadline), **params
+        )
+        return _GatewayStream(self, events, started, waited)
+
+    def metrics(self):
+        """Return queue depth, saturation and latency percentiles"""
+        with self._cond:
+            latencies = sorted(self._latencies)
+            queue_waits = sorted(self._queue_waits)
+            return {
+                'in_flight': self._in_flight,
+                'queue_depth': self._waiting,
+                'max_in_flight': self.max_in_flight,
+                'max_queue': self.max_queue,
+                'calls': self.calls,
+                'errors': self.errors,
+                'rejected': self.rejected,
+                'queue_timeouts': self.queue_timeouts,
+                'latency_seconds': _percentiles(latencies),
+                'queue_wait_seconds': _percentiles(queue_waits)
+            }
+
+
+class _GatewayStream:
+    """Iterator over upstream stream events that holds a gateway slot until closed"""
+
+    def __init__(self, gateway, events, started, waited=None):
+        self._gateway = gateway
+        self._events = events
+        self._started = started
+        self._waited = waited
+        self._usage = {}
+        self._failed = False
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            event = next(self._events)
+        except StopIteration:
+            self.close()
+            raise
+        if event['type'] == 'error':
+            self._failed = True
+        elif event['type'] == 'done':
+            self._usage = event
+        return event
+
+    def close(self):
+        # Safe to call more than once, including before iteration started
+        if self._closed:
+            return
+        self._closed = True
+        self._events.close()
+        self._gateway._release(self._started, self._failed)
+        observe_llm_call('stream', time.monotonic() - self._started, self._failed, self._waited,
+                         self._usage.get('prompt_tokens'), self._usage.get('tokens_used'))
+
+
+def _percentiles(values):
+    if not values:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0}
+    last = len(values) - 1
+    return {
+        'p50': round(values[int(last * 0.50)], 4),
+        'p95': round(values[int(last * 0.95)], 4),
+        'p99': round(values[int(last * 0.99)], 4)
+    }
@@ -1,37 +1,77 @@
+import logging
 import os
-import sys
-sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import time
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Blueprint, current_app, request, jsonify, g, Response, stream_with_context
 from flask_cors import CORS
 from functools import wraps
 import jwt
+import json
 from datetime import datetime
+from bson import ObjectId
 
 from src.config import get_config
 from src.database import (
-    User, Credits, TutoringSession, Upload,
-    generate_jwt_token, verify_jwt_token
+    User, UserStats, Credits, Usage, TutoringSession, Upload, AdminJob,
+    issue_tokens, generate_jwt_token, decode_jwt_token, current_claims,
+    authz_versions, user_cache, waitlist_rank, mongo, ACCESS_TOKEN_TTL
 )
-from src.ai_service import DeepSeekService, load_prompt_template, fill_template
+from src.indexes import ensure_indexes
+from src.llm_client import DeepSeekClient
+from src.llm_gateway import LLMGateway, GatewayOverloaded
+from src.context import build_context
+from src.prompts import prompt_registry
+from src.response_cache import ResponseCache
+from src.tokens import token_estimator
+from src.static_assets import AssetManifest
+from src.retrieval import retrieve, format_chunks, drop_user, remove_upload, NO_CONTENT, vector_indexes, lexical_indexes
+from src.passwords import PasswordHasherBusy
+from src.ingest import (
+    ingester, spool_upload, supported_types, file_type_of,
+    IngestBusy, UploadTooLarge, UPLOAD_MAX_BYTES
+)
+from src.admin_jobs import admin_jobs, parse_targets, AdminJobsBusy
+from src import metrics
 
 config = get_config()
-app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
-app.config['SECRET_KEY'] = config.SECRET_KEY
 
-# Enable CORS with proper configuration
-CORS(app, 
-     origins=["https://5000-ijm6ddv0krjs7u1jnra4f-2787b946.manusvm.computer", "http://localhost:3000", "http://localhost:5000"],
-     supports_credentials=True,
-     allow_headers=["Content-Type", "Authorization", "Origin", "Accept", "X-Requested-With"],
-     methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-     expose_headers=["Content-Type", "Authorization"])
+logger = logging.getLogger(__name__)
+
+STATIC_FOLDER = os.path.join(os.path.dirname(__file__), 'static')
+WARM_UP_ON_START = getattr(config, 'WARM_UP_ON_START', True)  # Connect and load caches in create_app()
+ENSURE_INDEXES_ON_START = getattr(config, 'ENSURE_INDEXES_ON_START', True)
+LLM_WARM_UP = getattr(config, 'LLM_WARM_UP', True)  # Pre-open a connection to the LLM API
+
+# All routes live on this blueprint; create_app() mounts it
+api = Blueprint('api', __name__)
+
+# Seconds spent in create_app() and warm_up() by this process
+startup_timings = {}
+
+# Initialize AI service behind a pooled, concurrency-bounded gateway. Nothing
+# connects here: the HTTP pool opens in each process on first use
+ai_service = LLMGateway(DeepSeekClient())
+response_cache = ResponseCache(ai_service.client.model)
+
+def _gateway_calls():
+    gateway = ai_service.metrics()
+    return {('in_flight',): gateway['in_flight'], ('queued',): gateway['queue_depth']}
 
-# Initialize AI service
-ai_service = DeepSeekService()
+metrics.registry.register(metrics.Gauge(
+    'rpm_llm_gateway_calls', 'LLM calls running and waiting for a slot', _gateway_calls, ('state',)))
+metrics.registry.register(metrics.Gauge(
+    'rpm_token_estimator_scale', 'Calibration factor of the offline token estimator',
+    lambda: {(): token_estimator.scale}))
+metrics.registry.register(metrics.Gauge(
+    'rpm_process_startup_seconds', 'Time this process spent building the app and warming up',
+    lambda: {(phase,): seconds for phase, seconds in startup_timings.items()}, ('phase',)))
+
+LLM_MAX_TOKENS = getattr(config, 'LLM_MAX_TOKENS', 1000)  # Longest reply a request may ask for
+LLM_MIN_REPLY_TOKENS = getattr(config, 'LLM_MIN_REPLY_TOKENS', 64)  # Shorter caps are refused, not sent
+LLM_CONTEXT_WINDOW = getattr(config, 'LLM_CONTEXT_WINDOW', 65536)  # Prompt plus reply limit of the model
 
 # Global OPTIONS handler for CORS preflight requests
-@app.before_request
+@api.before_app_request
 def handle_preflight():
     if request.method == "OPTIONS":
         response = jsonify({'status': 'ok'})
@@ -52,28 +92,54 @@ def require_auth(f):
         
         try:
             token = token.replace('Bearer ', '')
-            user_id = verify_jwt_token(token)
-            if not user_id:
+            payload = decode_jwt_token(token)
+            if not payload or authz_versions.is_deleted(payload['user_id']):
                 return jsonify({'error': 'Invalid token'}), 401
             
-            request.current_user_id = user_id
-            return f(*args, **kwargs)
+            request.current_user_id = payload['user_id']
+            # Trusted claims let gated routes skip the user lookup
+            g.token_claims = current_claims(payload)
         except Exception as e:
             return jsonify({'error': 'Token verification failed'}), 401
+        
+        return f(*args, **kwargs)
     
     return decorated_function
 
+def get_current_user():
+    """Load the authenticated user's document once per request"""
+    if 'current_user' not in g:
+        g.current_user = User.find_by_id(request.current_user_id)
+    return g.current_user
+
+def current_user_has(flag, claim):
+    """Check an authorization flag from fresh token claims, else from the user document"""
+    claims = g.get('token_claims')
+    if claims is not None:
+        return bool(claims.get(claim))
+    user = get_current_user()
+    return bool(user and user.get(flag, False))
+
+def current_user_is_admin():
+    return current_user_has('is_admin', 'adm')
+
 def require_whitelist(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        user = User.find_by_id(request.current_user_id)
-        if not user or not user.get('is_whitelisted', False):
+        if not current_user_has('is_whitelisted', 'wl'):
             return jsonify({'error': 'Access denied. You are on the waitlist.'}), 403
         return f(*args, **kwargs)
     return decorated_function
 
+def int_arg(name, default, low, high=None):
+    """Integer query parameter clamped to [low, high]; None when it is not an integer"""
+    value = request.args.get(name, type=int)
+    if value is None:
+        return None if request.args.get(name) else default
+    return max(low, value if high is None else min(value, high))
+
 # Health check
-@app.route('/api/health')
+@api.route('/api/health')
 def health_check():
     return jsonify({
         'status': 'healthy',
@@ -81,8 +147,13 @@ def health_check():
         'version': '1.0.0'
     })
 
+# Prometheus scrape endpoint (per process; see DEPLOYMENT_GUIDE.md)
+@api.route('/api/metrics')
+def get_metrics():
+    return metrics.metrics_response()
+
 # Google OAuth login (simplified - you'll need to implement full OAuth flow)
-@app.route('/api/auth/google', methods=['POST'])
+@api.route('/api/auth/google', methods=['POST'])
 def google_login():
     data = request.get_json()
     google_id = data.get('google_id')
@@ -97,15 +168,24 @@ def google_login():
     user = User.find_by_google_id(google_id)
     if not user:
         user_id = User.create_user(google_id, email, name, picture)
-        user = User.find_by_id(user_id)
+        if user_id:
+            user = User.find_by_id(user_id)
+        else:
+            # Either a concurrent sign-in created this Google user first, or
+            # the email belongs to an email/password account. Google ids are
+            # not verified here, so they are never linked onto existing accounts.
+            user = User.find_by_google_id(google_id)
+            if not user:
+                return jsonify({
+                    'error': 'This email is already registered with a password. Sign in with your email and password.',
+                    'code': 'email_registered'
+                }), 409
+            User.update_last_login(str(user['_id']))
     else:
         User.update_last_login(str(user['_id']))
     
-    # Generate JWT token
-    token = generate_jwt_token(str(user['_id']))
-    
     return jsonify({
-        'token': token,
+        **issue_tokens(user),
         'user': {
             'id': str(user['_id']),
             'email': user['email'],
@@ -118,7 +198,7 @@ def google_login():
     })
 
 # Manual user registration
-@app.route('/api/auth/register', methods=['POST'])
+@api.route('/api/auth/register', methods=['POST'])
 def register():
     data = request.get_json()
     email = data.get('email')
@@ -151,11 +231,8 @@ def register():
     # Get updated user
     user = User.find_by_id(user_id)
     
-    # Generate JWT token
-    token = generate_jwt_token(user_id)
-    
     return jsonify({
-        'token': token,
+        **issue_tokens(user),
         'user': {
             'id': str(user['_id']),
             'email': user['email'],
@@ -168,7 +245,7 @@ def register():
     }), 201
 
 # Manual user login
-@app.route('/api/auth/login', methods=['POST', 'OPTIONS'])
+@api.route('/api/auth/login', methods=['POST', 'OPTIONS'])
 def login():
     if request.method == 'OPTIONS':
         # Handle preflight request
@@ -194,11 +271,8 @@ def login():
     # Update last login
     User.update_last_login(str(user['_id']))
     
-    # Generate JWT token
-    token = generate_jwt_token(str(user['_id']))
-    
     return jsonify({
-        'token': token,
+        **issue_tokens(user),
         'user': {
             'id': str(user['_id']),
             'email': user['email'],
@@ -210,11 +284,28 @@ def login():
         }
     })
 
+# Exchange a refresh token for a new access token with current claims
+@api.route('/api/auth/refresh', methods=['POST'])
+def refresh_token():
+    data = request.get_json() or {}
+    payload = decode_jwt_token(data.get('refresh_token', ''), 'refresh')
+    if not payload:
+        return jsonify({'error': 'Invalid refresh token'}), 401
+    
+    user = User.find_by_id(payload['user_id'])
+    if not user:
+        return jsonify({'error': 'Invalid refresh token'}), 401
+    
+    return jsonify({
+        'token': generate_jwt_token(user, 'access'),
+        'expires_in': ACCESS_TOKEN_TTL
+    })
+
 # User status check
-@app.route('/api/user/status')
+@api.route('/api/user/status')
 @require_auth
 def user_status():
-    user = User.find_by_id(request.current_user_id)
+    user = get_current_user()
     credit_status = Credits.get_credit_status(request.current_user_id)
     
     return jsonify({
@@ -230,7 +321,7 @@ def user_status():
     })
 
 # Complete user profile
-@app.route('/api/user/profile', methods=['POST'])
+@api.route('/api/user/profile', methods=['POST'])
 @require_auth
 def complete_profile():
     data = request.get_json()
@@ -246,24 +337,22 @@ def complete_profile():
     return jsonify({'message': 'Profile completed successfully'})
 
 # Admin: Whitelist user
-@app.route('/api/admin/whitelist/<user_id>', methods=['PATCH'])
+@api.route('/api/admin/whitelist/<user_id>', methods=['PATCH'])
 @require_auth
 def whitelist_user(user_id):
     # Check if current user is admin
-    current_user = User.find_by_id(request.current_user_id)
-    if not current_user.get('is_admin', False):
+    if not current_user_is_admin():
         return jsonify({'error': 'Admin access required'}), 403
     
     User.whitelist_user(user_id)
     return jsonify({'message': 'User whitelisted successfully'})
 
 # Admin: Bulk whitelist users
-@app.route('/api/admin/bulk-whitelist', methods=['PATCH'])
+@api.route('/api/admin/bulk-whitelist', methods=['PATCH'])
 @require_auth
 def bulk_whitelist_users():
     # Check if current user is admin
-    current_user = User.find_by_id(request.current_user_id)
-    if not current_user.get('is_admin', False):
+    if not current_user_is_admin():
         return jsonify({'error': 'Admin access required'}), 403
     
     data = request.get_json()
@@ -278,48 +367,271 @@ def bulk_whitelist_users():
         'modified_count': result.modified_count
     })
 
+# Admin: Start a background job over many users (whitelist the next N, or
+# whitelist/delete a list of ids or emails given as JSON or as a CSV file)
+@api.route('/api/admin/jobs', methods=['POST'])
+@require_auth
+def create_admin_job():
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    next_n, invalid = None, 0
+    if request.mimetype == 'application/json':
+        data = request.get_json() or {}
+        action = data.get('action')
+        next_n = data.get('next')
+        user_ids = [str(user_id) for user_id in data.get('user_ids', [])]
+        emails = [str(email) for email in data.get('emails', [])]
+        bad_ids = [user_id for user_id in user_ids if not ObjectId.is_valid(user_id)]
+        if bad_ids:
+            return jsonify({'error': f'Invalid user IDs: {", ".join(bad_ids[:5])}'}), 400
+    else:
+        # CSV of ids and/or emails, as a raw body or a multipart "file" field
+        action = request.args.get('action') or request.form.get('action')
+        upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+        raw = upload.read() if upload else request.get_data()
+        user_ids, emails, invalid = parse_targets(raw.decode('utf-8-sig', errors='replace'))
+    
+    try:
+        job_id = admin_jobs.submit(action, request.current_user_id, next_n, user_ids, emails)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except AdminJobsBusy as e:
+        response = jsonify({'error': 'Too many admin jobs running, please retry shortly'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    
+    return jsonify({'job': serialize_job(AdminJob.get(job_id)), 'invalid_rows': invalid}), 202
+
+def serialize_job(job):
+    """Admin job status and progress counters"""
+    total = job.get('total')
+    return {
+        'id': str(job['_id']),
+        'action': job['action'],
+        'source': job['source'],
+        'status': job['status'],
+        'total': total,
+        'processed': job['processed'],
+        'succeeded': job['succeeded'],
+        'skipped': job['skipped'],
+        'failed': job['failed'],
+        'progress': round(job['processed'] / total, 4) if total else None,
+        'errors': job.get('errors', []),
+        'error': job.get('error'),
+        'created_by': job.get('created_by'),
+        'created_at': job['created_at'].isoformat(),
+        'started_at': job['started_at'].isoformat() if job.get('started_at') else None,
+        'finished_at': job['finished_at'].isoformat() if job.get('finished_at') else None
+    }
+
+# Admin: Recent jobs
+@api.route('/api/admin/jobs', methods=['GET'])
+@require_auth
+def list_admin_jobs():
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    limit = int_arg('limit', 20, 1, 100)
+    if limit is None:
+        return jsonify({'error': 'limit must be an integer'}), 400
+    return jsonify({'jobs': [serialize_job(job) for job in AdminJob.list_recent(limit)]})
+
+# Admin: Poll a job's progress
+@api.route('/api/admin/jobs/<job_id>', methods=['GET'])
+@require_auth
+def get_admin_job(job_id):
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    job = AdminJob.get(job_id) if ObjectId.is_valid(job_id) else None
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    return jsonify({'job': serialize_job(job)})
+
+# Admin: Usage analytics from the per-day ledger, grouped by day, user or topic
+@api.route('/api/admin/usage', methods=['GET'])
+@require_auth
+def usage_summary():
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    group_by = request.args.get('group', 'day')
+    if group_by not in Usage.GROUPS:
+        return jsonify({'error': f"group must be one of {', '.join(Usage.GROUPS)}"}), 400
+    days = int_arg('days', 30, 1, 366)
+    limit = int_arg('limit', 100, 1, 1000)
+    if days is None or limit is None:
+        return jsonify({'error': 'days and limit must be integers'}), 400
+    
+    rows = Usage.summary(group_by, days, request.args.get('user_id'), limit)
+    for row in rows:
+        if 'day' in row:
+            row['day'] = row['day'].strftime('%Y-%m-%d')
+    return jsonify({'group': group_by, 'days': days, 'rows': rows})
+
 # Admin: List all users (with pagination)
-@app.route('/api/admin/users', methods=['GET'])
+@api.route('/api/admin/users', methods=['GET'])
 @require_auth
 def list_users():
     # Check if current user is admin
-    current_user = User.find_by_id(request.current_user_id)
-    if not current_user.get('is_admin', False):
+    if not current_user_is_admin():
         return jsonify({'error': 'Admin access required'}), 403
     
-    page = int(request.args.get('page', 1))
-    limit = int(request.args.get('limit', 50))
+    page = int_arg('page', 1, 1)
+    limit = int_arg('limit', 50, 1, 200)
+    if page is None or limit is None:
+        return jsonify({'error': 'page and limit must be integers'}), 400
     filter_type = request.args.get('filter', 'all')  # all, waitlist, whitelisted
+    cursor = request.args.get('cursor')  # next_cursor/prev_cursor from a previous page
     
-    users = User.list_users(page, limit, filter_type)
+    users = User.list_users(page, limit, filter_type, cursor)
     return jsonify(users)
 
 # Admin: Make user admin
-@app.route('/api/admin/make-admin/<user_id>', methods=['PATCH'])
+@api.route('/api/admin/make-admin/<user_id>', methods=['PATCH'])
 @require_auth
 def make_admin(user_id):
     # Check if current user is admin
-    current_user = User.find_by_id(request.current_user_id)
-    if not current_user.get('is_admin', False):
+    if not current_user_is_admin():
         return jsonify({'error': 'Admin access required'}), 403
     
     User.make_admin(user_id)
     return jsonify({'message': 'User granted admin access successfully'})
 
 # Admin: Get waitlist stats
-@app.route('/api/admin/stats', methods=['GET'])
+@api.route('/api/admin/stats', methods=['GET'])
 @require_auth
 def get_admin_stats():
     # Check if current user is admin
-    current_user = User.find_by_id(request.current_user_id)
-    if not current_user.get('is_admin', False):
+    if not current_user_is_admin():
         return jsonify({'error': 'Admin access required'}), 403
     
     stats = User.get_user_stats()
     return jsonify(stats)
 
+# Admin: Recompute dashboard counters and repair drift
+@api.route('/api/admin/stats/reconcile', methods=['POST'])
+@require_auth
+def reconcile_admin_stats():
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    UserStats.reconcile()
+    return jsonify(User.get_user_stats())
+
+# Admin: User cache counters
+@api.route('/api/admin/cache-stats', methods=['GET'])
+@require_auth
+def get_cache_stats():
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    return jsonify({
+        'user_cache': user_cache.stats(),
+        'vector_indexes': vector_indexes.stats(),
+        'lexical_indexes': lexical_indexes.stats()
+    })
+
+# Admin: LLM gateway queue depth and latency
+@api.route('/api/admin/llm-metrics', methods=['GET'])
+@require_auth
+def get_llm_metrics():
+    if not current_user_is_admin():
+        return jsonify({'error': 'Admin access required'}), 403
+    
+    return jsonify(dict(ai_service.metrics(), response_cache=response_cache.stats(),
+                        token_estimator=token_estimator.stats()))
+
+def retrieved_context(user, message):
+    """Relevant chunks of the user's uploads, or the general-knowledge fallback"""
+    try:
+        return format_chunks(retrieve(str(user['_id']), message))
+    except Exception:
+        logger.exception('Error retrieving upload chunks')
+        return NO_CONTENT
+
+def build_tutor_messages(user, topic, message, session=None):
+    """Build the system prompt and chat messages for a tutoring turn"""
+    prompt = prompt_registry.render(
+        'tutor_prompt_template',
+        user_level=user.get('academic_level', 'intermediate'),
+        subject_interest=user.get('subject_interest', 'general'),
+        learning_goals=user.get('learning_goals', 'improve understanding'),
+        topic_name=topic,
+        retrieved_chunks=retrieved_context(user, message)
+    )
+    
+    return build_context(session, prompt, message)
+
+def overloaded_response(error):
+    """503 response telling the client when to retry"""
+    response = jsonify({'error': 'AI service is busy, please retry shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+@api.app_errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    response = jsonify({'error': 'Too many login attempts in progress, please retry shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def price_request(messages, topic):
+    """Reserve credits for the estimated prompt plus the longest reply the user can afford
+
+    Returns (reservation, max_tokens, prompt_tokens). The reservation is None
+    when not even LLM_MIN_REPLY_TOKENS fit in the user's remaining credits,
+    and max_tokens is None when the prompt alone overflows the model.
+    """
+    prompt_tokens = token_estimator.count_messages(messages)
+    max_tokens = min(LLM_MAX_TOKENS, LLM_CONTEXT_WINDOW - prompt_tokens)
+    if max_tokens < LLM_MIN_REPLY_TOKENS:
+        return None, None, prompt_tokens
+    
+    user_id = request.current_user_id
+    reservation = Credits.reserve_credits(user_id, Credits.credits_for_tokens(prompt_tokens + max_tokens), topic)
+    if reservation is None:
+        # Not enough for a full reply: cap the reply to what is left today
+        remaining = Credits.get_credit_status(user_id)['remaining_credits']
+        max_tokens = min(max_tokens, remaining * config.TOKENS_PER_CREDIT - prompt_tokens)
+        if max_tokens >= LLM_MIN_REPLY_TOKENS:
+            reservation = Credits.reserve_credits(
+                user_id, Credits.credits_for_tokens(prompt_tokens + max_tokens), topic
+            )
+    return reservation, max_tokens, prompt_tokens
+
+def unpriced_response(max_tokens):
+    """Error for a request price_request could not reserve"""
+    if max_tokens is None:
+        return jsonify({'error': 'Message is too long'}), 413
+    return jsonify({'error': 'Insufficient credits'}), 402
+
+def cached_reply(messages, max_tokens, opt_out=False):
+    """Look up a tutoring request in the response cache; returns (cache key or None, reply or None)"""
+    cacheable, reason = response_cache.cacheable(messages, opt_out)
+    if not cacheable:
+        response_cache.skip(reason)
+        return None, None
+    cache_key = response_cache.key(messages, max_tokens=max_tokens)
+    return cache_key, response_cache.get(cache_key)
+
+def settle_cached_reply(reservation, session_id, message, cached):
+    """Bill a cache hit at the discounted rate and save the turn"""
+    tokens_used = cached['tokens_used']
+    settlement = Credits.commit_credits(reservation, tokens_used, Credits.credits_for_cache_hit(tokens_used), cached=True)
+    TutoringSession.add_turn(session_id, message, cached['content'], tokens_used)
+    return settlement
+
+def sse_event(event, data):
+    """Format a server-sent event frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
 # Tutoring session
-@app.route('/api/tutor', methods=['POST'])
+@api.route('/api/tutor', methods=['POST'])
 @require_auth
 @require_whitelist
 def tutor_session():
@@ -331,87 +643,345 @@ def tutor_session():
     if not message:
         return jsonify({'error': 'Message is required'}), 400
     
-    # Check credits
-    if not Credits.can_use_credits(request.current_user_id, 150):  # Estimate
-        return jsonify({'error': 'Insufficient credits'}), 402
+    session = None
+    if session_id:
+        session = TutoringSession.get_session(session_id) if ObjectId.is_valid(session_id) else None
+        if not session or session.get('user_id') != request.current_user_id:
+            return jsonify({'error': 'Session not found'}), 404
     
     # Get user info for personalization
-    user = User.find_by_id(request.current_user_id)
+    user = get_current_user()
+    messages = build_tutor_messages(user, topic, message, session)
+    
+    # Reserve credits for the priced request up front; settled against real usage below
+    reservation, max_tokens, prompt_tokens = price_request(messages, session.get('topic', topic) if session else topic)
+    if not reservation:
+        return unpriced_response(max_tokens)
     
     # Create or get session
     if not session_id:
         session_id = TutoringSession.create_session(request.current_user_id, topic)
     
-    # Load and fill prompt template
-    template = load_prompt_template('tutor_prompt_template')
-    prompt = fill_template(
-        template,
-        user_level=user.get('academic_level', 'intermediate'),
-        subject_interest=user.get('subject_interest', 'general'),
-        learning_goals=user.get('learning_goals', 'improve understanding'),
-        topic_name=topic,
-        retrieved_chunks="No specific content uploaded yet. Use general knowledge."
-    )
-    
-    # Prepare messages for AI
-    messages = [
-        {"role": "system", "content": prompt},
-        {"role": "user", "content": message}
-    ]
+    # Repeated first questions are answered from the cache at a discount
+    cache_key, cached = cached_reply(messages, max_tokens, data.get('no_cache', False))
+    if cached:
+        settlement = settle_cached_reply(reservation, session_id, message, cached)
+        return jsonify({
+            'response': cached['content'],
+            'session_id': session_id,
+            'tokens_used': cached['tokens_used'],
+            'credits_remaining': settlement['remaining_credits'],
+            'cached': True
+        })
     
     # Get AI response
-    response = ai_service.chat_completion(messages)
+    try:
+        response = ai_service.chat_completion(messages, max_tokens=max_tokens)
+    except GatewayOverloaded as e:
+        Credits.refund_credits(reservation)
+        return overloaded_response(e)
     
     if 'error' in response:
+        Credits.refund_credits(reservation)
         return jsonify({'error': 'AI service error'}), 500
     
-    # Deduct credits
-    Credits.deduct_credits(request.current_user_id, response['tokens_used'])
+    # Settle credits
+    settlement = Credits.commit_credits(reservation, response['tokens_used'])
+    token_estimator.observe(prompt_tokens, response.get('prompt_tokens'))
     
-    # Save messages to session
-    TutoringSession.add_message(session_id, 'user', message)
-    TutoringSession.add_message(session_id, 'assistant', response['content'], response['tokens_used'])
+    # Save both turns to the session
+    TutoringSession.add_turn(session_id, message, response['content'], response['tokens_used'])
+    
+    if cache_key:
+        response_cache.put(cache_key, response['content'], response['tokens_used'])
     
     return jsonify({
         'response': response['content'],
         'session_id': session_id,
         'tokens_used': response['tokens_used'],
-        'credits_remaining': Credits.get_credit_status(request.current_user_id)['remaining_credits']
+        'credits_remaining': settlement['remaining_credits'],
+        'cached': False
     })
 
+# Streaming tutoring session (server-sent events)
+@api.route('/api/tutor/stream', methods=['POST'])
+@require_auth
+@require_whitelist
+def tutor_session_stream():
+    data = request.get_json()
+    message = data.get('message')
+    topic = data.get('topic', 'General Learning')
+    session_id = data.get('session_id')
+    
+    if not message:
+        return jsonify({'error': 'Message is required'}), 400
+    
+    session = None
+    if session_id:
+        session = TutoringSession.get_session(session_id) if ObjectId.is_valid(session_id) else None
+        if not session or session.get('user_id') != request.current_user_id:
+            return jsonify({'error': 'Session not found'}), 404
+    
+    user = get_current_user()
+    messages = build_tutor_messages(user, topic, message, session)
+    
+    reservation, max_tokens, prompt_tokens = price_request(messages, session.get('topic', topic) if session else topic)
+    if not reservation:
+        return unpriced_response(max_tokens)
+    
+    if not session_id:
+        session_id = TutoringSession.create_session(request.current_user_id, topic)
+    
+    cache_key, cached = cached_reply(messages, max_tokens, data.get('no_cache', False))
+    if cached:
+        settlement = settle_cached_reply(reservation, session_id, message, cached)
+        
+        def replay():
+            yield sse_event('session', {'session_id': session_id})
+            yield sse_event('delta', {'content': cached['content']})
+            yield sse_event('done', {
+                'session_id': session_id,
+                'tokens_used': cached['tokens_used'],
+                'credits_remaining': settlement['remaining_credits'],
+                'cached': True
+            })
+        
+        return Response(replay(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    
+    try:
+        events = ai_service.stream_chat_completion(messages, max_tokens=max_tokens)
+    except GatewayOverloaded as e:
+        Credits.refund_credits(reservation)
+        return overloaded_response(e)
+    
+    parts = []
+    state = {'tokens_used': None, 'finished': False, 'failed': False}
+    
+    def finish():
+        # Runs once, whether the stream completed, failed or the client went away
+        events.close()
+        if state['finished']:
+            return None
+        state['finished'] = True
+        content = ''.join(parts)
+        if not content:
+            Credits.refund_credits(reservation)
+            TutoringSession.add_message(session_id, 'user', message)
+            return None
+        tokens_used = state['tokens_used']
+        if tokens_used is None:
+            # No usage frame (disconnect or upstream error): estimate from text
+            tokens_used = prompt_tokens + token_estimator.count(content)
+        settlement = Credits.commit_credits(reservation, tokens_used)
+        TutoringSession.add_turn(session_id, message, content, tokens_used)
+        if cache_key and state['tokens_used'] is not None and not state['failed']:
+            # Only complete replies are cached
+            response_cache.put(cache_key, content, tokens_used)
+        return dict(settlement, tokens_used=tokens_used)
+    
+    def generate():
+        yield sse_event('session', {'session_id': session_id})
+        for event in events:
+            if event['type'] == 'delta':
+                parts.append(event['content'])
+                yield sse_event('delta', {'content': event['content']})
+            elif event['type'] == 'done':
+                state['tokens_used'] = event['tokens_used']
+                token_estimator.observe(prompt_tokens, event.get('prompt_tokens'))
+            else:
+                state['failed'] = True
+        
+        result = finish()
+        if state['failed'] and not parts:
+            yield sse_event('error', {'error': 'AI service error'})
+        else:
+            yield sse_event('done', {
+                'session_id': session_id,
+                'tokens_used': result['tokens_used'] if result else 0,
+                'credits_remaining': result['remaining_credits'] if result else reservation['remaining_credits'],
+                'cached': False
+            })
+    
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Settles and persists on disconnect too, even if the stream never started
+    response.call_on_close(finish)
+    return response
+
+# List the user's recent sessions (summaries only)
+@api.route('/api/sessions', methods=['GET'])
+@require_auth
+def list_sessions():
+    limit = request.args.get('limit', type=int)
+    if limit is None and request.args.get('limit'):
+        return jsonify({'error': 'limit must be an integer'}), 400
+    
+    limit = 10 if limit is None else max(1, min(limit, 50))
+    sessions = TutoringSession.get_user_sessions(request.current_user_id, limit)
+    
+    return jsonify({'sessions': [
+        {
+            'id': str(session['_id']),
+            'topic': session.get('topic'),
+            'status': session.get('status'),
+            'message_count': session.get('message_count', 0),
+            'tokens_used': session.get('tokens_used', 0),
+            'credits_used': session.get('credits_used', 0),
+            'created_at': session['created_at'].isoformat() if session.get('created_at') else None,
+            'updated_at': session['updated_at'].isoformat() if session.get('updated_at') else None
+        }
+        for session in sessions
+    ]})
+
+# Paginated message history for a session (latest first, cursor moves backwards)
+@api.route('/api/sessions/<session_id>/messages', methods=['GET'])
+@require_auth
+def get_session_messages(session_id):
+    session = TutoringSession.get_session(session_id) if ObjectId.is_valid(session_id) else None
+    if not session or session.get('user_id') != request.current_user_id:
+        return jsonify({'error': 'Session not found'}), 404
+    
+    limit = request.args.get('limit', type=int)
+    before = request.args.get('before', type=int)
+    if (limit is None and request.args.get('limit')) or (before is None and request.args.get('before')):
+        return jsonify({'error': 'limit and before must be integers'}), 400
+    
+    limit = 20 if limit is None else max(1, min(limit, 100))
+    history = TutoringSession.get_messages(session_id, limit, before)
+    
+    return jsonify({
+        'messages': [
+            {
+                'seq': m['seq'],
+                'role': m['role'],
+                'content': m['content'],
+                'tokens_used': m.get('tokens_used', 0),
+                'timestamp': m['timestamp'].isoformat() if m.get('timestamp') else None
+            }
+            for m in history['messages']
+        ],
+        'next_cursor': history['next_cursor']
+    })
+
+# Upload study material: the body is spooled to disk and ingested in the background
+@api.route('/api/uploads', methods=['POST'])
+@require_auth
+@require_whitelist
+def create_upload():
+    if request.content_length and request.content_length > UPLOAD_MAX_BYTES + 64 * 1024:
+        return jsonify({'error': 'File too large'}), 413
+    
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    filename = upload.filename if upload else (request.args.get('filename') or request.headers.get('X-Filename'))
+    file_type = file_type_of(filename)
+    
+    if not filename:
+        return jsonify({'error': 'Filename is required'}), 400
+    if file_type not in supported_types():
+        return jsonify({'error': f"Unsupported file type. Allowed: {', '.join(supported_types())}"}), 415
+    
+    try:
+        path, size = spool_upload(upload.stream if upload else request.stream)
+    except UploadTooLarge:
+        return jsonify({'error': 'File too large'}), 413
+    
+    upload_id = Upload.create_pending_upload(request.current_user_id, filename, file_type, size)
+    try:
+        ingester.submit(upload_id, request.current_user_id, path, file_type)
+    except IngestBusy as e:
+        os.remove(path)
+        Upload.mark_failed(upload_id, 'Ingestion queue is full')
+        response = jsonify({'error': 'Upload processing is busy, please retry shortly'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    
+    return jsonify({'upload': serialize_upload(Upload.get_upload(upload_id))}), 202
+
+def serialize_upload(upload):
+    """Upload metadata and ingestion progress"""
+    return {
+        'id': str(upload['_id']),
+        'filename': upload.get('filename'),
+        'file_type': upload.get('file_type'),
+        'size_bytes': upload.get('size_bytes'),
+        'status': upload.get('status', 'indexed' if upload.get('vector_indexed') else 'queued'),
+        'pages_done': upload.get('pages_done', 0),
+        'pages_total': upload.get('pages_total'),
+        'chunk_count': upload.get('chunk_count', 0),
+        'vector_indexed': upload.get('vector_indexed', False),
+        'error': upload.get('error'),
+        'created_at': upload['created_at'].isoformat() if upload.get('created_at') else None,
+        'updated_at': upload['updated_at'].isoformat() if upload.get('updated_at') else None
+    }
+
+# List the user's uploads with their ingestion status
+@api.route('/api/uploads', methods=['GET'])
+@require_auth
+def list_uploads():
+    uploads = Upload.get_user_uploads(request.current_user_id)
+    return jsonify({'uploads': [serialize_upload(upload) for upload in uploads]})
+
+# Poll a single upload's ingestion progress
+@api.route('/api/uploads/<upload_id>', methods=['GET'])
+@require_auth
+def get_upload_status(upload_id):
+    try:
+        upload = Upload.get_upload(upload_id, request.current_user_id)
+    except Exception:
+        upload = None
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    
+    return jsonify({'upload': serialize_upload(upload)})
+
+# Delete an upload with its chunks and index entries
+@api.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@require_auth
+def delete_upload(upload_id):
+    if not ObjectId.is_valid(upload_id):
+        return jsonify({'error': 'Upload not found'}), 404
+    upload = Upload.get_upload(upload_id, request.current_user_id)
+    if not upload:
+        return jsonify({'error': 'Upload not found'}), 404
+    if upload.get('status') in ('queued', 'processing'):
+        # The ingester would keep adding chunks for it
+        return jsonify({'error': 'Upload is still being processed'}), 409
+    
+    if Upload.delete_upload(upload_id, request.current_user_id) is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    remove_upload(request.current_user_id, upload_id)
+    return jsonify({'message': 'Upload deleted successfully'})
+
 # Get credits status
-@app.route('/api/credits')
+@api.route('/api/credits')
 @require_auth
 def get_credits():
     credit_status = Credits.get_credit_status(request.current_user_id)
     return jsonify(credit_status)
 
-# Serve frontend
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
+# Serve frontend from the startup-built asset manifest
+@api.route('/', defaults={'path': ''})
+@api.route('/<path:path>')
 def serve(path):
-    static_folder_path = app.static_folder
-    if static_folder_path is None:
+    static_assets = current_app.extensions.get('static_assets')
+    if static_assets is None:
         return "Static folder not configured", 404
-
-    if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
-    else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
-        else:
-            return "Frontend not built", 404
+    return static_assets.response(path, request)
 
 
 # User waitlist status
-@app.route('/api/user/waitlist', methods=['GET'])
+@api.route('/api/user/waitlist', methods=['GET'])
 @require_auth
 def get_user_waitlist_status():
     """Get the current user's waitlist status and position."""
     try:
-        user_id = request.user_id
-        user = User.find_by_id(user_id)
+        user_id = request.current_user_id
+        user = get_current_user()
         
         if not user:
             return jsonify({'error': 'User not found'}), 404
@@ -439,34 +1009,91 @@ def get_user_waitlist_status():
             }
         })
         
-    except Exception as e:
-        print(f"Error getting waitlist status: {e}")
+    except Exception:
+        logger.exception('Error getting waitlist status')
         return jsonify({'error': 'Internal server error'}), 500
 
 
-if __name__ == '__main__':
-    port = int(os.environ.get('PORT', 5000))
-    debug = config.FLASK_ENV == 'development'
-    app.run(host='0.0.0.0', port=port, debug=debug)
-
-
 # Admin: Delete user
-@app.route("/api/admin/users/<user_id>", methods=["DELETE"])
+@api.route("/api/admin/users/<user_id>", methods=["DELETE"])
 @require_auth
 def delete_user_route(user_id):
     # Check if current user is admin
-    current_user = User.find_by_id(request.current_user_id)
-    if not current_user.get('is_admin', False):
+    if not current_user_is_admin():
         return jsonify({"error": "Admin access required"}), 403
     
     # Prevent admin from deleting themselves
     if str(request.current_user_id) == user_id:
         return jsonify({"error": "Cannot delete your own admin account"}), 400
 
-    result = User.delete_user(user_id)
-    if result.deleted_count == 0:
+    if not ObjectId.is_valid(user_id):
         return jsonify({"error": "User not found"}), 404
+
+    deleted = User.delete_user(user_id)
+    if not deleted:
+        return jsonify({"error": "User not found"}), 404
+    drop_user(user_id)
     
     return jsonify({"message": "User deleted successfully"}), 200
 
 
+def warm_up():
+    """Open this process's connections and load its caches before it takes traffic"""
+    started = time.perf_counter()
+    steps = {}
+
+    def step(name, fn):
+        t0 = time.perf_counter()
+        try:
+            fn()
+        except Exception:
+            # A cold cache or pool is slower, not broken; serve anyway
+            logger.exception('Warm-up step %s failed', name)
+        steps[name] = round(time.perf_counter() - t0, 4)
+
+    step('mongo', mongo.ping)
+    if ENSURE_INDEXES_ON_START:
+        step('indexes', ensure_indexes)
+    step('waitlist', waitlist_rank.refresh)
+    if LLM_WARM_UP:
+        step('llm', ai_service.client.warm_up)
+    startup_timings['warm_up'] = time.perf_counter() - started
+    return steps
+
+def create_app(static_folder=STATIC_FOLDER, warm=None):
+    """Build the Flask app; run once per worker process (see src/wsgi.py)"""
+    started = time.perf_counter()
+    app = Flask(__name__, static_folder=static_folder)
+    app.config['SECRET_KEY'] = config.SECRET_KEY
+
+    # Enable CORS with proper configuration
+    CORS(app, 
+         origins=["https://5000-ijm6ddv0krjs7u1jnra4f-2787b946.manusvm.computer", "http://localhost:3000", "http://localhost:5000"],
+         supports_credentials=True,
+         allow_headers=["Content-Type", "Authorization", "Origin", "Accept", "X-Requested-With"],
+         methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+         expose_headers=["Content-Type", "Authorization"])
+
+    app.register_blueprint(api)
+
+    # Per-route latency, Mongo and LLM timings for /api/metrics
+    metrics.init_app(app)
+
+    # Hash, index and (for small files) load the frontend build once
+    app.extensions['static_assets'] = AssetManifest(
+        static_folder,
+        memory_file_limit=getattr(config, 'STATIC_MEMORY_FILE_LIMIT', 256 * 1024),
+        memory_budget=getattr(config, 'STATIC_MEMORY_BUDGET', 32 * 1024 * 1024)
+    ) if static_folder else None
+    startup_timings['create_app'] = time.perf_counter() - started
+
+    if WARM_UP_ON_START if warm is None else warm:
+        warm_up()
+    return app
+
+
+if __name__ == '__main__':
+    # Development server; see DEPLOYMENT_GUIDE.md for gunicorn
+    port = int(os.environ.get('PORT', 5000))
+    debug = config.FLASK_ENV == 'development'
+    create_app().run(host='0.0.0.0', port=port, debug=debug)
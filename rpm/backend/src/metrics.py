@@ -0,0 +1,301 @@
+import contextvars
+import json
+import logging
+import math
+import threading
+import time
+
+from flask import Response, request
+from pymongo import monitoring
+
+from src.config import get_config
+
+config = get_config()
+
+SLOW_REQUEST_SECONDS = getattr(config, 'SLOW_REQUEST_SECONDS', None)  # None disables the slow-request log
+SLOW_REQUEST_MAX_COMMANDS = 50  # Mongo commands listed per slow request
+METRICS_TOKEN = getattr(config, 'METRICS_TOKEN', None)  # Bearer token for /api/metrics, if set
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DB_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+logger = logging.getLogger(__name__)
+slow_log = logging.getLogger('rpm.slow_requests')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}'
+
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets, labelnames=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            snapshot = {labels: (list(s[0]), s[1], s[2]) for labels, s in self._series.items()}
+        for labels, (counts, total, count) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', _number(bound))])} {cumulative}"
+            yield f'{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}'
+            yield f'{self.name}_count{_labels(self.labelnames, labels)} {count}'
+
+
+class Gauge:
+    """Value read from a callback at scrape time; the callback returns {label tuple: value}"""
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, read, labelnames=()):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        for labels, value in sorted(self.read().items()):
+            yield f'{self.name}{_labels(self.labelnames, labels)} {_number(value)}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception:
+                # A failing gauge callback must not break the whole scrape
+                logger.exception('Error collecting metric %s', metric.name)
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(samples)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.register(Counter(
+    'rpm_http_requests_total', 'HTTP requests by route, method and status', ('route', 'method', 'status')))
+http_latency = registry.register(Histogram(
+    'rpm_http_request_duration_seconds', 'HTTP request latency by route', LATENCY_BUCKETS, ('route', 'method')))
+http_mongo_commands = registry.register(Histogram(
+    'rpm_http_request_mongo_commands', 'Mongo commands issued per HTTP request', COUNT_BUCKETS, ('route',)))
+http_mongo_seconds = registry.register(Histogram(
+    'rpm_http_request_mongo_seconds', 'Time spent in Mongo per HTTP request', LATENCY_BUCKETS, ('route',)))
+mongo_commands = registry.register(Counter(
+    'rpm_mongo_commands_total', 'Mongo commands by name, collection and outcome', ('command', 'collection', 'outcome')))
+mongo_latency = registry.register(Histogram(
+    'rpm_mongo_command_duration_seconds', 'Mongo command round-trip time', DB_LATENCY_BUCKETS, ('command',)))
+llm_latency = registry.register(Histogram(
+    'rpm_llm_request_duration_seconds', 'Upstream LLM call duration', LATENCY_BUCKETS, ('mode', 'outcome')))
+llm_queue_wait = registry.register(Histogram(
+    'rpm_llm_queue_wait_seconds', 'Time waiting for an LLM gateway slot', LATENCY_BUCKETS))
+llm_tokens = registry.register(Counter(
+    'rpm_llm_tokens_total', 'Tokens billed by the LLM API', ('kind',)))
+llm_prompt_tokens = registry.register(Histogram(
+    'rpm_llm_prompt_tokens', 'Prompt tokens per LLM call', TOKEN_BUCKETS))
+
+
+# Per-request breakdown, set by the Flask hooks and filled in by the Mongo
+# listener and the LLM gateway on whatever thread serves the request
+_trace = contextvars.ContextVar('rpm_request_trace', default=None)
+
+
+class RequestTrace:
+    __slots__ = ('started', 'mongo_count', 'mongo_seconds', 'commands', 'llm_calls', 'llm_seconds', 'status',
+                 'streamed')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.mongo_count = 0
+        self.mongo_seconds = 0.0
+        self.commands = []
+        self.llm_calls = 0
+        self.llm_seconds = 0.0
+        self.status = None
+        self.streamed = False
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Counts and times every command a MongoClient sends"""
+
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if event.command_name == 'getMore':
+            collection = event.command.get('collection')
+        self._pending[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ''
+
+    def _finish(self, event, outcome):
+        collection = self._pending.pop((event.connection_id, event.request_id), '')
+        seconds = event.duration_micros / 1e6
+        mongo_commands.inc(event.command_name, collection, outcome)
+        mongo_latency.observe(seconds, event.command_name)
+        trace = _trace.get()
+        if trace is not None:
+            trace.mongo_count += 1
+            trace.mongo_seconds += seconds
+            if len(trace.commands) < SLOW_REQUEST_MAX_COMMANDS:
+                trace.commands.append((event.command_name, collection, round(seconds * 1000, 2)))
+
+    def succeeded(self, event):
+        self._finish(event, 'ok')
+
+    def failed(self, event):
+        self._finish(event, 'error')
+
+
+mongo_listener = MongoCommandListener()
+
+
+def observe_llm_call(mode, seconds, failed, queue_wait=None, prompt_tokens=None, total_tokens=None):
+    """Record one upstream LLM call"""
+    llm_latency.observe(seconds, mode, 'error' if failed else 'ok')
+    if queue_wait is not None:
+        llm_queue_wait.observe(queue_wait)
+    if prompt_tokens:
+        llm_prompt_tokens.observe(prompt_tokens)
+        llm_tokens.inc('prompt', amount=prompt_tokens)
+    if total_tokens:
+        llm_tokens.inc('completion', amount=max(0, total_tokens - (prompt_tokens or 0)))
+    trace = _trace.get()
+    if trace is not None:
+        trace.llm_calls += 1
+        trace.llm_seconds += seconds
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def _start_request():
+    _trace.set(RequestTrace())
+
+
+def _record_status(response):
+    trace = _trace.get()
+    if trace is not None:
+        trace.status = response.status_code
+        if response.is_streamed:
+            # Teardown runs before a streamed body is sent; time it to the
+            # last byte instead, when the server closes the response
+            trace.streamed = True
+            route, method, path = _route(), request.method, request.path
+            response.call_on_close(lambda: _observe(trace, route, method, path, trace.status))
+    return response
+
+
+def _finish_request(error=None):
+    trace = _trace.get()
+    if trace is None or trace.streamed:
+        return
+    _observe(trace, _route(), request.method, request.path, trace.status or (500 if error is not None else 200))
+
+
+def _observe(trace, route, method, path, status):
+    if _trace.get() is trace:
+        _trace.set(None)
+    elapsed = time.perf_counter() - trace.started
+    http_requests.inc(route, method, str(status))
+    http_latency.observe(elapsed, route, method)
+    http_mongo_commands.observe(trace.mongo_count, route)
+    http_mongo_seconds.observe(trace.mongo_seconds, route)
+    if SLOW_REQUEST_SECONDS is not None and elapsed >= SLOW_REQUEST_SECONDS:
+        slow_log.warning(json.dumps({
+            'route': route,
+            'method': method,
+            'path': path,
+            'status': status,
+            'seconds': round(elapsed, 4),
+            'mongo_commands': trace.mongo_count,
+            'mongo_seconds': round(trace.mongo_seconds, 4),
+            'llm_calls': trace.llm_calls,
+            'llm_seconds': round(trace.llm_seconds, 4),
+            'other_seconds': round(max(0.0, elapsed - trace.mongo_seconds - trace.llm_seconds), 4),
+            'commands': trace.commands
+        }))
+
+
+def metrics_response():
+    """The /api/metrics scrape response"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return Response('Unauthorized\n', 401, mimetype='text/plain')
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Time every request; registered ahead of the app's own before_request hooks"""
+    app.before_request_funcs.setdefault(None, []).insert(0, _start_request)
+    app.after_request(_record_status)
+    app.teardown_request(_finish_request)
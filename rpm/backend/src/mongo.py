@@ -0,0 +1,93 @@
+import os
+import threading
+
+from pymongo import MongoClient
+
+from src.config import get_config
+
+config = get_config()
+
+MONGODB_DATABASE = getattr(config, 'MONGODB_DATABASE', 'ai_tutoring_platform')
+
+# Connection pool and timeouts, passed to MongoClient as-is; None keeps the driver default
+MONGO_CLIENT_OPTIONS = {
+    'maxPoolSize': getattr(config, 'MONGO_MAX_POOL_SIZE', 100),
+    'minPoolSize': getattr(config, 'MONGO_MIN_POOL_SIZE', 0),
+    'maxIdleTimeMS': getattr(config, 'MONGO_MAX_IDLE_TIME_MS', None),
+    'waitQueueTimeoutMS': getattr(config, 'MONGO_WAIT_QUEUE_TIMEOUT_MS', None),
+    'connectTimeoutMS': getattr(config, 'MONGO_CONNECT_TIMEOUT_MS', 5000),
+    'serverSelectionTimeoutMS': getattr(config, 'MONGO_SERVER_SELECTION_TIMEOUT_MS', 10000),
+    'socketTimeoutMS': getattr(config, 'MONGO_SOCKET_TIMEOUT_MS', None),
+}
+
+
+class MongoConnection:
+    """MongoClient created on first use and again in every forked process"""
+
+    # A MongoClient's pooled sockets and monitor threads do not survive
+    # fork(), so a client opened in a pre-forking server's master must not
+    # be used by its workers. Nothing connects at import time; each process
+    # opens its own client the first time it touches a collection.
+
+    def __init__(self, uri, db_name=MONGODB_DATABASE, **options):
+        self.uri = uri
+        self.db_name = db_name
+        self.options = {k: v for k, v in dict(MONGO_CLIENT_OPTIONS, **options).items() if v is not None}
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    # The parent's client is dropped, not closed: closing it
+                    # here would act on sockets the parent still owns
+                    self._client = MongoClient(self.uri, **self.options)
+                    self._pid = os.getpid()
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[self.db_name]
+
+    @property
+    def connected(self):
+        """Whether this process has opened its client yet"""
+        return self._client is not None and self._pid == os.getpid()
+
+    def collection(self, name):
+        return LazyCollection(self, name)
+
+    def ping(self):
+        """Round trip to the server; opens the pool if this process has none yet"""
+        return self.db.command('ping')
+
+    def close(self):
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+
+
+class LazyCollection:
+    """Stand-in for a pymongo Collection that resolves against the current process's client"""
+
+    def __init__(self, connection, name):
+        self._connection = connection
+        self._resolved = None
+        self.name = name
+
+    def _collection(self):
+        client = self._connection.client
+        resolved = self._resolved
+        if resolved is None or resolved[0] is not client:
+            resolved = self._resolved = (client, client[self._connection.db_name][self.name])
+        return resolved[1]
+
+    def __getattr__(self, attr):
+        return getattr(self._collection(), attr)
+
+    def __repr__(self):
+        return f'LazyCollection({self._connection.db_name}.{self.name})'
@@ -0,0 +1,13 @@
+import bcrypt
+
+# Entry points of the bcrypt process pool in src/passwords.py. Pool children
+# are started with forkserver (or spawn), which imports this module fresh in
+# each of them, so it must stay free of config, Mongo and HTTP clients.
+
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def check_password(password, hashed):
+    return bcrypt.checkpw(password, hashed)
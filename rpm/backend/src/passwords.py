@@ -0,0 +1,107 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeout
+
+from src.config import get_config
+from src.password_worker import hash_password, check_password
+
+config = get_config()
+
+BCRYPT_ROUNDS = getattr(config, 'BCRYPT_ROUNDS', 12)
+PASSWORD_POOL_SIZE = getattr(config, 'PASSWORD_POOL_SIZE', os.cpu_count() or 2)
+PASSWORD_QUEUE_LIMIT = getattr(config, 'PASSWORD_QUEUE_LIMIT', 64)
+PASSWORD_TIMEOUT = getattr(config, 'PASSWORD_TIMEOUT', 10)
+PASSWORD_START_METHOD = getattr(config, 'PASSWORD_START_METHOD', 'forkserver')
+
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many hash/verify jobs are already queued"""
+
+    def __init__(self, retry_after=1):
+        super().__init__('Password hashing queue is full')
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """Runs bcrypt in a bounded process pool so request threads are not blocked on it"""
+
+    def __init__(self, rounds=BCRYPT_ROUNDS, workers=PASSWORD_POOL_SIZE,
+                 queue_limit=PASSWORD_QUEUE_LIMIT, timeout=PASSWORD_TIMEOUT):
+        self.rounds = rounds
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(queue_limit)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created lazily and per process, so pre-forking servers get their own pool.
+        # The pool is first used inside a threaded worker that holds Mongo and
+        # HTTP clients; forking it would copy their held locks and sockets into
+        # the children, so they are started from a clean forkserver (or spawn)
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    method = PASSWORD_START_METHOD
+                    if method not in multiprocessing.get_all_start_methods():
+                        method = 'spawn'
+                    context = multiprocessing.get_context(method)
+                    if method == 'forkserver':
+                        # Children fork from a server that has imported bcrypt and nothing else
+                        context.set_forkserver_preload(['src.password_worker'])
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def submit(self, fn, *args):
+        """Queue a bcrypt job, failing fast when the queue limit is reached"""
+        if not self._slots.acquire(blocking=False):
+            raise PasswordHasherBusy()
+        if self.workers <= 0:
+            # Inline mode (workers=0), e.g. for environments without multiprocessing
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._slots.release()
+            return future
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def _result(self, future):
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise PasswordHasherBusy()
+
+    def hash(self, password):
+        """Hash a password with the configured cost"""
+        return self._result(self.submit(hash_password, password.encode('utf-8'), self.rounds))
+
+    def hash_async(self, password):
+        """Hash in the background; returns a Future"""
+        return self.submit(hash_password, password.encode('utf-8'), self.rounds)
+
+    def verify(self, password, hashed):
+        """Check a password against a stored bcrypt hash"""
+        return self._result(self.submit(check_password, password.encode('utf-8'), hashed))
+
+    def needs_rehash(self, hashed):
+        """Whether a stored hash was made with a different cost factor"""
+        try:
+            return int(hashed.split(b'$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,118 @@
+import os
+import re
+import threading
+import time
+import zlib
+
+from src.config import get_config
+from src.cache import TTLCache
+from src.ai_service import load_prompt_template, fill_template
+
+config = get_config()
+
+PROMPT_TEMPLATE_DIR = getattr(config, 'PROMPT_TEMPLATE_DIR', os.path.join(os.path.dirname(__file__), 'prompts'))
+PROMPT_RENDER_CACHE_SIZE = getattr(config, 'PROMPT_RENDER_CACHE_SIZE', 4096)
+PROMPT_RELOAD_INTERVAL = getattr(config, 'PROMPT_RELOAD_INTERVAL', 2)
+
+TEMPLATE_FIELDS = ('user_level', 'subject_interest', 'learning_goals', 'topic_name', 'retrieved_chunks')
+TEMPLATE_EXTENSIONS = ('', '.txt', '.md')
+
+# Stand-in for a field inside memoized renders; swapped for the real value per request
+_SENTINEL = '\x00{}\x00'
+_SENTINEL_PATTERN = re.compile('\x00(' + '|'.join(TEMPLATE_FIELDS) + ')\x00')
+
+
+class CompiledTemplate:
+    """Template pre-split into literal text and field slots"""
+
+    def __init__(self, name, text, version):
+        self.name = name
+        self.text = text
+        self.version = version
+        # Compile through fill_template itself so placeholder syntax stays its concern
+        filled = fill_template(text, **{field: _SENTINEL.format(field) for field in TEMPLATE_FIELDS})
+        self.parts = _SENTINEL_PATTERN.split(filled)
+
+    def render(self, **values):
+        """Join literal segments with field values"""
+        return ''.join(
+            part if index % 2 == 0 else str(values.get(part, ''))
+            for index, part in enumerate(self.parts)
+        )
+
+
+class PromptRegistry:
+    """Loads each template once, reloads on file change and memoizes rendered prompts"""
+
+    def __init__(self, template_dir=PROMPT_TEMPLATE_DIR, cache_size=PROMPT_RENDER_CACHE_SIZE,
+                 reload_interval=PROMPT_RELOAD_INTERVAL):
+        self.template_dir = template_dir
+        self.reload_interval = reload_interval
+        self.rendered = TTLCache(maxsize=cache_size, ttl=None)
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def _find_file(self, name):
+        for extension in TEMPLATE_EXTENSIONS:
+            path = os.path.join(self.template_dir, name + extension)
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def _load(self, name, path):
+        if path is None:
+            # Not in the template directory: ai_service reads it, wherever it keeps it
+            text = load_prompt_template(name)
+            return CompiledTemplate(name, text, ('builtin', zlib.crc32(text.encode('utf-8'))))
+        stat = os.stat(path)
+        with open(path, encoding='utf-8') as f:
+            text = f.read()
+        return CompiledTemplate(name, text, (stat.st_mtime_ns, stat.st_size))
+
+    def _current(self, name, path, template):
+        """The template as it is now on disk, or the given one if unchanged"""
+        if path is None:
+            loaded = self._load(name, None)
+            return template if template is not None and template.version == loaded.version else loaded
+        stat = os.stat(path)
+        if template is None or template.version != (stat.st_mtime_ns, stat.st_size):
+            return self._load(name, path)
+        return template
+
+    def get(self, name):
+        """Return the compiled template, re-checking its source at most once per reload interval"""
+        now = time.monotonic()
+        entry = self._templates.get(name)
+        if entry and now - entry['checked_at'] < self.reload_interval:
+            return entry['template']
+
+        with self._lock:
+            entry = self._templates.get(name)
+            if entry and now - entry['checked_at'] < self.reload_interval:
+                return entry['template']
+            # A template served by ai_service may later be added to the directory
+            path = entry['path'] if entry and entry['path'] else self._find_file(name)
+            template = entry['template'] if entry and entry['path'] == path else None
+            try:
+                template = self._current(name, path, template)
+            except OSError:
+                if entry is None:
+                    raise
+                template = entry['template']
+            self._templates[name] = {'template': template, 'path': path, 'checked_at': now}
+            return template
+
+    def render(self, name, **fields):
+        """Render a template; output is memoized per template version and field values"""
+        template = self.get(name)
+        chunks = fields.pop('retrieved_chunks', '')
+        key = (name, template.version, tuple(sorted(fields.items())))
+
+        prompt = self.rendered.get(key)
+        if prompt is None:
+            prompt = template.render(retrieved_chunks=_SENTINEL.format('retrieved_chunks'), **fields)
+            self.rendered.set(key, prompt)
+        return prompt.replace(_SENTINEL.format('retrieved_chunks'), chunks)
+
+
+prompt_registry = PromptRegistry()
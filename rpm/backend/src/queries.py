@@ -0,0 +1,336 @@
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+# Query shapes of the data-access layer, shared by the sync models in
+# src/database.py and the async ones in src/async_database.py. Functions
+# here build filters, updates, projections and pipelines, or shape raw
+# results; they never touch a collection. Both layers send exactly what is
+# built here, so a query changed in one place changes for both.
+#
+# Writes that take more than one round trip are written here once as step
+# generators. A step generator yields operations, (collection name, method,
+# args, kwargs), and is sent each result or thrown each error; what it
+# returns is the result of the write. database.run_steps drives them with
+# blocking calls and async_database.run_steps with awaits, so the retries
+# and ordering are the same in both layers.
+
+EPOCH = datetime(1970, 1, 1)
+
+# Projections
+SESSION_FIELDS = {'messages': 0}  # Counters only; history lives in session_messages
+SESSION_LIST_FIELDS = {'messages': 0, 'content_chunks': 0}
+UPLOAD_FIELDS = {'chunks': 0, 'extracted_text': 0}
+CREDIT_ACCOUNT_FIELDS = {'total_credits_used': 1, 'archived_through': 1}
+BUCKET_CREDITS = {'credits': 1}
+
+
+def operation(collection, method, *args, **kwargs):
+    """One step of a step generator: a call to make on the named collection"""
+    return collection, method, args, kwargs
+
+
+# Users
+
+def user_by_id(user_id):
+    return {'_id': ObjectId(user_id)}
+
+
+def user_by_email(email):
+    return {'email': email}
+
+
+# Credits and the usage ledger
+
+def utc_today():
+    return datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def credits_for_tokens(tokens, tokens_per_credit):
+    """Convert a token count into billable credits"""
+    return max(1, tokens // tokens_per_credit)
+
+
+def credit_account(user_id):
+    return {'user_id': user_id}
+
+
+def new_credit_account(user_id):
+    return {
+        'user_id': user_id,
+        'total_credits_used': 0,  # Usage archived out of the ledger (see Usage.archive)
+        'archived_through': None,
+        'created_at': datetime.utcnow()
+    }
+
+
+def new_bucket_fields():
+    return {'created_at': datetime.utcnow(), 'tokens': 0, 'requests': 0, 'cache_hits': 0, 'topics': {}}
+
+
+def topic_key(topic):
+    """Field-safe topic name (no dots, no leading $)"""
+    key = (topic or 'General Learning').strip()[:100].replace('.', '_').lstrip('$')
+    return key or 'General Learning'
+
+
+def usage_totals_pipeline(user_id, today, archived_through=None):
+    """Credits used today and since the last archival, as one indexed aggregation"""
+    return [
+        {'$match': {'user_id': user_id, 'day': {'$gt': archived_through or EPOCH}}},
+        {'$group': {
+            '_id': None,
+            'total': {'$sum': '$credits'},
+            'today': {'$sum': {'$cond': [{'$eq': ['$day', today]}, '$credits', 0]}}
+        }}
+    ]
+
+
+def usage_totals(rows):
+    return {'total': rows[0]['total'], 'today': rows[0]['today']} if rows else {'total': 0, 'today': 0}
+
+
+def credit_status(account, totals, today, daily_limit):
+    """The /api/credits view of an account (or {}) and its ledger totals"""
+    used_today = totals['today']
+    return {
+        'remaining_credits': max(0, daily_limit - used_today),
+        'daily_limit': daily_limit,
+        'used_today': used_today,
+        'next_reset': today + timedelta(days=1),
+        'total_used': account.get('total_credits_used', 0) + totals['total']
+    }
+
+
+def reserve(user_id, day, credits, daily_limit):
+    """(filter, update) that holds credits in a day bucket only while the balance allows it
+
+    The balance check is part of the filter. When it fails, an upsert tries
+    to insert a second bucket for the day and hits the unique index; when it
+    passes on a missing bucket, the bucket is created. Callers retry once
+    without upsert on DuplicateKeyError.
+    """
+    return (
+        {'user_id': user_id, 'day': day, 'credits': {'$lte': daily_limit - credits}},
+        {'$inc': {'credits': credits}, '$setOnInsert': new_bucket_fields()}
+    )
+
+
+def reservation(user_id, credits, day, topic, bucket, daily_limit):
+    return {
+        'user_id': user_id,
+        'credits': credits,
+        'day': day,
+        'topic': topic,
+        'remaining_credits': max(0, daily_limit - bucket['credits'])
+    }
+
+
+def record_usage(user_id, day, credits=0, tokens=0, topic=None, charged=None, cached=False):
+    """(filter, update) adding one settled request to a day bucket, creating it if needed"""
+    increments = {'credits': credits, 'tokens': tokens, 'requests': 1}
+    if cached:
+        increments['cache_hits'] = 1
+    if topic is not None:
+        key = topic_key(topic)
+        increments[f'topics.{key}.tokens'] = tokens
+        increments[f'topics.{key}.credits'] = credits if charged is None else charged
+        increments[f'topics.{key}.requests'] = 1
+    set_on_insert = new_bucket_fields()
+    for name in increments:
+        set_on_insert.pop(name.split('.')[0], None)
+    return {'user_id': user_id, 'day': day}, {'$inc': increments, '$setOnInsert': set_on_insert}
+
+
+def record_usage_step(user_id, day, credits=0, tokens=0, topic=None, charged=None, cached=False):
+    """Operation adding one settled request to a day bucket; its result is the bucket's credits"""
+    return operation(
+        'usage_ledger', 'find_one_and_update', *record_usage(user_id, day, credits, tokens, topic, charged, cached),
+        upsert=True, projection=BUCKET_CREDITS, return_document=ReturnDocument.AFTER
+    )
+
+
+def reserve_steps(user_id, credits, day, topic, daily_limit):
+    """Hold credits in the day's bucket; returns a reservation, or None when the balance is too low"""
+    if credits > daily_limit:
+        return None
+
+    query, update = reserve(user_id, day, credits, daily_limit)
+    try:
+        bucket = yield operation('usage_ledger', 'find_one_and_update', query, update, upsert=True,
+                                 projection=BUCKET_CREDITS, return_document=ReturnDocument.AFTER)
+    except DuplicateKeyError:
+        # Either over the limit, or another request created the day's bucket first
+        bucket = yield operation('usage_ledger', 'find_one_and_update', query, update,
+                                 projection=BUCKET_CREDITS, return_document=ReturnDocument.AFTER)
+    if bucket is None:
+        return None
+
+    return reservation(user_id, credits, day, topic, bucket, daily_limit)
+
+
+def commit_steps(reservation, tokens_used, charged, cached, daily_limit):
+    """Settle a reservation against the real usage; returns the settlement"""
+    # Usage counts toward the day the request started, even if it ends after midnight
+    bucket = yield record_usage_step(
+        reservation['user_id'], reservation['day'],
+        credits=charged - reservation['credits'], tokens=tokens_used,
+        topic=reservation.get('topic'), charged=charged, cached=cached
+    )
+    return settlement(reservation, charged, bucket, utc_today(), daily_limit)
+
+
+def settlement(reservation, charged, bucket, today, daily_limit):
+    """Balance after committing a reservation; usage stays on the day the request started"""
+    used = bucket['credits'] if bucket and reservation['day'] == today else 0
+    return {
+        'credits_charged': charged,
+        'remaining_credits': max(0, daily_limit - used)
+    }
+
+
+def refund(reservation):
+    return (
+        {'user_id': reservation['user_id'], 'day': reservation['day']},
+        {'$inc': {'credits': -reservation['credits']}}
+    )
+
+
+# Tutoring sessions and their bucketed messages
+
+def new_session(user_id, topic, content_chunks=None):
+    now = datetime.utcnow()
+    return {
+        'user_id': user_id,
+        'topic': topic,
+        'content_chunks': content_chunks or [],
+        'message_count': 0,
+        'summary': '',
+        'summary_through': 0,
+        'tokens_used': 0,
+        'credits_used': 0,
+        'status': 'active',
+        'created_at': now,
+        'updated_at': now
+    }
+
+
+def session_by_id(session_id):
+    return {'_id': ObjectId(session_id)}
+
+
+def user_sessions(user_id):
+    """(filter, projection, sort) of a user's sessions, most recently active first"""
+    return {'user_id': user_id}, SESSION_LIST_FIELDS, [('updated_at', -1)]
+
+
+def allocate_messages(session_id, count, tokens_used, credits_used, now):
+    """(filter, update) reserving sequence numbers for count new messages on the session"""
+    return (
+        {'_id': ObjectId(session_id)},
+        {
+            '$inc': {'message_count': count, 'tokens_used': tokens_used, 'credits_used': credits_used},
+            '$set': {'updated_at': now, 'last_message_at': now}
+        }
+    )
+
+
+def message_bucket_writes(session_id, first_seq, messages, bucket_size, now):
+    """(filter, update) upserts appending messages, numbered from first_seq, to their buckets"""
+    buckets = {}
+    for offset, message in enumerate(messages):
+        seq = first_seq + offset
+        buckets.setdefault(seq // bucket_size, []).append(dict(message, seq=seq, timestamp=now))
+    return [
+        (
+            {'session_id': session_id, 'bucket': bucket},
+            {
+                '$push': {'messages': {'$each': bucket_messages}},
+                '$inc': {'count': len(bucket_messages)},
+                '$min': {'seq_start': bucket_messages[0]['seq']},
+                '$max': {'seq_end': bucket_messages[-1]['seq']},
+                '$setOnInsert': {'created_at': now}
+            }
+        )
+        for bucket, bucket_messages in buckets.items()
+    ]
+
+
+def append_messages_steps(session_id, messages, tokens_used, credits_used, bucket_size):
+    """Allocate sequence numbers on the session, then write all messages in one bulk_write
+
+    Returns the bulk_write result, or None when the session does not exist.
+    """
+    now = datetime.utcnow()
+    session = yield operation(
+        'sessions', 'find_one_and_update',
+        *allocate_messages(session_id, len(messages), tokens_used, credits_used, now),
+        projection={'message_count': 1}, return_document=ReturnDocument.AFTER
+    )
+    if session is None:
+        return None
+
+    first_seq = session['message_count'] - len(messages)
+    operations = [
+        UpdateOne(query, update, upsert=True)
+        for query, update in message_bucket_writes(session_id, first_seq, messages, bucket_size, now)
+    ]
+    return (yield operation('session_messages', 'bulk_write', operations, ordered=False))
+
+
+def message_page(session_id, before, bucket_size):
+    """Filter over the buckets that can hold messages older than before, or None if none can"""
+    if before is not None and before <= 0:
+        return None
+    query = {'session_id': session_id}
+    if before is not None:
+        query['bucket'] = {'$lte': (before - 1) // bucket_size}
+    return query
+
+
+class MessagePage:
+    """Collects the latest limit messages from buckets fed newest first"""
+
+    def __init__(self, limit, before=None):
+        self.limit = limit
+        self.before = before
+        self.messages = []
+
+    @property
+    def full(self):
+        return len(self.messages) >= self.limit
+
+    def add(self, bucket):
+        for message in sorted(bucket['messages'], key=lambda m: m['seq'], reverse=True):
+            if self.before is None or message['seq'] < self.before:
+                self.messages.append(message)
+
+    def result(self):
+        messages = self.messages[:self.limit]
+        messages.reverse()
+        next_cursor = messages[0]['seq'] if messages and messages[0]['seq'] > 0 else None
+        return {'messages': messages, 'next_cursor': next_cursor}
+
+
+def summary_update(session_id, summary, summary_through, expected_through):
+    """(filter, update) storing a rolling summary unless another request already advanced it"""
+    return (
+        {'_id': ObjectId(session_id), 'summary_through': expected_through or {'$in': [0, None]}},
+        {'$set': {'summary': summary, 'summary_through': summary_through}}
+    )
+
+
+# Uploads
+
+def upload_by_id(upload_id, user_id=None):
+    query = {'_id': ObjectId(upload_id)}
+    if user_id is not None:
+        query['user_id'] = user_id
+    return query
+
+
+def user_uploads(user_id):
+    """(filter, projection, sort) of a user's uploads, newest first"""
+    return {'user_id': user_id}, UPLOAD_FIELDS, [('created_at', -1)]
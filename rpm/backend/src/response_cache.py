@@ -0,0 +1,177 @@
+import atexit
+import hashlib
+import json
+import logging
+import re
+import threading
+import time
+import unicodedata
+
+from src.cache import TTLCache
+from src.config import get_config
+from src.database import CachedResponse
+
+config = get_config()
+
+LLM_CACHE_ENABLED = getattr(config, 'LLM_CACHE_ENABLED', True)
+LLM_CACHE_TTL = getattr(config, 'LLM_CACHE_TTL', 24 * 3600)
+LLM_CACHE_SIZE = getattr(config, 'LLM_CACHE_SIZE', 2048)
+LLM_CACHE_MAX_MESSAGE_CHARS = getattr(config, 'LLM_CACHE_MAX_MESSAGE_CHARS', 2000)
+LLM_CACHE_STATS_FLUSH_INTERVAL = getattr(config, 'LLM_CACHE_STATS_FLUSH_INTERVAL', 10)
+
+logger = logging.getLogger(__name__)
+
+# Sampling defaults of DeepSeekClient._payload, so explicit and implicit params share keys
+DEFAULT_PARAMS = {'temperature': 0.7, 'max_tokens': 1000}
+
+_SPACE = re.compile(r'\s+')
+
+
+def normalize_message(text):
+    """Canonical form of a question: Unicode-folded, lowercased, single-spaced"""
+    text = unicodedata.normalize('NFKC', text).casefold()
+    return _SPACE.sub(' ', text).strip().rstrip(' ?!.')
+
+
+def _digest(value):
+    return hashlib.sha256(value.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier LLM reply cache: an in-process LRU in front of a shared Mongo collection"""
+
+    # Keys cover everything that shapes the reply: a hash of the system
+    # prompt (learner profile, topic and retrieved chunks), the normalized
+    # question and the model and sampling params. Only first turns are
+    # cacheable, since later turns depend on the session's history. Shared
+    # hits are copied into the local tier for the rest of their lifetime.
+    #
+    # Cross-worker counters are batched in memory and written every
+    # flush_interval seconds (and at exit) as one $inc on the stats document
+    # plus one bulk write of per-entry hit counts, so lookups never write to
+    # Mongo themselves.
+
+    def __init__(self, model, maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL,
+                 max_message_chars=LLM_CACHE_MAX_MESSAGE_CHARS, enabled=LLM_CACHE_ENABLED,
+                 flush_interval=LLM_CACHE_STATS_FLUSH_INTERVAL):
+        self.model = model
+        self.ttl = ttl
+        self.max_message_chars = max_message_chars
+        self.enabled = enabled
+        self.flush_interval = flush_interval
+        self.local = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._counters = dict.fromkeys(
+            ('memory_hits', 'shared_hits', 'misses', 'uncacheable', 'stores', 'tokens_saved'), 0
+        )
+        self._pending = {}  # Shared counter deltas not yet written
+        self._pending_hits = {}  # Hits per entry not yet written
+        self._flushed_at = time.monotonic()
+        atexit.register(self.flush)
+
+    def _count(self, shared=None, entry=None, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._counters[name] += delta
+            for name, delta in (shared or {}).items():
+                self._pending[name] = self._pending.get(name, 0) + delta
+            if entry is not None:
+                self._pending_hits[entry] = self._pending_hits.get(entry, 0) + 1
+            due = shared and time.monotonic() - self._flushed_at >= self.flush_interval
+        if due and self._flush_lock.acquire(blocking=False):
+            threading.Thread(target=self._background_flush, daemon=True).start()
+
+    def _background_flush(self):
+        try:
+            self.flush()
+        finally:
+            self._flush_lock.release()
+
+    def flush(self):
+        """Write the counters batched since the last flush"""
+        with self._lock:
+            pending, hits = self._pending, self._pending_hits
+            self._pending, self._pending_hits = {}, {}
+            self._flushed_at = time.monotonic()
+        if not pending and not hits:
+            return
+        try:
+            CachedResponse.record(pending, hits)
+        except Exception:
+            logger.exception('Error flushing response cache counters')
+            # Keep them for the next flush
+            with self._lock:
+                for name, delta in pending.items():
+                    self._pending[name] = self._pending.get(name, 0) + delta
+                for key, count in hits.items():
+                    self._pending_hits[key] = self._pending_hits.get(key, 0) + count
+
+    def key(self, messages, **params):
+        """Cache key for a chat request"""
+        system = messages[0]['content'] if messages and messages[0]['role'] == 'system' else ''
+        return _digest(json.dumps({
+            'system': _digest(system),
+            'message': normalize_message(messages[-1]['content']),
+            'model': self.model,
+            'params': dict(DEFAULT_PARAMS, **params)
+        }, sort_keys=True))
+
+    def cacheable(self, messages, opt_out=False):
+        """Whether a request may be answered from (and stored in) the cache; returns (bool, reason)"""
+        if not self.enabled:
+            return False, 'disabled'
+        if opt_out:
+            return False, 'opted_out'
+        if len(messages) != 2 or messages[0]['role'] != 'system':
+            return False, 'history'
+        if len(messages[-1]['content']) > self.max_message_chars:
+            return False, 'long_message'
+        return True, None
+
+    def skip(self, reason):
+        """Record a request that bypassed the cache"""
+        self._count(uncacheable=1, shared={'uncacheable': 1, f'uncacheable_by.{reason}': 1})
+
+    def get(self, key):
+        """A cached reply {'content', 'tokens_used', 'tier'}, or None"""
+        entry = self.local.get(key)
+        tier = 'memory'
+        if entry is None:
+            document = CachedResponse.get(key)
+            if document is not None:
+                tier = 'shared'
+                entry = {'content': document['content'], 'tokens_used': document['tokens_used']}
+                remaining = (document['expires_at'] - document['created_at']).total_seconds()
+                self.local.set(key, entry, ttl=min(self.ttl, max(0, remaining)))
+        if entry is None:
+            self._count(misses=1, shared={'misses': 1})
+            return None
+        self._count(
+            tokens_saved=entry['tokens_used'], **{f'{tier}_hits': 1},
+            shared={'hits': 1, 'tokens_saved': entry['tokens_used']}, entry=key
+        )
+        return dict(entry, tier=tier)
+
+    def put(self, key, content, tokens_used):
+        """Store a complete reply in both tiers"""
+        if not content or not tokens_used:
+            return
+        entry = {'content': content, 'tokens_used': tokens_used}
+        self.local.set(key, entry)
+        CachedResponse.put(key, content, tokens_used, self.model, self.ttl)
+        self._count(stores=1)
+
+    def stats(self):
+        """Hit rate and tokens saved, for this worker and across all workers"""
+        with self._lock:
+            local = dict(self._counters)
+        hits = local['memory_hits'] + local['shared_hits']
+        lookups = hits + local['misses']
+        local['hit_rate'] = round(hits / lookups, 4) if lookups else 0.0
+
+        self.flush()
+        shared = CachedResponse.get_stats()
+        shared_lookups = shared.get('hits', 0) + shared.get('misses', 0)
+        shared['hit_rate'] = round(shared.get('hits', 0) / shared_lookups, 4) if shared_lookups else 0.0
+        return {'process': local, 'all_workers': shared, 'memory_tier': self.local.stats()}
@@ -0,0 +1,230 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from src.cache import TTLCache
+from src.config import get_config
+from src.database import Upload, UploadChunks
+from src.lexical_index import LexicalIndex
+from src.tokens import token_estimator
+from src.vector_index import HashingEmbedder, VectorIndexStore
+
+config = get_config()
+
+logger = logging.getLogger(__name__)
+
+VECTOR_INDEX_DIR = getattr(config, 'VECTOR_INDEX_DIR', os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'vector_index'))
+EMBEDDING_DIM = getattr(config, 'EMBEDDING_DIM', 256)
+VECTOR_INDEX_CACHE_SIZE = getattr(config, 'VECTOR_INDEX_CACHE_SIZE', 64)
+VECTOR_IVF_MIN_VECTORS = getattr(config, 'VECTOR_IVF_MIN_VECTORS', 20000)
+VECTOR_NPROBE = getattr(config, 'VECTOR_NPROBE', 8)
+RETRIEVAL_TOP_K = getattr(config, 'RETRIEVAL_TOP_K', 4)
+RETRIEVAL_MIN_SCORE = getattr(config, 'RETRIEVAL_MIN_SCORE', 0.15)
+RETRIEVAL_TOKEN_BUDGET = getattr(config, 'RETRIEVAL_TOKEN_BUDGET', 1200)  # Prompt tokens for retrieved chunks
+RETRIEVAL_MODE = getattr(config, 'RETRIEVAL_MODE', 'hybrid')  # 'hybrid', 'vector' or 'lexical'
+HYBRID_ALPHA = getattr(config, 'HYBRID_ALPHA', 0.5)  # Weight of the vector score in hybrid mode
+LEXICAL_INDEX_CACHE_SIZE = getattr(config, 'LEXICAL_INDEX_CACHE_SIZE', 32)
+BACKFILL_WORKERS = getattr(config, 'VECTOR_BACKFILL_WORKERS', 1)
+BACKFILL_PAGE = 500
+
+NO_CONTENT = "No specific content uploaded yet. Use general knowledge."
+
+embedder = HashingEmbedder(EMBEDDING_DIM)
+
+
+# Opening a user's index schedules a check that it holds every indexed
+# upload. The checks share one small pool, created per process like the
+# ingest pool, and a user already queued is not queued twice.
+_backfill_executor = None
+_backfill_pid = None
+_backfill_lock = threading.Lock()
+_backfill_pending = set()
+
+
+def _get_backfill_executor():
+    global _backfill_executor, _backfill_pid
+    if _backfill_executor is None or _backfill_pid != os.getpid():
+        with _backfill_lock:
+            if _backfill_executor is None or _backfill_pid != os.getpid():
+                _backfill_executor = ThreadPoolExecutor(max_workers=BACKFILL_WORKERS,
+                                                        thread_name_prefix='vector-backfill')
+                _backfill_pid = os.getpid()
+                _backfill_pending.clear()
+    return _backfill_executor
+
+
+def _backfill(user_id, index):
+    """Embed indexed uploads the on-disk index is missing (new host, lost files)"""
+    try:
+        missing = set(Upload.get_indexed_upload_ids(user_id)) - index.uploads()
+        for upload_id in missing:
+            texts = []
+            while True:
+                page = UploadChunks.get_chunks(upload_id, len(texts), BACKFILL_PAGE)
+                texts.extend(chunk['text'] for chunk in page)
+                if len(page) < BACKFILL_PAGE:
+                    break
+            index.add(upload_id, 0, embedder.embed(texts), if_absent=True)
+    except Exception:
+        logger.exception('Error backfilling vector index for %s', user_id)
+    finally:
+        with _backfill_lock:
+            _backfill_pending.discard(user_id)
+
+
+def _on_load(user_id, index):
+    # Users who never uploaded anything are the common case on the tutor
+    # path; they have no indexed upload and nothing is queued for them
+    try:
+        if not Upload.has_indexed_uploads(user_id):
+            return
+    except Exception:
+        pass  # The backfill repeats the query and reports the error
+    executor = _get_backfill_executor()
+    with _backfill_lock:
+        if user_id in _backfill_pending:
+            return
+        _backfill_pending.add(user_id)
+    executor.submit(_backfill, user_id, index)
+
+
+vector_indexes = VectorIndexStore(
+    VECTOR_INDEX_DIR, EMBEDDING_DIM, VECTOR_INDEX_CACHE_SIZE,
+    VECTOR_IVF_MIN_VECTORS, VECTOR_NPROBE, on_load=_on_load
+)
+
+
+# BM25 indexes live in memory per process. The vector index's meta.json is
+# the shared commit log: when its version moves (another worker ingested or
+# deleted something) the lexical index is synced against it in the background.
+lexical_indexes = TTLCache(maxsize=LEXICAL_INDEX_CACHE_SIZE, ttl=None)
+_lexical_lock = threading.Lock()
+
+
+def _sync_lexical(lexical, vector_index, version):
+    try:
+        target = vector_index.upload_rows()
+        for upload_id in set(lexical.uploads()) - set(target):
+            lexical.remove_upload(upload_id)
+        have = lexical.uploads()
+        for upload_id, rows in target.items():
+            start = have.get(upload_id, 0)
+            while start < rows:
+                page = UploadChunks.get_chunks(upload_id, start, BACKFILL_PAGE)
+                if not page:
+                    break
+                lexical.add(upload_id, page[0]['seq'], [chunk['text'] for chunk in page])
+                start = page[-1]['seq'] + 1
+        lexical.synced_version = version
+    except Exception:
+        logger.exception('Error syncing lexical index')
+    finally:
+        lexical.syncing = False
+
+
+def lexical_index(user_id, vector_index=None):
+    """The user's BM25 index, scheduling a background sync when it is behind"""
+    vector_index = vector_index or vector_indexes.get(user_id)
+    lexical = lexical_indexes.get(user_id)
+    if lexical is None:
+        with _lexical_lock:
+            lexical = lexical_indexes.get(user_id)
+            if lexical is None:
+                lexical = LexicalIndex()
+                lexical_indexes.set(user_id, lexical)
+    version = vector_index.version
+    if lexical.synced_version != version and not lexical.syncing:
+        lexical.syncing = True
+        threading.Thread(target=_sync_lexical, args=(lexical, vector_index, version), daemon=True).start()
+    return lexical
+
+
+def index_chunks(user_id, upload_id, first_seq, texts):
+    """Embed a batch of an upload's chunks into the user's indexes"""
+    vector_indexes.get(user_id).add(upload_id, first_seq, embedder.embed(texts))
+    lexical = lexical_indexes.get(user_id)
+    if lexical is not None:
+        lexical.add(upload_id, first_seq, texts)
+
+
+def remove_upload(user_id, upload_id):
+    """Drop an upload's chunks from the user's indexes"""
+    vector_indexes.get(user_id).remove_upload(upload_id)
+    lexical = lexical_indexes.get(user_id)
+    if lexical is not None:
+        lexical.remove_upload(upload_id)
+
+
+def drop_user(user_id):
+    """Delete a user's indexes (after the user is deleted)"""
+    vector_indexes.drop(user_id)
+    lexical_indexes.pop(user_id)
+
+
+def _normalized(hits):
+    """Scale a ranked hit list's scores to [0, 1] relative to its best hit"""
+    if not hits:
+        return {}
+    top = hits[0][2]
+    return {(upload_id, seq): score / top if top > 0 else 0.0 for upload_id, seq, score in hits}
+
+
+def search(user_id, query, k=RETRIEVAL_TOP_K, mode=RETRIEVAL_MODE):
+    """Top-k (upload_id, seq, score) over the user's chunks"""
+    index = vector_indexes.get(user_id)
+    if not len(index):
+        return []
+    # Fusion needs a deeper pool from each side than the k it returns
+    depth = k * 4 if mode == 'hybrid' else k
+    dense, lexical = [], []
+    if mode in ('vector', 'hybrid'):
+        dense = [hit for hit in index.search(embedder.embed([query]), depth)[0] if hit[2] >= RETRIEVAL_MIN_SCORE]
+    if mode in ('lexical', 'hybrid'):
+        lexical = lexical_index(user_id, index).search(query, depth)
+    if mode == 'vector':
+        return dense
+    if mode == 'lexical':
+        return lexical
+
+    return fuse(dense, lexical, k)
+
+
+def fuse(dense, lexical, k, alpha=HYBRID_ALPHA):
+    """Blend normalized vector and BM25 scores into one ranking"""
+    dense, lexical = _normalized(dense), _normalized(lexical)
+    fused = {
+        ref: alpha * dense.get(ref, 0.0) + (1 - alpha) * lexical.get(ref, 0.0)
+        for ref in dense.keys() | lexical.keys()
+    }
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:k]
+    return [(upload_id, seq, score) for (upload_id, seq), score in ranked]
+
+
+def retrieve(user_id, query, k=RETRIEVAL_TOP_K, mode=RETRIEVAL_MODE):
+    """The user's k chunks most relevant to the query, best first"""
+    hits = search(user_id, query, k, mode)
+    scores = {(upload_id, seq): score for upload_id, seq, score in hits}
+    chunks = UploadChunks.get_by_refs(list(scores))
+    for chunk in chunks:
+        chunk['score'] = scores[(chunk['upload_id'], chunk['seq'])]
+    return chunks
+
+
+def format_chunks(chunks, token_budget=RETRIEVAL_TOKEN_BUDGET):
+    """Render retrieved chunks for the tutor prompt's retrieved_chunks slot within a token budget"""
+    # Chunks come best first, so the budget drops the weakest; the last one
+    # that fits only partly is cut rather than dropped
+    sections = []
+    for i, chunk in enumerate(chunks, 1):
+        section = f"[{i}] {chunk['text']}"
+        cost = token_estimator.count(section) + 1
+        if cost > token_budget:
+            section = token_estimator.truncate(section, token_budget - 1)
+            if len(section) > len(f'[{i}] '):
+                sections.append(section)
+            break
+        token_budget -= cost
+        sections.append(section)
+    return '\n\n'.join(sections) if sections else NO_CONTENT
@@ -0,0 +1,240 @@
+import argparse
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import sys
+
+from flask import Response, send_file
+
+try:
+    import brotli
+except ImportError:  # Brotli variants are optional
+    brotli = None
+
+# The bundler writes its output to assets/ as name-<8 character hash>.ext
+# (assets/index-D-m4R7FG.js), so such a URL never changes content and can
+# be cached forever. Anything else, including look-alikes outside assets/
+# such as apple-touch-icon.png, is revalidated.
+HASHED_NAME = re.compile(r'^assets/(?:.+/)?[^/]+-[A-Za-z0-9_-]{8}\.[a-z0-9]+$')
+COMPRESSIBLE = ('.js', '.mjs', '.css', '.html', '.json', '.svg', '.txt', '.xml', '.map', '.wasm')
+ENCODINGS = {'br': '.br', 'gzip': '.gz'}
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+
+INDEX = 'index.html'
+ASSET_REFERENCE = re.compile(r'''(?:src|href)\s*=\s*["']/?([^"'?#]+)''')
+
+
+class Asset:
+    """One static file and its precompressed variants"""
+
+    def __init__(self, path, digest, size, mimetype, hashed):
+        self.path = path
+        self.digest = digest
+        self.size = size
+        self.mimetype = mimetype
+        self.hashed = hashed
+        self.variants = {'identity': (path, size)}
+        self.bodies = {}
+
+    def etag(self, encoding):
+        """Unquoted strong validator; each encoding is its own representation"""
+        return self.digest if encoding == 'identity' else f'{self.digest}-{encoding}'
+
+
+class AssetManifest:
+    """Startup-built map of static files to content hashes, variants and cached bodies"""
+
+    # Requests are answered from the manifest without touching the
+    # filesystem: no exists() checks, ETags computed once, and files up to
+    # memory_file_limit (per variant, within memory_budget) served from RAM.
+    # Gzip/Brotli variants are produced at build time (see `build` below)
+    # and picked by Accept-Encoding. index.html is the SPA fallback and is
+    # always kept in memory.
+
+    def __init__(self, root, memory_file_limit=256 * 1024, memory_budget=32 * 1024 * 1024):
+        self.root = root
+        self.memory_file_limit = memory_file_limit
+        self.memory_budget = memory_budget
+        self.assets = {}
+        self.index = None
+        self.reload()
+
+    def reload(self):
+        """Rescan the static folder (e.g. after deploying a new frontend build)"""
+        assets, memory = {}, 0
+        for path in _walk(self.root):
+            name = os.path.relpath(path, self.root).replace(os.sep, '/')
+            if name.endswith(tuple(ENCODINGS.values())):
+                continue
+            with open(path, 'rb') as f:
+                body = f.read()
+            mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+            asset = Asset(path, hashlib.sha256(body).hexdigest()[:32], len(body), mimetype,
+                          bool(HASHED_NAME.match(name)))
+            for encoding, suffix in ENCODINGS.items():
+                if os.path.exists(path + suffix):
+                    asset.variants[encoding] = (path + suffix, os.path.getsize(path + suffix))
+            for encoding, (variant_path, size) in asset.variants.items():
+                if name == INDEX or (size <= self.memory_file_limit and memory + size <= self.memory_budget):
+                    with open(variant_path, 'rb') as f:
+                        asset.bodies[encoding] = f.read()
+                    memory += size
+            assets[name] = asset
+        self.assets = assets
+        self.index = assets.get(INDEX)
+        self.memory_bytes = memory
+
+    def _representation(self, asset, accept_encodings):
+        encoding = accept_encodings.best_match(
+            [e for e in ENCODINGS if e in asset.variants], default='identity'
+        )
+        return encoding if encoding in asset.variants else 'identity'
+
+    def response(self, path, request):
+        """Response for a GET/HEAD of path, falling back to index.html for client-side routes"""
+        asset = self.assets.get(path) if path else None
+        if asset is None:
+            if path.startswith('assets/') or self.index is None:
+                # A missing hashed asset must not turn into an HTML page
+                return Response('Not found' if self.index else 'Frontend not built', 404)
+            asset = self.index
+
+        encoding = self._representation(asset, request.accept_encodings)
+        etag = asset.etag(encoding)
+        headers = {
+            'ETag': f'"{etag}"',
+            'Cache-Control': IMMUTABLE if asset.hashed else REVALIDATE
+        }
+        if len(asset.variants) > 1:
+            headers['Vary'] = 'Accept-Encoding'
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+
+        if request.if_none_match.contains(etag) or request.if_none_match.star_tag:
+            return Response(status=304, headers=headers)
+
+        body = asset.bodies.get(encoding)
+        if body is not None:
+            return Response(body, mimetype=asset.mimetype, headers=headers)
+        response = send_file(asset.variants[encoding][0], mimetype=asset.mimetype,
+                             etag=False, conditional=False, max_age=None)
+        response.headers.update(headers)
+        return response
+
+    def stats(self):
+        return {
+            'files': len(self.assets),
+            'hashed': sum(1 for a in self.assets.values() if a.hashed),
+            'in_memory': sum(1 for a in self.assets.values() if a.bodies),
+            'memory_bytes': self.memory_bytes,
+            'variants': sum(len(a.variants) - 1 for a in self.assets.values())
+        }
+
+
+def _walk(root):
+    for directory, _, files in os.walk(root):
+        for filename in sorted(files):
+            yield os.path.join(directory, filename)
+
+
+def build(root, min_size=1024):
+    """Write .gz (and .br, if brotli is installed) next to compressible files"""
+    written = []
+    for path in _walk(root):
+        if path.endswith(tuple(ENCODINGS.values())) or not path.endswith(COMPRESSIBLE):
+            continue
+        with open(path, 'rb') as f:
+            body = f.read()
+        if len(body) < min_size:
+            continue
+        compressors = {'.gz': lambda data: gzip.compress(data, 9, mtime=0)}
+        if brotli is not None:
+            compressors['.br'] = lambda data: brotli.compress(data, quality=11)
+        for suffix, compress in compressors.items():
+            compressed = compress(body)
+            # Not worth a variant unless it saves at least 5%
+            if len(compressed) < len(body) * 0.95:
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+                written.append((path + suffix, len(body), len(compressed)))
+            elif os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    return written
+
+
+def referenced_assets(root):
+    """Files reachable from index.html, following references inside JS/CSS"""
+    index_path = os.path.join(root, INDEX)
+    if not os.path.exists(index_path):
+        raise FileNotFoundError(f'{index_path} not found; refusing to guess which assets are live')
+    names = {os.path.relpath(p, root).replace(os.sep, '/') for p in _walk(root)}
+    basenames = {}
+    for name in names:
+        basenames.setdefault(os.path.basename(name), set()).add(name)
+
+    keep, pending = {INDEX}, [INDEX]
+    while pending:
+        with open(os.path.join(root, pending.pop()), 'r', encoding='utf-8', errors='replace') as f:
+            text = f.read()
+        found = set(ASSET_REFERENCE.findall(text)) & names
+        # Bundles import sibling chunks and fonts by bare file name
+        for basename, candidates in basenames.items():
+            if basename in text:
+                found |= candidates
+        for name in found - keep:
+            keep.add(name)
+            if name.endswith(('.js', '.mjs', '.css', '.html')):
+                pending.append(name)
+    return keep
+
+
+def prune(root, dry_run=False):
+    """Delete files under assets/ that index.html no longer references"""
+    keep = referenced_assets(root)
+    removed = []
+    for path in _walk(os.path.join(root, 'assets')):
+        name = os.path.relpath(path, root).replace(os.sep, '/')
+        for suffix in ENCODINGS.values():
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+        if name not in keep:
+            removed.append(path)
+            if not dry_run:
+                os.remove(path)
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build, inspect and prune static frontend assets')
+    parser.add_argument('command', choices=['build', 'manifest', 'prune'])
+    parser.add_argument('--root', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+    parser.add_argument('--dry-run', action='store_true', help='list what prune would delete')
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if brotli is None:
+            print('brotli not installed; writing gzip variants only')
+        for path, size, compressed in build(args.root):
+            print(f'{path}: {size} -> {compressed} bytes')
+    elif args.command == 'manifest':
+        manifest = AssetManifest(args.root)
+        for name, asset in sorted(manifest.assets.items()):
+            variants = ', '.join(sorted(set(asset.variants) - {'identity'})) or '-'
+            print(f"{name}  {asset.size}  {asset.digest}  {'immutable' if asset.hashed else 'no-cache'}  {variants}")
+        print(manifest.stats())
+    else:
+        try:
+            removed = prune(args.root, args.dry_run)
+        except FileNotFoundError as e:
+            print(e)
+            return 1
+        for path in removed:
+            print(f"{'would remove' if args.dry_run else 'removed'} {path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+import math
+import re
+import threading
+
+from src.cache import TTLCache
+from src.config import get_config
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # Exact counts need the tokenizers package and the model's tokenizer.json
+    Tokenizer = None
+
+config = get_config()
+
+DEEPSEEK_TOKENIZER_PATH = getattr(config, 'DEEPSEEK_TOKENIZER_PATH', None)
+TOKEN_CACHE_SIZE = getattr(config, 'TOKEN_CACHE_SIZE', 1024)
+TOKEN_CACHE_MIN_CHARS = 256  # Shorter texts are cheaper to count than to cache
+
+# Chat template framing per message (role marker and separators) and for
+# the assistant turn the reply is generated into
+MESSAGE_OVERHEAD = 4
+REPLY_OVERHEAD = 2
+
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+
+# Pre-tokenization in the style of DeepSeek's byte-level BPE: digits in
+# groups of up to three, one piece per CJK character, words with their
+# leading space, punctuation runs, and newline or whitespace runs
+_PIECE = re.compile(
+    rf"\d{{1,3}}|[{_CJK}]| ?[^\W\d_{_CJK}]+| ?[^\s\w]+|\s*[\r\n]+|\s+|_+"
+)
+
+
+def _piece_cost(piece):
+    """Estimated BPE tokens for one pre-tokenized piece"""
+    word = piece.lstrip(' ')
+    if not word:
+        return 1
+    if len(word) == 1 or word[0].isdigit() or word.isspace():
+        return 1
+    if word[0].isalpha() and word.isascii():
+        # Common English words are single tokens in a 100k+ vocabulary;
+        # longer or mixed-case ones split into a few subwords
+        return math.ceil(len(word) / (6 if word.islower() or word.istitle() else 3))
+    # Other scripts and punctuation runs merge less
+    return math.ceil(len(word) / 2)
+
+
+class TokenEstimator:
+    """Offline token counts for DeepSeek chat requests"""
+
+    # With DEEPSEEK_TOKENIZER_PATH pointing at the model's tokenizer.json and
+    # the tokenizers package installed, counts are exact. Otherwise they come
+    # from a pre-tokenizer that mirrors the model's splitting rules plus
+    # per-piece BPE costs, scaled by a factor learned from the prompt_tokens
+    # the API reports (see observe). Counts of long texts, mostly system
+    # prompts repeated across requests, are cached.
+
+    def __init__(self, tokenizer_path=DEEPSEEK_TOKENIZER_PATH, cache_size=TOKEN_CACHE_SIZE):
+        self.tokenizer = None
+        if tokenizer_path and Tokenizer is not None:
+            self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self._cache = TTLCache(maxsize=cache_size, ttl=None)
+        self._lock = threading.Lock()
+        self.scale = 1.0
+        self.observations = 0
+        self.error_sum = 0.0
+
+    @property
+    def exact(self):
+        return self.tokenizer is not None
+
+    def _count(self, text):
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+        return sum(_piece_cost(piece) for piece in _PIECE.findall(text))
+
+    def raw_count(self, text):
+        """Unscaled token count of a text"""
+        if not text:
+            return 0
+        if len(text) < TOKEN_CACHE_MIN_CHARS:
+            return self._count(text)
+        count = self._cache.get(text)
+        if count is None:
+            count = self._count(text)
+            self._cache.set(text, count)
+        return count
+
+    def count(self, text):
+        """Estimated tokens in a text"""
+        return math.ceil(self.raw_count(text) * self.scale)
+
+    def count_messages(self, messages):
+        """Estimated prompt tokens of a chat request"""
+        raw = sum(self.raw_count(m['content']) + MESSAGE_OVERHEAD for m in messages) + REPLY_OVERHEAD
+        return math.ceil(raw * self.scale)
+
+    def truncate(self, text, max_tokens):
+        """Longest prefix of text (cut at a piece boundary) within max_tokens"""
+        if self.count(text) <= max_tokens:
+            return text
+        if self.tokenizer is not None:
+            offsets = self.tokenizer.encode(text, add_special_tokens=False).offsets
+            return text[:offsets[max_tokens - 1][1]] if max_tokens > 0 else ''
+        budget = max_tokens / self.scale
+        used, end = 0, 0
+        for match in _PIECE.finditer(text):
+            used += _piece_cost(match.group())
+            if used > budget:
+                break
+            end = match.end()
+        return text[:end]
+
+    def observe(self, messages_estimate, prompt_tokens):
+        """Calibrate the heuristic against the prompt_tokens the API billed"""
+        if self.exact or not messages_estimate or not prompt_tokens:
+            return
+        with self._lock:
+            raw = messages_estimate / self.scale
+            ratio = min(2.0, max(0.5, prompt_tokens / raw))
+            # Slow moving average, so one odd request barely moves the scale
+            self.scale += (ratio - self.scale) * 0.05
+            self.observations += 1
+            self.error_sum += abs(messages_estimate - prompt_tokens) / prompt_tokens
+
+    def stats(self):
+        with self._lock:
+            return {
+                'exact': self.exact,
+                'scale': round(self.scale, 4),
+                'observations': self.observations,
+                'mean_abs_error': round(self.error_sum / self.observations, 4) if self.observations else None,
+                'cache': self._cache.stats()
+            }
+
+
+token_estimator = TokenEstimator()
@@ -0,0 +1,376 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+
+import numpy as np
+
+from src.cache import TTLCache
+
+try:
+    import fcntl
+except ImportError:  # No cross-process write lock outside POSIX
+    fcntl = None
+
+_TOKEN = re.compile(r'\w+')
+
+SCAN_BLOCK = 65536  # Rows scored per matmul in brute-force search
+IVF_TRAIN_ITERATIONS = 8
+IVF_TRAIN_SAMPLE = 64  # Training rows per list
+IVF_RETRAIN_RATIO = 0.25  # Retrain once the unclustered tail reaches this share
+COMPACT_RATIO = 0.25  # Rewrite files once deleted rows reach this share
+
+
+@lru_cache(maxsize=1 << 16)
+def _bucket(feature, dim):
+    digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+    value = int.from_bytes(digest, 'little')
+    return value % dim, 1.0 if value >> 63 else -1.0
+
+
+class HashingEmbedder:
+    """Offline embedder: signed feature hashing of word unigrams and bigrams"""
+
+    def __init__(self, dim=256):
+        self.dim = dim
+
+    def embed(self, texts):
+        """Embed a batch of texts into L2-normalized float32 rows"""
+        matrix = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = _TOKEN.findall(text.lower())
+            features = tokens + [f'{a} {b}' for a, b in zip(tokens, tokens[1:])]
+            if not features:
+                continue
+            buckets = [_bucket(feature, self.dim) for feature in features]
+            counts = np.bincount([b[0] for b in buckets], weights=[b[1] for b in buckets], minlength=self.dim)
+            # Sublinear term frequency so repeated words do not dominate
+            matrix[row] = np.sign(counts) * np.log1p(np.abs(counts))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+
+def _top_k(scores, k):
+    """Indices of the k highest scores, best first"""
+    if len(scores) > k:
+        candidates = np.argpartition(-scores, k)[:k]
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def _spherical_kmeans(sample, nlist, iterations, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        for i in range(nlist):
+            members = sample[assign == i]
+            if len(members):
+                centroids[i] = members.sum(axis=0)
+        norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+        np.divide(centroids, norms, out=centroids, where=norms > 0)
+    return centroids
+
+
+class VectorIndex:
+    """One user's chunk embeddings as memory-mapped float32 files"""
+
+    # vectors.f32 is an (n, dim) row-major matrix and refs.i32 an (n, 2) matrix
+    # of (upload slot, chunk seq); both are append-only. meta.json is the
+    # commit point: it is replaced atomically after the data is written, and
+    # rows past its count are ignored (and truncated by the next writer).
+    # Removing an upload tombstones its slot; files are compacted once enough
+    # rows are dead. Past ivf_min_vectors a coarse quantizer (spherical
+    # k-means) groups rows into lists so a search only scores the nprobe
+    # nearest lists plus the rows appended since the last training.
+
+    def __init__(self, path, dim, ivf_min_vectors=20000, nprobe=8):
+        self.path = path
+        self.dim = dim
+        self.ivf_min_vectors = ivf_min_vectors
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        self._state = None
+        self._loaded_mtime = None
+        self.reload()
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _meta_mtime(self):
+        try:
+            return os.stat(self._file('meta.json')).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _read_meta(self):
+        try:
+            with open(self._file('meta.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'dim': self.dim, 'count': 0, 'uploads': [], 'dead_rows': 0, 'ivf': None}
+
+    def _write_meta(self, meta):
+        tmp = self._file('meta.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._file('meta.json'))
+
+    def _map(self, name, dtype, shape):
+        if not shape[0]:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(self._file(name), dtype=dtype, mode='r', shape=shape)
+
+    def stale(self):
+        """Whether another writer (thread or process) committed since the last load"""
+        return self._meta_mtime() != self._loaded_mtime
+
+    def reload(self):
+        """Map the committed files; searches already running keep the old snapshot"""
+        mtime = self._meta_mtime()
+        meta = self._read_meta()
+        count = meta['count']
+        ivf = None
+        if meta.get('ivf'):
+            nlist, trained = meta['ivf']['nlist'], meta['ivf']['trained']
+            ivf = (
+                self._map('centroids.f32', np.float32, (nlist, self.dim)),
+                self._map('ivf_order.i32', np.int32, (trained,)),
+                np.array(self._map('ivf_offsets.i32', np.int32, (nlist + 1,))),
+                trained
+            )
+        self._state = {
+            'count': count,
+            'vectors': self._map('vectors.f32', np.float32, (count, self.dim)),
+            'refs': self._map('refs.i32', np.int32, (count, 2)),
+            'uploads': meta['uploads'],
+            'alive': np.array([u is not None for u in meta['uploads']] or [True], dtype=bool),
+            'dead_rows': meta.get('dead_rows', 0),
+            'ivf': ivf
+        }
+        self._loaded_mtime = mtime
+
+    @contextmanager
+    def _writing(self):
+        # Thread lock for this process, file lock against other workers
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._file('write.lock'), 'w') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield self._read_meta()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        self.reload()
+
+    def _append(self, name, count, row_bytes, data):
+        fd = os.open(self._file(name), os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, 'r+b') as f:
+            # Drop rows an interrupted writer left past the committed count
+            f.truncate(count * row_bytes)
+            f.seek(count * row_bytes)
+            f.write(data)
+
+    def add(self, upload_id, first_seq, vectors, if_absent=False):
+        """Append embeddings for consecutive chunks of an upload"""
+        if not len(vectors):
+            return
+        with self._writing() as meta:
+            if upload_id in meta['uploads']:
+                if if_absent:
+                    return
+                slot = meta['uploads'].index(upload_id)
+            else:
+                slot = len(meta['uploads'])
+                meta['uploads'].append(upload_id)
+            count = meta['count']
+            refs = np.empty((len(vectors), 2), dtype=np.int32)
+            refs[:, 0] = slot
+            refs[:, 1] = np.arange(first_seq, first_seq + len(vectors))
+            self._append('vectors.f32', count, self.dim * 4, np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+            self._append('refs.i32', count, 8, refs.tobytes())
+            meta['count'] = count + len(vectors)
+            self._maybe_train(meta)
+            self._write_meta(meta)
+
+    def remove_upload(self, upload_id):
+        """Tombstone an upload's rows; compacts once enough rows are dead"""
+        with self._writing() as meta:
+            if upload_id not in meta['uploads']:
+                return
+            slot = meta['uploads'].index(upload_id)
+            meta['uploads'][slot] = None
+            refs = self._map('refs.i32', np.int32, (meta['count'], 2))
+            meta['dead_rows'] = meta.get('dead_rows', 0) + int(np.count_nonzero(refs[:, 0] == slot))
+            del refs
+            if meta['dead_rows'] >= COMPACT_RATIO * meta['count']:
+                self._compact(meta)
+            self._write_meta(meta)
+
+    def _compact(self, meta):
+        count = meta['count']
+        vectors = self._map('vectors.f32', np.float32, (count, self.dim))
+        refs = self._map('refs.i32', np.int32, (count, 2))
+        alive = np.array([u is not None for u in meta['uploads']] or [True], dtype=bool)
+        keep = np.flatnonzero(alive[refs[:, 0]]) if count else np.zeros(0, dtype=np.int64)
+        # Renumber slots so the uploads list only holds live uploads
+        live_slots = np.flatnonzero(alive)
+        renumber = np.full(len(alive), -1, dtype=np.int32)
+        renumber[live_slots] = np.arange(len(live_slots), dtype=np.int32)
+        new_refs = np.array(refs[keep])
+        new_refs[:, 0] = renumber[new_refs[:, 0]]
+        # Write new files under temporary names; readers keep the old inodes mapped
+        for name, data in (('vectors.f32', np.array(vectors[keep])), ('refs.i32', new_refs)):
+            with open(self._file(name + '.tmp'), 'wb') as f:
+                f.write(data.tobytes())
+            os.replace(self._file(name + '.tmp'), self._file(name))
+        del vectors, refs
+        meta['uploads'] = [u for u in meta['uploads'] if u is not None]
+        meta['count'] = len(keep)
+        meta['dead_rows'] = 0
+        meta['ivf'] = None
+        self._maybe_train(meta)
+
+    def _maybe_train(self, meta):
+        count = meta['count']
+        if count < self.ivf_min_vectors:
+            meta['ivf'] = None
+            return
+        trained = meta['ivf']['trained'] if meta.get('ivf') else 0
+        if trained and count - trained < IVF_RETRAIN_RATIO * trained:
+            return
+        vectors = self._map('vectors.f32', np.float32, (count, self.dim))
+        nlist = int(min(4096, max(16, 2 * np.sqrt(count))))
+        rng = np.random.default_rng(count)
+        sample_rows = np.sort(rng.choice(count, min(count, nlist * IVF_TRAIN_SAMPLE), replace=False))
+        nlist = min(nlist, len(sample_rows))
+        centroids = _spherical_kmeans(np.array(vectors[sample_rows]), nlist, IVF_TRAIN_ITERATIONS)
+        assign = np.empty(count, dtype=np.int32)
+        for start in range(0, count, SCAN_BLOCK):
+            assign[start:start + SCAN_BLOCK] = np.argmax(vectors[start:start + SCAN_BLOCK] @ centroids.T, axis=1)
+        order = np.argsort(assign, kind='stable').astype(np.int32)
+        offsets = np.zeros(nlist + 1, dtype=np.int32)
+        np.cumsum(np.bincount(assign, minlength=nlist), out=offsets[1:])
+        for name, data in (('centroids.f32', centroids), ('ivf_order.i32', order), ('ivf_offsets.i32', offsets)):
+            with open(self._file(name + '.tmp'), 'wb') as f:
+                f.write(data.tobytes())
+            os.replace(self._file(name + '.tmp'), self._file(name))
+        meta['ivf'] = {'nlist': nlist, 'trained': count}
+
+    @property
+    def version(self):
+        """Changes whenever a writer commits (meta.json mtime)"""
+        return self._loaded_mtime
+
+    def uploads(self):
+        """Upload ids with live rows in the index"""
+        return {u for u in self._state['uploads'] if u is not None}
+
+    def upload_rows(self):
+        """Upload id -> number of rows it has in the index"""
+        state = self._state
+        if state['count']:
+            rows = np.bincount(state['refs'][:, 0], minlength=len(state['uploads']))
+        else:
+            rows = np.zeros(len(state['uploads']), dtype=np.int64)
+        return {u: int(n) for u, n in zip(state['uploads'], rows) if u is not None}
+
+    def __len__(self):
+        state = self._state
+        return state['count'] - state['dead_rows']
+
+    def _candidates(self, state, query, nprobe):
+        """Row ids to score for one query: the nprobe nearest lists plus the tail"""
+        centroids, order, offsets, trained = state['ivf']
+        probes = _top_k(centroids @ query, nprobe)
+        rows = [order[offsets[p]:offsets[p + 1]] for p in probes]
+        rows.append(np.arange(trained, state['count'], dtype=np.int32))
+        return np.sort(np.concatenate(rows))
+
+    def search(self, queries, k=4, nprobe=None):
+        """Top-k (upload_id, seq, score) per query row, best first"""
+        state = self._state
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if not state['count'] - state['dead_rows']:
+            return [[] for _ in queries]
+        vectors, refs, alive = state['vectors'], state['refs'], state['alive']
+        # Over-fetch so tombstoned rows can be dropped after ranking
+        fetch = k + min(state['dead_rows'], 4 * k)
+        results = []
+        if state['ivf'] is not None:
+            for query in queries:
+                rows = self._candidates(state, query, nprobe or self.nprobe)
+                scores = vectors[rows] @ query
+                best = _top_k(scores, fetch)
+                results.append((rows[best], scores[best]))
+        else:
+            # Brute force in row blocks; each block scores every query in one matmul
+            pools = [([], []) for _ in queries]
+            for start in range(0, state['count'], SCAN_BLOCK):
+                block = vectors[start:start + SCAN_BLOCK] @ queries.T
+                for j, pool in enumerate(pools):
+                    best = _top_k(block[:, j], fetch)
+                    pool[0].append(best + start)
+                    pool[1].append(block[best, j])
+            for rows, scores in pools:
+                rows, scores = np.concatenate(rows), np.concatenate(scores)
+                best = _top_k(scores, fetch)
+                results.append((rows[best], scores[best]))
+
+        hits = []
+        for rows, scores in results:
+            found = []
+            for row, score in zip(rows, scores):
+                slot, seq = refs[row]
+                if alive[slot]:
+                    found.append((state['uploads'][slot], int(seq), float(score)))
+                    if len(found) == k:
+                        break
+            hits.append(found)
+        return hits
+
+
+class VectorIndexStore:
+    """Per-user VectorIndex instances, opened lazily and LRU-evicted when cold"""
+
+    def __init__(self, root, dim=256, capacity=64, ivf_min_vectors=20000, nprobe=8, on_load=None):
+        self.root = root
+        self.dim = dim
+        self.ivf_min_vectors = ivf_min_vectors
+        self.nprobe = nprobe
+        self.on_load = on_load
+        self._indexes = TTLCache(maxsize=capacity, ttl=None)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """The user's index, reloaded if another writer committed since it was opened"""
+        index = self._indexes.get(user_id)
+        if index is None:
+            with self._lock:
+                index = self._indexes.get(user_id)
+                if index is None:
+                    index = VectorIndex(os.path.join(self.root, str(user_id)), self.dim,
+                                        self.ivf_min_vectors, self.nprobe)
+                    self._indexes.set(user_id, index)
+                    if self.on_load:
+                        self.on_load(user_id, index)
+        elif index.stale():
+            index.reload()
+        return index
+
+    def drop(self, user_id):
+        """Forget a user's index and delete its files"""
+        with self._lock:
+            self._indexes.pop(user_id)
+            shutil.rmtree(os.path.join(self.root, str(user_id)), ignore_errors=True)
+
+    def stats(self):
+        return self._indexes.stats()
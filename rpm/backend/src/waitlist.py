@@ -0,0 +1,184 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _timestamp(created_at):
+    # Mongo stores milliseconds and hands back naive UTC datetimes, so truncate
+    # and never let the local timezone leak in
+    created_at = created_at.replace(microsecond=created_at.microsecond // 1000 * 1000)
+    if created_at.tzinfo is not None:
+        return created_at.timestamp()
+    return (created_at - _EPOCH).total_seconds()
+
+
+class WaitlistRank:
+    """Order-statistic index over the waitlist (Fenwick tree over signup order)"""
+
+    # Slots are waitlisted users sorted by (created_at, _id). A Fenwick tree
+    # over per-slot active flags turns "how many active users signed up before
+    # me" into an O(log n) prefix sum. Leaving the waitlist clears a flag;
+    # joining appends a slot. The snapshot is rebuilt from Mongo in the
+    # background every refresh_interval so changes made by other workers are
+    # picked up; callers fall back to an indexed count while it is not ready.
+    # Joins and leaves arriving during a rebuild are replayed onto the new
+    # snapshot, since its loader may have read the users before or after them.
+
+    def __init__(self, loader, refresh_interval=60):
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._building = False
+        self._built_at = None
+        self._pending = []
+        self._reset()
+
+    def _reset(self):
+        self._times = array('d')
+        self._ids = bytearray()
+        self._tree = array('i', [0])
+        self._active = bytearray()
+
+    @property
+    def size(self):
+        return len(self._active)
+
+    def ready(self):
+        """Whether a snapshot is loaded; schedules a background refresh when stale"""
+        if self._built_at is None or time.monotonic() - self._built_at > self.refresh_interval:
+            self.refresh(background=True)
+        return self._built_at is not None
+
+    def refresh(self, background=False):
+        """Rebuild the snapshot from the loader's (created_at, ObjectId) stream"""
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+            self._pending = []
+        if background:
+            threading.Thread(target=self._rebuild, daemon=True).start()
+        else:
+            self._rebuild()
+
+    def _rebuild(self):
+        try:
+            times = array('d')
+            ids = bytearray()
+            for created_at, object_id in self.loader():
+                times.append(_timestamp(created_at))
+                ids += object_id.binary
+            n = len(times)
+            # All slots start active, so tree[i] is just the width of its range
+            tree = array('i', [0]) * (n + 1)
+            for i in range(1, n + 1):
+                tree[i] = i & -i
+            with self._lock:
+                self._times, self._ids, self._tree = times, ids, tree
+                self._active = bytearray(b'\x01') * n
+                self._built_at = time.monotonic()
+                for change, object_id, created_at in self._pending:
+                    change(object_id, created_at)
+                self._pending = []
+                self._building = False
+        finally:
+            if self._building:
+                with self._lock:
+                    self._pending = []
+                    self._building = False
+
+    def _prefix(self, i):
+        total = 0
+        tree = self._tree
+        while i > 0:
+            total += tree[i]
+            i -= i & -i
+        return total
+
+    def _add(self, i, delta):
+        tree = self._tree
+        n = len(tree) - 1
+        while i <= n:
+            tree[i] += delta
+            i += i & -i
+
+    def _slot(self, object_id, created_at):
+        """1-based slot for a user, or None when it is not in the snapshot"""
+        ts = _timestamp(created_at)
+        binary = object_id.binary
+        lo = bisect_left(self._times, ts)
+        hi = bisect_right(self._times, ts, lo)
+        for slot in range(lo, hi):
+            if self._ids[slot * 12:slot * 12 + 12] == binary:
+                return slot + 1
+        return None
+
+    def position(self, object_id, created_at):
+        """1-based queue position, or None if the user is unknown to this snapshot"""
+        with self._lock:
+            slot = self._slot(object_id, created_at)
+            if slot is None or not self._active[slot - 1]:
+                return None
+            return self._prefix(slot)
+
+    def join(self, object_id, created_at):
+        """Append a new signup; out-of-order signups wait for the next refresh"""
+        with self._lock:
+            if self._building:
+                self._pending.append((self._join, object_id, created_at))
+            if self._built_at is not None:
+                self._join(object_id, created_at)
+
+    def _join(self, object_id, created_at):
+        ts = _timestamp(created_at)
+        if self._times and ts <= self._times[-1]:
+            if self._slot(object_id, created_at) is not None:
+                # Replayed after a rebuild whose loader already saw this signup
+                return
+            if ts < self._times[-1]:
+                self._built_at = 0
+                return
+        self._times.append(ts)
+        self._ids += object_id.binary
+        self._active.append(1)
+        i = len(self._active)
+        # New Fenwick node covers (i - lowbit(i), i]
+        self._tree.append(1 + self._prefix(i - 1) - self._prefix(i - (i & -i)))
+
+    def leave(self, object_id, created_at=None):
+        """Mark a user as no longer waitlisted (whitelisted, promoted or deleted)
+
+        Pass created_at whenever it is known: it locates the slot with a
+        binary search, while without it the whole id array is scanned.
+        """
+        with self._lock:
+            if self._building:
+                self._pending.append((self._leave, object_id, created_at))
+            if self._built_at is not None:
+                self._leave(object_id, created_at)
+
+    def _leave(self, object_id, created_at):
+        if created_at is not None:
+            slot = self._slot(object_id, created_at)
+        else:
+            slot = self._scan(object_id.binary)
+        if slot is not None and self._active[slot - 1]:
+            self._active[slot - 1] = 0
+            self._add(slot, -1)
+
+    def _scan(self, binary):
+        index = self._ids.find(binary)
+        while index != -1 and index % 12:
+            index = self._ids.find(binary, index + 1)
+        return index // 12 + 1 if index != -1 else None
+
+    def stats(self):
+        return {
+            'slots': self.size,
+            'waitlisted': self._prefix(self.size) if self._built_at is not None else None,
+            'snapshot_age_seconds': round(time.monotonic() - self._built_at, 1) if self._built_at else None
+        }
@@ -0,0 +1,10 @@
+"""WSGI entry point for production servers, run from rpm/backend:
+
+    gunicorn src.wsgi:app                  # settings from gunicorn.conf.py
+
+Each worker imports this module after the fork, so every process builds
+its own app and opens its own Mongo and LLM connections.
+"""
+from src.main import create_app
+
+app = create_app()
@@ -0,0 +1,13 @@
+import pytest
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """The models in src/database.py, backed by a fresh in-memory database"""
+    mongomock = pytest.importorskip('mongomock')
+    from src import database, mongo
+
+    database.mongo.close()
+    monkeypatch.setattr(mongo, 'MongoClient', mongomock.MongoClient)
+    yield database
+    database.mongo.close()
@@ -0,0 +1,47 @@
+from src import context
+from src.context import build_context
+
+
+def _turn(db, session_id, i):
+    session = db.TutoringSession.get_session(session_id)
+    messages = build_context(session, 'You are a tutor.', f'Question {i}?')
+    db.TutoringSession.add_turn(session_id, f'Question {i}?', f'Answer {i}.')
+    return messages
+
+
+def test_first_turn_has_no_history(db):
+    session_id = db.TutoringSession.create_session('u1', 'Algebra')
+    messages = _turn(db, session_id, 0)
+    assert [m['role'] for m in messages] == ['system', 'user']
+
+
+def test_turns_leaving_the_window_are_summarized(db):
+    session_id = db.TutoringSession.create_session('u1', 'Algebra')
+    turns = context.CONTEXT_HISTORY_MESSAGES  # Twice as many messages as the window holds
+    for i in range(turns):
+        _turn(db, session_id, i)
+    messages = _turn(db, session_id, turns)
+
+    session = db.TutoringSession.get_session(session_id)
+    assert session['summary_through'] == 2 * turns - context.CONTEXT_HISTORY_MESSAGES
+    assert session['summary'].split('\n')[:2] == ['Student: Question 0?', 'Tutor: Answer 0.']
+    assert 'Question 0?' in messages[0]['content']
+
+    # The window itself is sent verbatim and never duplicated in the summary
+    history = messages[1:-1]
+    assert len(history) == context.CONTEXT_HISTORY_MESSAGES
+    assert history[0]['content'] == f'Question {turns - context.CONTEXT_HISTORY_MESSAGES // 2}?'
+    assert f'Question {turns - context.CONTEXT_HISTORY_MESSAGES // 2}?' not in session['summary']
+
+
+def test_over_budget_window_is_folded_up_to_the_selection(db):
+    session_id = db.TutoringSession.create_session('u1', 'Algebra')
+    for i in range(3):
+        db.TutoringSession.add_turn(session_id, f'Question {i}? ' + 'word ' * 200, f'Answer {i}.')
+    session = db.TutoringSession.get_session(session_id)
+    messages = build_context(session, 'You are a tutor.', 'Next?', token_budget=context.SUMMARY_TOKEN_BUDGET + 300)
+
+    session = db.TutoringSession.get_session(session_id)
+    folded = session['summary_through']
+    assert 0 < folded <= 6
+    assert len(messages) - 2 == 6 - folded
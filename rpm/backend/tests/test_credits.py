@@ -0,0 +1,47 @@
+from datetime import datetime
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from src import queries
+from src.indexes import ensure_indexes
+
+
+@pytest.fixture
+def credits(db):
+    ensure_indexes()  # The unique (user_id, day) index turns an over-limit upsert into DuplicateKeyError
+    return db.Credits
+
+
+def test_reserve_holds_credits_until_the_limit(db, credits):
+    limit = db.config.DAILY_CREDIT_LIMIT
+    first = credits.reserve_credits('u', limit - 10)
+    assert first['remaining_credits'] == 10
+    assert credits.reserve_credits('u', 11) is None
+    assert credits.reserve_credits('u', 10)['remaining_credits'] == 0
+    assert credits.reserve_credits('u', limit + 1) is None
+
+
+def test_commit_settles_against_real_usage(db, credits):
+    limit = db.config.DAILY_CREDIT_LIMIT
+    reservation = credits.reserve_credits('u', 50, topic='Algebra')
+    settlement = credits.commit_credits(reservation, 0, charged=20)
+    assert settlement == {'credits_charged': 20, 'remaining_credits': limit - 20}
+    assert credits.get_credit_status('u')['used_today'] == 20
+
+
+def test_refund_releases_a_reservation(db, credits):
+    reservation = credits.reserve_credits('u', 50)
+    credits.refund_credits(reservation)
+    assert credits.get_credit_status('u')['used_today'] == 0
+
+
+def test_reserve_retries_without_upsert_after_duplicate_key():
+    steps = queries.reserve_steps('u', 10, datetime(2024, 1, 1), 'Algebra', 100)
+    _, _, _, first = next(steps)
+    assert first['upsert'] is True
+    _, _, _, retry = steps.throw(DuplicateKeyError('bucket exists'))
+    assert 'upsert' not in retry
+    with pytest.raises(StopIteration) as done:
+        steps.send({'credits': 40})
+    assert done.value.value['remaining_credits'] == 60
@@ -0,0 +1,53 @@
+import random
+
+import pytest
+
+from src.lexical_index import LexicalIndex
+
+WORDS = [f'w{i}' for i in range(300)]
+
+
+def _corpus(rng, docs):
+    # Zipf-ish term frequencies, so some query terms are common and some rare
+    weights = [1 / (rank + 1) for rank in range(len(WORDS))]
+    return [' '.join(rng.choices(WORDS, weights, k=rng.randint(5, 80))) for _ in range(docs)]
+
+
+def _scores(hits):
+    return [round(score, 4) for _, _, score in hits]
+
+
+@pytest.fixture
+def index():
+    rng = random.Random(7)
+    index = LexicalIndex()
+    for upload in range(4):
+        index.add(f'upload-{upload}', 0, _corpus(rng, 500))
+    return index
+
+
+def test_maxscore_matches_exhaustive_scoring(index):
+    rng = random.Random(11)
+    for _ in range(50):
+        query = ' '.join(rng.sample(WORDS[:60], rng.randint(1, 6)))
+        for k in (1, 4, 20):
+            assert _scores(index.search(query, k)) == _scores(index.search(query, k, exhaustive=True))
+
+
+def test_maxscore_skips_removed_uploads(index):
+    index.remove_upload('upload-1')
+    rng = random.Random(13)
+    for _ in range(20):
+        query = ' '.join(rng.sample(WORDS[:60], 3))
+        hits = index.search(query, 10)
+        assert _scores(hits) == _scores(index.search(query, 10, exhaustive=True))
+        assert all(upload_id != 'upload-1' for upload_id, _, _ in hits)
+
+
+def test_hits_are_best_first_with_chunk_refs():
+    index = LexicalIndex()
+    index.add('a', 0, ['the cat sat', 'cat cat cat', 'a dog barked'])
+    hits = index.search('cat', 5)
+    assert [(upload_id, seq) for upload_id, seq, _ in hits] == [('a', 1), ('a', 0)]
+    assert hits[0][2] > hits[1][2]
+    assert index.search('unicorn') == []
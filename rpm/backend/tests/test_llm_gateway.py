@@ -0,0 +1,87 @@
+import threading
+
+import pytest
+
+from src.llm_gateway import GatewayOverloaded, LLMGateway
+
+
+class BlockingClient:
+    """Fake upstream whose calls wait until released"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Semaphore(0)
+
+    def chat_completion(self, messages, deadline=None, **params):
+        self.started.release()
+        self.release.wait(5)
+        return {'content': 'ok', 'tokens_used': 3, 'prompt_tokens': 1}
+
+    def stream_chat_completion(self, messages, deadline=None, **params):
+        yield {'type': 'delta', 'content': 'ok'}
+        yield {'type': 'done', 'tokens_used': 3, 'prompt_tokens': 1}
+
+
+def _call_in_thread(gateway, results):
+    def run():
+        try:
+            results.append(gateway.chat_completion([]))
+        except GatewayOverloaded as e:
+            results.append(e)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_rejects_when_slots_and_queue_are_full():
+    client = BlockingClient()
+    gateway = LLMGateway(client, max_in_flight=1, max_queue=0, queue_timeout=5)
+    results = []
+    thread = _call_in_thread(gateway, results)
+    assert client.started.acquire(timeout=5)
+    with pytest.raises(GatewayOverloaded):
+        gateway.chat_completion([])
+    client.release.set()
+    thread.join(5)
+    metrics = gateway.metrics()
+    assert (metrics['in_flight'], metrics['calls'], metrics['rejected']) == (0, 1, 1)
+
+
+def test_queued_call_times_out():
+    client = BlockingClient()
+    gateway = LLMGateway(client, max_in_flight=1, max_queue=1, queue_timeout=0.05)
+    results = []
+    thread = _call_in_thread(gateway, results)
+    assert client.started.acquire(timeout=5)
+    with pytest.raises(GatewayOverloaded):
+        gateway.chat_completion([])
+    client.release.set()
+    thread.join(5)
+    assert gateway.metrics()['queue_timeouts'] == 1
+    assert gateway.metrics()['queue_depth'] == 0
+
+
+def test_stream_holds_its_slot_until_closed():
+    client = BlockingClient()
+    client.release.set()
+    gateway = LLMGateway(client, max_in_flight=1, max_queue=0, queue_timeout=5)
+    stream = gateway.stream_chat_completion([])
+    assert gateway.metrics()['in_flight'] == 1
+    with pytest.raises(GatewayOverloaded):
+        gateway.chat_completion([])
+    assert [event['type'] for event in stream] == ['delta', 'done']
+    stream.close()
+    assert gateway.metrics()['in_flight'] == 0
+    assert gateway.chat_completion([])['content'] == 'ok'
+
+
+def test_failed_call_frees_its_slot():
+    class FailingClient:
+        def chat_completion(self, messages, deadline=None, **params):
+            raise RuntimeError('upstream broke')
+
+    gateway = LLMGateway(FailingClient(), max_in_flight=1, max_queue=0)
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            gateway.chat_completion([])
+    assert gateway.metrics()['in_flight'] == 0
@@ -0,0 +1,59 @@
+from datetime import datetime
+
+from src import queries
+
+NOW = datetime(2024, 1, 1)
+
+
+def _bucket(messages):
+    return {'messages': [{'seq': seq, 'content': f'm{seq}'} for seq in messages]}
+
+
+def test_bucket_writes_split_at_bucket_boundaries():
+    messages = [{'role': 'user', 'content': str(i)} for i in range(5)]
+    writes = queries.message_bucket_writes('s', 8, messages, 10, NOW)
+    assert [query for query, _ in writes] == [{'session_id': 's', 'bucket': 0}, {'session_id': 's', 'bucket': 1}]
+    first, second = (update for _, update in writes)
+    assert [m['seq'] for m in first['$push']['messages']['$each']] == [8, 9]
+    assert [m['seq'] for m in second['$push']['messages']['$each']] == [10, 11, 12]
+    assert (second['$inc']['count'], second['$min']['seq_start'], second['$max']['seq_end']) == (3, 10, 12)
+
+
+def test_message_page_filter():
+    assert queries.message_page('s', None, 10) == {'session_id': 's'}
+    assert queries.message_page('s', 10, 10) == {'session_id': 's', 'bucket': {'$lte': 0}}
+    assert queries.message_page('s', 11, 10) == {'session_id': 's', 'bucket': {'$lte': 1}}
+    assert queries.message_page('s', 0, 10) is None
+
+
+def test_message_page_collects_latest_across_buckets():
+    page = queries.MessagePage(4, before=13)
+    for bucket in (_bucket(range(10, 15)), _bucket(range(0, 10))):
+        page.add(bucket)
+        if page.full:
+            break
+    result = page.result()
+    assert [m['seq'] for m in result['messages']] == [9, 10, 11, 12]
+    assert result['next_cursor'] == 9
+
+
+def test_message_page_ends_at_first_message():
+    page = queries.MessagePage(10)
+    page.add(_bucket(range(3)))
+    assert page.result() == {'messages': _bucket(range(3))['messages'], 'next_cursor': None}
+
+
+def test_pages_walk_back_through_every_message(db):
+    session_id = db.TutoringSession.create_session('u', 'Algebra')
+    for turn in range(60):
+        db.TutoringSession.add_turn(session_id, f'q{turn}', f'a{turn}', tokens_used=3)
+    assert db.TutoringSession.get_session(session_id)['message_count'] == 120
+
+    seqs, before = [], None
+    while True:
+        page = db.TutoringSession.get_messages(session_id, 25, before)
+        seqs = [m['seq'] for m in page['messages']] + seqs
+        before = page['next_cursor']
+        if before is None:
+            break
+    assert seqs == list(range(120))
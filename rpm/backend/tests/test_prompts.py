@@ -0,0 +1,47 @@
+import os
+
+from src import prompts
+from src.prompts import PromptRegistry
+
+
+def _write(path, text, mtime):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_changed_file_replaces_compiled_and_rendered_prompt(tmp_path):
+    path = tmp_path / 'tutor.txt'
+    _write(path, 'Version one', 1_000_000_000)
+    registry = PromptRegistry(str(tmp_path), reload_interval=0)
+
+    first = registry.get('tutor')
+    assert registry.render('tutor', topic_name='Algebra') == 'Version one'
+    assert registry.get('tutor') is first
+
+    # Same size, new mtime: only the stat tells the versions apart
+    _write(path, 'Version two', 2_000_000_000)
+    assert registry.get('tutor') is not first
+    assert registry.render('tutor', topic_name='Algebra') == 'Version two'
+
+
+def test_reload_waits_for_the_interval(tmp_path):
+    path = tmp_path / 'tutor.txt'
+    _write(path, 'Version one', 1_000_000_000)
+    registry = PromptRegistry(str(tmp_path), reload_interval=3600)
+    assert registry.render('tutor') == 'Version one'
+    _write(path, 'Version two', 2_000_000_000)
+    assert registry.render('tutor') == 'Version one'
+
+
+def test_templates_outside_the_directory_are_reloaded_too(tmp_path, monkeypatch):
+    texts = {'tutor': 'Builtin one'}
+    monkeypatch.setattr(prompts, 'load_prompt_template', lambda name: texts[name])
+    registry = PromptRegistry(str(tmp_path / 'missing'), reload_interval=0)
+
+    first = registry.get('tutor')
+    assert registry.render('tutor') == 'Builtin one'
+    assert registry.get('tutor') is first
+
+    texts['tutor'] = 'Builtin two'
+    assert registry.render('tutor') == 'Builtin two'
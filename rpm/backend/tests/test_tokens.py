@@ -0,0 +1,38 @@
+from src.tokens import TokenEstimator
+
+
+def _estimator():
+    return TokenEstimator(tokenizer_path=None, cache_size=16)
+
+
+def test_counts_grow_with_text():
+    estimator = _estimator()
+    assert estimator.count('') == 0
+    short = estimator.count('What is a derivative?')
+    assert 0 < short < estimator.count('What is a derivative? ' * 10)
+
+
+def test_truncate_stays_within_budget():
+    estimator = _estimator()
+    text = 'Integration by parts moves the derivative from one factor to the other. ' * 20
+    for budget in (1, 10, 50):
+        cut = estimator.truncate(text, budget)
+        assert text.startswith(cut)
+        assert estimator.count(cut) <= budget
+    assert estimator.truncate('short', 100) == 'short'
+
+
+def test_observe_moves_scale_toward_billed_tokens():
+    estimator = _estimator()
+    messages = [{'role': 'user', 'content': 'Explain limits. ' * 30}]
+    estimate = estimator.count_messages(messages)
+    for _ in range(200):
+        estimator.observe(estimator.count_messages(messages), int(estimate * 1.5))
+    assert 1.45 < estimator.scale < 1.55
+    assert estimator.stats()['observations'] == 200
+
+
+def test_observe_clamps_outliers():
+    estimator = _estimator()
+    estimator.observe(100, 100000)
+    assert estimator.scale <= 1.0 + (2.0 - 1.0) * 0.05 + 1e-9
@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+
+def test_archive_folds_old_buckets_into_the_account(db):
+    db.Credits.create_credit_account('u')
+    today = db.Usage.today()
+    for days_ago, credits in ((50, 10), (40, 20), (1, 5), (0, 7)):
+        db.Usage.record('u', today - timedelta(days=days_ago), credits=credits)
+    before = db.Credits.get_credit_status('u')
+
+    assert db.Usage.archive(retention_days=30) == 1
+    account = db.credits_collection.find_one({'user_id': 'u'})
+    assert account['total_credits_used'] == 30
+    assert account['archived_through'] == today - timedelta(days=40)
+    assert db.usage_collection.count_documents({'user_id': 'u'}) == 2
+    assert db.Credits.get_credit_status('u') == before
+
+    # A second run finds nothing new to fold
+    db.Usage.archive(retention_days=30)
+    assert db.credits_collection.find_one({'user_id': 'u'})['total_credits_used'] == 30
+
+
+def test_fold_skips_buckets_already_folded(db):
+    # A run that died after folding but before deleting leaves its buckets behind
+    db.Credits.create_credit_account('u')
+    day = db.Usage.today() - timedelta(days=60)
+    db.Usage.record('u', day, credits=10)
+    db.credits_collection.update_one({'user_id': 'u'}, {'$set': {'archived_through': day, 'total_credits_used': 10}})
+
+    db.Usage.archive(retention_days=30)
+    assert db.credits_collection.find_one({'user_id': 'u'})['total_credits_used'] == 10
+    assert db.usage_collection.count_documents({'user_id': 'u'}) == 0
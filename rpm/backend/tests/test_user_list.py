@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+START = datetime(2024, 1, 1)
+
+
+def _insert_users(db, n):
+    # Pairs share a created_at, so pages must break ties on _id
+    users = [
+        {'_id': ObjectId(), 'email': f'user{i}@example.com', 'created_at': START + timedelta(minutes=i // 2),
+         'is_whitelisted': i % 3 == 0, 'is_admin': False}
+        for i in range(n)
+    ]
+    db.users_collection.insert_many(users)
+    return users
+
+
+def _ids(page):
+    return [user['_id'] for user in page['users']]
+
+
+def test_cursors_round_trip(db):
+    user = {'_id': ObjectId(), 'created_at': START}
+    assert db.decode_cursor(db.encode_cursor(user, 'prev')) == (START, user['_id'], 'prev')
+    assert db.decode_cursor('not a cursor') is None
+
+
+def test_list_users_keyset_pages_cover_every_user_once(db):
+    users = _insert_users(db, 23)
+    expected = [str(user['_id']) for user in sorted(users, key=lambda u: (u['created_at'], u['_id']), reverse=True)]
+
+    pages = [db.User.list_users(limit=5)]
+    while pages[-1]['pagination']['next_cursor']:
+        pages.append(db.User.list_users(limit=5, cursor=pages[-1]['pagination']['next_cursor']))
+    assert [user_id for page in pages for user_id in _ids(page)] == expected
+
+    # Walking back from the last page returns the same pages
+    back = db.User.list_users(limit=5, cursor=pages[-1]['pagination']['prev_cursor'])
+    assert _ids(back) == _ids(pages[-2])
+
+
+def test_list_users_filters(db):
+    users = _insert_users(db, 12)
+    whitelisted = db.User.list_users(limit=50, filter_type='whitelisted')
+    assert sorted(_ids(whitelisted)) == sorted(str(u['_id']) for u in users if u['is_whitelisted'])
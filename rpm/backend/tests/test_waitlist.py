@@ -0,0 +1,91 @@
+import threading
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from src.waitlist import WaitlistRank
+
+START = datetime(2024, 1, 1)
+
+
+def _users(n):
+    return [(START + timedelta(seconds=i), ObjectId()) for i in range(n)]
+
+
+def _rank(users):
+    rank = WaitlistRank(lambda: iter(list(users)), refresh_interval=3600)
+    rank.refresh()
+    return rank
+
+
+def test_positions_follow_signup_order():
+    users = _users(20)
+    rank = _rank(users)
+    assert [rank.position(object_id, created_at) for created_at, object_id in users] == list(range(1, 21))
+
+
+def test_leave_moves_everyone_behind_up():
+    users = _users(10)
+    rank = _rank(users)
+    rank.leave(users[2][1], users[2][0])
+    rank.leave(users[5][1])  # Without created_at the slot is found by scanning
+    assert rank.position(users[2][1], users[2][0]) is None
+    assert rank.position(users[9][1], users[9][0]) == 8
+    assert rank.position(users[3][1], users[3][0]) == 3
+    assert rank.stats()['waitlisted'] == 8
+
+
+def test_join_appends_and_matches_a_rebuild():
+    users = _users(37)
+    rank = _rank(users[:30])
+    for created_at, object_id in users[30:]:
+        rank.join(object_id, created_at)
+    for created_at, object_id in users[::4]:
+        rank.leave(object_id, created_at)
+    remaining = [user for i, user in enumerate(users) if i % 4]
+    rebuilt = _rank(remaining)
+    for created_at, object_id in remaining:
+        assert rank.position(object_id, created_at) == rebuilt.position(object_id, created_at)
+
+
+def test_out_of_order_join_marks_snapshot_stale():
+    users = _users(5)
+    rank = _rank(users[1:])
+    rank.join(users[0][1], users[0][0])
+    assert rank.position(users[0][1], users[0][0]) is None
+    assert rank._built_at == 0
+
+
+def test_changes_during_a_rebuild_are_replayed():
+    users = _users(10)
+    current = list(users[:8])
+    loading, resume = threading.Event(), threading.Event()
+
+    def loader():
+        # The rebuild reads the database as it was before the changes below
+        snapshot = list(current)
+        loading.set()
+        resume.wait(5)
+        return iter(snapshot)
+
+    rank = WaitlistRank(lambda: iter(list(current)), refresh_interval=3600)
+    rank.refresh()
+    rank.loader = loader
+    thread = threading.Thread(target=rank.refresh)
+    thread.start()
+    loading.wait(5)
+
+    for created_at, object_id in users[8:]:
+        current.append((created_at, object_id))
+        rank.join(object_id, created_at)
+    rank.leave(users[0][1], users[0][0])
+    resume.set()
+    thread.join(5)
+
+    assert rank.position(users[0][1], users[0][0]) is None
+    assert rank.position(users[9][1], users[9][0]) == 9
+    assert rank.stats()['slots'] == 10
+    # A replayed join the loader had already seen is not added twice
+    rank.refresh()
+    rank.join(users[9][1], users[9][0])
+    assert rank.stats()['slots'] == 10